@@ -6,36 +6,22 @@ from typing import Any
 
 from celery import shared_task
 from django.conf import settings
-import gitlab
-from opensearch_dsl import Date, Document, connections
 from opensearchpy import ConnectionTimeout
+from redis.exceptions import RedisError
 from requests.exceptions import ReadTimeout
 from urllib3.exceptions import ReadTimeoutError
 
 from analytics import setup_gitlab_job_sentry_tags
-from analytics.job_processor.utils import get_job_retry_data
-
-
-class JobLog(Document):
-    timestamp = Date()
-
-    class Index:
-        name = "gitlab-job-logs-*"
-
-    def save(self, **kwargs):
-        # assign now if no timestamp given
-        if not self.timestamp:
-            self.timestamp = datetime.utcnow()
-
-        # override the index to go to the proper timeslot
-        kwargs["index"] = self.timestamp.strftime("gitlab-job-logs-%Y%m%d")
-        return super().save(**kwargs)
+from analytics.core.job_log_uploader.indexer import get_log_indexer
+from analytics.core.job_log_uploader.windows import build_error_window_document
+from analytics.job_processor.traces import get_job_trace
+from analytics.job_processor.utils import get_gitlab_handle, get_job_retry_data
 
 
 @shared_task(
     name="store_job_data",
     soft_time_limit=60,
-    autoretry_for=(ReadTimeoutError, ConnectionTimeout, ReadTimeout),
+    autoretry_for=(ReadTimeoutError, ConnectionTimeout, ReadTimeout, RedisError),
     retry_backoff=30,
     retry_backoff_max=3600,
     max_retries=10,
@@ -45,17 +31,11 @@ def store_job_data(job_input_data_json: str) -> None:
     job_input_data: dict[str, Any] = json.loads(job_input_data_json)
     setup_gitlab_job_sentry_tags(job_input_data)
 
-    gl = gitlab.Gitlab(
-        settings.GITLAB_ENDPOINT,
-        settings.GITLAB_TOKEN,
-        retry_transient_errors=True,
-        timeout=15,
-    )
-
-    # Retrieve project and job from gitlab API
-    project = gl.projects.get(job_input_data["project_id"])
-    job = project.jobs.get(job_input_data["build_id"])
-    job_trace: str = job.trace().decode()
+    # Only the trace is needed, so the project and job don't need to be fetched
+    gl = get_gitlab_handle()
+    project = gl.projects.get(job_input_data["project_id"], lazy=True)
+    job = project.jobs.get(job_input_data["build_id"], lazy=True)
+    job_trace = get_job_trace(job)
 
     retry_info = get_job_retry_data(
         job_id=job_input_data["build_id"],
@@ -69,17 +49,29 @@ def store_job_data(job_input_data_json: str) -> None:
     # TODO: this still leaves trailing ;m in the output
     job_trace = re.sub(r"\x1b\[([0-9,A-Z]{1,2}(;[0-9]{1,2})?(;[0-9]{3})?)?[m|G|K]?", "", job_trace)
 
-    connections.create_connection(
-        hosts=[settings.OPENSEARCH_ENDPOINT],
-        http_auth=(
-            settings.OPENSEARCH_USERNAME,
-            settings.OPENSEARCH_PASSWORD,
-        ),
-    )
+    # In error window mode, only the relevant parts of the trace are indexed
+    if settings.JOB_LOG_INDEX_MODE == "error-window":
+        trace_fields = build_error_window_document(job_input_data, job_trace)
+    else:
+        trace_fields = {"job_trace": job_trace}
 
-    doc = JobLog(
-        **job_input_data,
-        job_url=f'{job_input_data["project"]["web_url"]}/-/jobs/{job_input_data["build_id"]}',
-        job_trace=job_trace,
+    # The document is buffered before the task returns (and is acknowledged), and sent in bulk
+    timestamp = datetime.utcnow()
+    job_id = job_input_data["build_id"]
+    buffer_full = get_log_indexer().add(
+        doc_id=str(job_id),
+        doc={
+            **job_input_data,
+            **trace_fields,
+            "timestamp": timestamp.isoformat(),
+            "job_url": f'{job_input_data["project"]["web_url"]}/-/jobs/{job_id}',
+        },
+        timestamp=timestamp,
     )
-    doc.save()
+    if buffer_full:
+        flush_job_logs.delay()
+
+
+@shared_task(name="flush_job_logs")
+def flush_job_logs() -> None:
+    get_log_indexer().flush()
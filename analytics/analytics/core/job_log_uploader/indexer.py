@@ -0,0 +1,234 @@
+"""
+Buffered, bulk indexing of job log documents into OpenSearch.
+
+Tasks hand their documents off to a redis list (on the celery broker), and are acknowledged once the
+documents are stored there, so that they aren't lost if a worker dies. The `flush_job_logs` task
+then sends the buffered documents with the bulk API, in requests of a bounded size, and only removes
+them from the list once they've been indexed (or rejected). It's run periodically by celery beat,
+and whenever the buffer fills up.
+"""
+
+from datetime import datetime
+from functools import cache
+import json
+import logging
+import time
+from typing import Any
+
+from django.conf import settings
+from opensearchpy import OpenSearch
+from opensearchpy.exceptions import ConnectionError, ConnectionTimeout, TransportError
+import redis
+
+from analytics.core.metrics import get_redis
+
+logger = logging.getLogger(__name__)
+
+# The redis list documents are buffered in, the total size of the buffered documents, and the lock
+# held while flushing them
+BUFFER_KEY = "analytics:job-logs:buffer"
+BUFFER_BYTES_KEY = "analytics:job-logs:buffer-bytes"
+FLUSH_LOCK_KEY = "analytics:job-logs:flush"
+
+# Flush once this many bytes of documents are buffered, and send at most this many bytes per request
+BULK_MAX_BYTES = 8 * 1024**2
+
+# The lock is renewed before each request, so this only needs to cover sending one of them
+FLUSH_LOCK_TIMEOUT = 600
+
+# How many buffered documents are read from redis at once, when filling a request
+BUFFER_READ_SIZE = 100
+
+# Traces larger than this are split across several documents, so that no single document makes
+# up an unbounded bulk request
+TRACE_CHUNK_SIZE = 1024**2
+
+# Per document statuses which are worth retrying
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF = 2
+
+
+class BulkIndexError(Exception):
+    """Raised when documents still can't be indexed after retrying them."""
+
+
+def job_log_index_name(timestamp: datetime) -> str:
+    return timestamp.strftime("gitlab-job-logs-%Y%m%d")
+
+
+@cache
+def get_opensearch_client() -> OpenSearch:
+    """Return the OpenSearch client of this process, creating it if necessary."""
+    return OpenSearch(
+        hosts=[settings.OPENSEARCH_ENDPOINT],
+        http_auth=(settings.OPENSEARCH_USERNAME, settings.OPENSEARCH_PASSWORD),
+        http_compress=True,
+        pool_maxsize=4,
+        timeout=60,
+    )
+
+
+def split_job_log(doc_id: str, doc: dict[str, Any]) -> list[tuple[str, dict[str, Any]]]:
+    """
+    Split a job log document into several, if its trace is too large.
+
+    Each chunk document contains all fields of the original document, along with `chunk_index` and
+    `chunk_count`, and a part of the trace.
+    """
+    trace: str = doc.get("job_trace") or ""
+    if len(trace) <= TRACE_CHUNK_SIZE:
+        return [(doc_id, doc)]
+
+    chunks = [trace[i : i + TRACE_CHUNK_SIZE] for i in range(0, len(trace), TRACE_CHUNK_SIZE)]
+    return [
+        (
+            f"{doc_id}-{index}",
+            {**doc, "job_trace": chunk, "chunk_index": index, "chunk_count": len(chunks)},
+        )
+        for index, chunk in enumerate(chunks)
+    ]
+
+
+class BulkLogIndexer:
+    def __init__(
+        self,
+        client: OpenSearch,
+        redis_client: redis.Redis,
+        max_bytes: int = BULK_MAX_BYTES,
+    ) -> None:
+        self.client = client
+        self.redis = redis_client
+        self.max_bytes = max_bytes
+
+    def add(self, doc_id: str, doc: dict[str, Any], timestamp: datetime) -> bool:
+        """
+        Buffer a document, returning whether the buffer has filled up, and should be flushed.
+
+        Each buffered entry is a serialized bulk action and its document. Both are ASCII, since
+        json.dumps escapes everything else, so an entry's length is its size in bytes.
+        """
+        index = job_log_index_name(timestamp)
+        entries = []
+        for chunk_id, chunk in split_job_log(doc_id, doc):
+            action = json.dumps({"index": {"_index": index, "_id": chunk_id}})
+            source = json.dumps(chunk, default=str)
+            entries.append(f"{action}\n{source}\n")
+
+        size = sum(len(entry) for entry in entries)
+        _, buffered_bytes = (
+            self.redis.pipeline()
+            .rpush(BUFFER_KEY, *entries)
+            .incrby(BUFFER_BYTES_KEY, size)
+            .execute()
+        )
+
+        # Only the document which fills the buffer triggers a flush
+        return buffered_bytes - size < self.max_bytes <= buffered_bytes
+
+    def flush(self) -> int:
+        """
+        Send all buffered documents, retrying any that failed with a retryable status, and return
+        the number of documents sent.
+
+        Documents rejected for other reasons are logged and dropped. If any documents still fail
+        after retrying, they're moved to the end of the buffer and `BulkIndexError` is raised. Only
+        one process flushes the buffer at a time, so this returns immediately if another one is.
+        """
+        lock = self.redis.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            return 0
+
+        sent = 0
+        try:
+            while batch := self._read_batch():
+                lock.reacquire()
+                self._flush_batch(batch)
+                sent += len(batch)
+        finally:
+            lock.release()
+
+        return sent
+
+    def _read_batch(self) -> list[str]:
+        """Read documents from the start of the buffer, up to the size of a request."""
+        batch: list[str] = []
+        size = 0
+        while size < self.max_bytes:
+            entries = self.redis.lrange(BUFFER_KEY, len(batch), len(batch) + BUFFER_READ_SIZE - 1)
+            if not entries:
+                break
+
+            for entry in entries:
+                batch.append(entry.decode())
+                size += len(entry)
+                if size >= self.max_bytes:
+                    break
+
+        return batch
+
+    def _flush_batch(self, batch: list[str]) -> None:
+        """Send a batch read from the start of the buffer, then remove it from the buffer."""
+        pending = batch
+        for attempt in range(MAX_RETRIES + 1):
+            if not pending:
+                break
+
+            if attempt:
+                time.sleep(RETRY_BACKOFF**attempt)
+
+            pending = self._send(pending)
+
+        # Documents which still failed are put back at the end, so that they don't hold up others
+        pipeline = self.redis.pipeline()
+        pipeline.ltrim(BUFFER_KEY, len(batch), -1)
+        if pending:
+            pipeline.rpush(BUFFER_KEY, *pending)
+        pipeline.decrby(
+            BUFFER_BYTES_KEY,
+            sum(len(entry) for entry in batch) - sum(len(entry) for entry in pending),
+        )
+        pipeline.execute()
+
+        if pending:
+            raise BulkIndexError(
+                f"Failed to index {len(pending)} job log documents after {MAX_RETRIES} retries"
+            )
+
+    def _send(self, entries: list[str]) -> list[str]:
+        """Send a bulk request, and return the entries which should be retried."""
+        body = "".join(entries)
+        try:
+            response = self.client.bulk(body=body)
+        except (ConnectionError, ConnectionTimeout):
+            logger.warning("Bulk request of %s job log documents failed", len(entries))
+            return entries
+        except TransportError as e:
+            if e.status_code in RETRYABLE_STATUSES:
+                return entries
+
+            # The request itself was rejected, so retrying it would fail again
+            logger.error("Bulk request of %s job log documents rejected: %s", len(entries), e)
+            return []
+
+        if not response["errors"]:
+            return []
+
+        retry = []
+        for entry, item in zip(entries, response["items"]):
+            result = item["index"]
+            if result["status"] < 300:
+                continue
+
+            if result["status"] in RETRYABLE_STATUSES:
+                retry.append(entry)
+            else:
+                logger.error("Failed to index job log %s: %s", result["_id"], result.get("error"))
+
+        return retry
+
+
+@cache
+def get_log_indexer() -> BulkLogIndexer:
+    """Return the log indexer of this process, creating it if necessary."""
+    return BulkLogIndexer(get_opensearch_client(), get_redis())
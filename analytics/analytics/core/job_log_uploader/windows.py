@@ -0,0 +1,76 @@
+"""
+Reduce a job trace to the parts of it that are worth indexing.
+
+Instead of the entire trace, error window documents contain the lines surrounding each match of
+the error taxonomy (for failed jobs), the end of the trace, and the gitlab section timers, along
+with a pointer to the full trace in object storage.
+"""
+
+from typing import Any
+
+from django.conf import settings
+
+from analytics.job_processor.dimensions import get_gitlab_section_timers
+from analytics.job_processor.taxonomy import load_error_taxonomy
+from analytics.job_processor.traces import get_archived_trace
+
+# The number of lines to include before and after each taxonomy match
+ERROR_WINDOW_CONTEXT_LINES = 10
+
+# The number of lines to include from the end of the trace
+TAIL_LINES = 50
+
+
+def get_error_windows(
+    job_trace: str, context_lines: int = ERROR_WINDOW_CONTEXT_LINES
+) -> list[dict]:
+    """Return the merged windows of lines surrounding each error taxonomy match."""
+    lines = job_trace.split("\n")
+    matches = load_error_taxonomy().match_lines(job_trace)
+
+    windows: list[dict] = []
+    for line in sorted(matches):
+        start = max(line - context_lines, 0)
+        end = min(line + context_lines, len(lines) - 1)
+
+        # Merge overlapping or adjacent windows
+        if windows and start <= windows[-1]["end_line"] + 1:
+            windows[-1]["end_line"] = max(windows[-1]["end_line"], end)
+            windows[-1]["error_classes"] |= matches[line]
+            continue
+
+        windows.append({"start_line": start, "end_line": end, "error_classes": set(matches[line])})
+
+    for window in windows:
+        window["error_classes"] = sorted(window["error_classes"])
+        window["text"] = "\n".join(lines[window["start_line"] : window["end_line"] + 1])
+
+    return windows
+
+
+def get_trace_location(job_id: int) -> str | None:
+    """Return the URL of the archived trace of a job in object storage, if there is one."""
+    if settings.GITLAB_ARTIFACTS_BUCKET is None:
+        return None
+
+    archived_trace = get_archived_trace(job_id)
+    if archived_trace is None:
+        return None
+
+    return f"s3://{settings.GITLAB_ARTIFACTS_BUCKET}/{archived_trace.object_key}"
+
+
+def build_error_window_document(job_input_data: dict[str, Any], job_trace: str) -> dict[str, Any]:
+    """Return the fields of the error window document of a job, in place of `job_trace`."""
+    lines = job_trace.split("\n")
+    failed = job_input_data["build_status"] == "failed"
+
+    return {
+        "index_mode": "error-window",
+        "error_windows": get_error_windows(job_trace) if failed else [],
+        "trace_tail": "\n".join(lines[-TAIL_LINES:]),
+        "trace_line_count": len(lines),
+        "trace_size": len(job_trace),
+        "section_timers": get_gitlab_section_timers(job_trace),
+        "trace_location": get_trace_location(job_input_data["build_id"]),
+    }
@@ -1,13 +1,15 @@
-import json
 from datetime import datetime, timezone
 from itertools import batched
 
 import djclick as click
+from django.conf import settings
 from django.db import connections
 from tqdm import tqdm
 
 from analytics.core.models.facts import JobFact
-from analytics.job_processor import process_job
+from analytics.job_processor import process_job_data
+from analytics.job_processor.prometheus import PrometheusClient
+from analytics.job_processor.prometheus_bulk import BulkPrometheusExtractor
 
 WEBHOOK_QUERY = """
 SELECT
@@ -208,7 +210,13 @@ def dict_fetchall(cursor):
 @click.option(
     "--dry-run", "dry_run", is_flag=True, help="Don't actually process the jobs"
 )
-def backfill_jobs(start: datetime, end: datetime, dry_run: bool) -> None:
+@click.option(
+    "--bulk-prometheus",
+    "bulk_prometheus",
+    is_flag=True,
+    help="Retrieve the prometheus data of each batch of jobs at once, instead of per job",
+)
+def backfill_jobs(start: datetime, end: datetime, dry_run: bool, bulk_prometheus: bool) -> None:
     # Ensure in UTC timezone
     start = start.astimezone(timezone.utc)
     end = end.astimezone(timezone.utc)
@@ -245,6 +253,7 @@ def backfill_jobs(start: datetime, end: datetime, dry_run: bool) -> None:
             results = dict_fetchall(cursor)
 
             # Process each result
+            job_windows = {}
             for result in results:
                 # If the "build_started_at" field is None, set it to the created_at value. This seems
                 # to occurs when a job was queued for too long and marked as "failed", before it ever
@@ -255,6 +264,11 @@ def backfill_jobs(start: datetime, end: datetime, dry_run: bool) -> None:
                 if result.get("build_started_at") is None:
                     result["build_started_at"] = result["build_created_at"]
 
+                job_windows[result["build_id"]] = (
+                    result["build_started_at"],
+                    result["build_finished_at"],
+                )
+
                 pbar.set_description(
                     f"Processing records for {result['build_started_at'].replace(second=0, microsecond=0)}"
                 )
@@ -287,8 +301,14 @@ def backfill_jobs(start: datetime, end: datetime, dry_run: bool) -> None:
                 pbar.update(len(results))
                 continue
 
+            job_infos = {}
+            if bulk_prometheus:
+                pbar.set_description("Retrieving prometheus data")
+                extractor = BulkPrometheusExtractor(PrometheusClient(settings.PROMETHEUS_URL))
+                job_infos = extractor.extract(job_windows)
+
             for webhook_dict in results:
-                process_job(json.dumps(webhook_dict))
+                process_job_data(webhook_dict, job_info=job_infos.get(webhook_dict["build_id"]))
                 pbar.update(1)
 
     click.echo(f"Total records processed: {len(build_ids)}")
@@ -0,0 +1,101 @@
+import time
+
+from django.db import connection, transaction
+import djclick as click
+
+from analytics.core.models.facts import TimerFact, TimerPhaseFact
+
+# Synthetic data is generated server side, so that the insert timings aren't dominated by the
+# transfer of rows. Each table is created from the definition of the real table (with its indexes),
+# but as a temporary table, so that it starts out empty and nothing is left behind.
+CREATE_TABLES_SQL = f"""
+CREATE TEMPORARY TABLE bench_phase_rows
+    (LIKE {TimerPhaseFact._meta.db_table} INCLUDING DEFAULTS INCLUDING INDEXES) ON COMMIT DROP;
+CREATE TEMPORARY TABLE bench_phase_packed
+    (LIKE {TimerFact._meta.db_table} INCLUDING DEFAULTS INCLUDING INDEXES) ON COMMIT DROP;
+"""
+
+INSERT_ROWS_SQL = """
+INSERT INTO bench_phase_rows (
+    id, job_id, date_id, time_id, timer_data_id, package_id, spec_id, phase_id,
+    duration, ratio_of_total
+)
+SELECT
+    row_number() OVER (),
+    job, '20250101', '000000', 1, timer, timer, phase,
+    phase * 1.5, phase * 1.5 / 100
+FROM generate_series(1, %(jobs)s) job,
+    generate_series(1, %(timers)s) timer,
+    generate_series(1, %(phases)s) phase
+"""
+
+INSERT_PACKED_SQL = """
+INSERT INTO bench_phase_packed (
+    id, job_id, date_id, time_id, timer_data_id, package_id, spec_id, total_duration,
+    phase_ids, phase_durations
+)
+SELECT
+    row_number() OVER (),
+    job, '20250101', '000000', 1, timer, timer, 100,
+    (SELECT array_agg(phase ORDER BY phase) FROM generate_series(1, %(phases)s) phase),
+    (SELECT array_agg(phase * 1.5 ORDER BY phase) FROM generate_series(1, %(phases)s) phase)
+FROM generate_series(1, %(jobs)s) job,
+    generate_series(1, %(timers)s) timer
+"""
+
+# The average duration of each phase, which is what most dashboards are built on
+AGGREGATE_ROWS_SQL = """
+SELECT phase_id, AVG(duration)
+FROM bench_phase_rows
+GROUP BY phase_id
+"""
+
+AGGREGATE_PACKED_SQL = """
+SELECT phase.phase_id, AVG(phase.duration)
+FROM bench_phase_packed
+CROSS JOIN LATERAL unnest(phase_ids, phase_durations) AS phase(phase_id, duration)
+GROUP BY phase.phase_id
+"""
+
+
+def timed(cursor, sql: str, params: dict | None = None) -> float:
+    start = time.perf_counter()
+    cursor.execute(sql, params)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--jobs", type=int, default=1000, show_default=True, help="Number of jobs")
+@click.option("--timers", type=int, default=50, show_default=True, help="Timers per job")
+@click.option("--phases", type=int, default=10, show_default=True, help="Phases per timer")
+@click.option(
+    "--repeat", type=int, default=5, show_default=True, help="Runs of each aggregate query"
+)
+def benchmark_timer_phase_storage(jobs: int, timers: int, phases: int, repeat: int) -> None:
+    """Compare the size and speed of row based and packed timer phase storage."""
+    params = {"jobs": jobs, "timers": timers, "phases": phases}
+    results = {}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLES_SQL)
+
+        for mode, table, insert_sql, aggregate_sql in [
+            ("rows", "bench_phase_rows", INSERT_ROWS_SQL, AGGREGATE_ROWS_SQL),
+            ("packed", "bench_phase_packed", INSERT_PACKED_SQL, AGGREGATE_PACKED_SQL),
+        ]:
+            insert_seconds = timed(cursor, insert_sql, params)
+            cursor.execute(f"ANALYZE {table}")
+            cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+            (size,) = cursor.fetchone()
+            query_seconds = min(timed(cursor, aggregate_sql) for _ in range(repeat))
+            results[mode] = (size, insert_seconds, query_seconds)
+
+        # Don't keep anything around
+        transaction.set_rollback(True)
+
+    click.echo(f"{jobs} jobs x {timers} timers x {phases} phases")
+    click.echo(f"{'mode':<8} {'size (MB)':>12} {'insert (s)':>12} {'aggregate (s)':>14}")
+    for mode, (size, insert_seconds, query_seconds) in results.items():
+        click.echo(
+            f"{mode:<8} {size / 1024**2:>12.1f} {insert_seconds:>12.3f} {query_seconds:>14.3f}"
+        )
@@ -0,0 +1,23 @@
+from datetime import datetime, timezone
+
+import djclick as click
+
+from analytics.job_processor.spot_prices import ingest_spot_prices as _ingest_spot_prices
+
+
+@click.command()
+@click.option(
+    "--start",
+    type=click.DateTime(),
+    help="The start of the range to ingest. Defaults to the latest stored sample.",
+)
+@click.option(
+    "--end", type=click.DateTime(), help="The end of the range to ingest. Defaults to now."
+)
+def ingest_spot_prices(start: datetime | None, end: datetime | None) -> None:
+    """Ingest spot price samples from prometheus, e.g. to backfill a range of time."""
+    samples = _ingest_spot_prices(
+        start=start.astimezone(timezone.utc) if start is not None else None,
+        end=end.astimezone(timezone.utc) if end is not None else None,
+    )
+    click.echo(f"Ingested {samples} spot price samples")
@@ -0,0 +1,62 @@
+import datetime
+
+import djclick as click
+
+from analytics.core.partitions import (
+    PARTITIONED_FACT_TABLES,
+    add_months,
+    create_month_partition,
+    detach_month_partition,
+    list_month_partitions,
+    month_start,
+)
+
+
+@click.command()
+@click.option(
+    "--months-ahead",
+    type=int,
+    default=3,
+    show_default=True,
+    help="The number of months after the current one to create partitions for",
+)
+@click.option(
+    "--retain-months",
+    type=int,
+    default=None,
+    help="If given, detach partitions older than this many months before the current one",
+)
+@click.option(
+    "--archive-schema",
+    default=None,
+    help="Move detached partitions into this schema, instead of leaving them in public",
+)
+@click.option("--dry-run", "dry_run", is_flag=True, help="Only report what would be done")
+def manage_fact_partitions(
+    months_ahead: int, retain_months: int | None, archive_schema: str | None, dry_run: bool
+) -> None:
+    """Create upcoming monthly fact table partitions, and detach old ones."""
+    current_month = month_start(datetime.date.today())
+    upcoming = [add_months(current_month, i) for i in range(months_ahead + 1)]
+    cutoff = add_months(current_month, -retain_months) if retain_months is not None else None
+
+    for model in PARTITIONED_FACT_TABLES:
+        table = model._meta.db_table
+        existing = list_month_partitions(table)
+
+        for month in upcoming:
+            if month in existing:
+                continue
+
+            click.echo(f"Creating partition of {table} for {month:%Y-%m}")
+            if not dry_run:
+                create_month_partition(model, month)
+
+        if cutoff is None:
+            continue
+
+        for month in sorted(m for m in existing if m < cutoff):
+            click.echo(f"Detaching partition of {table} for {month:%Y-%m}")
+            if not dry_run:
+                name = detach_month_partition(model, month, archive_schema=archive_schema)
+                click.echo(f"Detached {name}")
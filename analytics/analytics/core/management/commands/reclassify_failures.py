@@ -0,0 +1,204 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import batched
+import logging
+import multiprocessing
+import os
+
+import django
+import djclick as click
+from gitlab.exceptions import GitlabError
+from tqdm import tqdm
+
+from analytics.core.models.dimensions import DateDimension, JobResultDimension
+from analytics.core.models.facts import JobFact
+from analytics.job_processor.dimensions import _assign_error_taxonomy
+from analytics.job_processor.gitlab_db import PROJECT_IDS, get_gitlab_db
+from analytics.job_processor.rollups import refresh_job_rollups
+from analytics.job_processor.taxonomy import load_error_taxonomy
+from analytics.job_processor.traces import get_job_trace
+from analytics.job_processor.utils import get_gitlab_handle
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+# The fields of a job result dimension which aren't changed by reclassification
+JOB_RESULT_FIELDS = [
+    "status",
+    "unnecessary",
+    "job_type",
+    "gitlab_failure_reason",
+    "job_exit_code",
+]
+
+
+def classify(args: tuple[int, str, str]) -> tuple[int, str | None]:
+    """Classify a single job trace, or return None if that fails. Runs in a worker process."""
+    job_id, failure_reason, job_trace = args
+    job_input_data = {"build_status": "failed", "build_failure_reason": failure_reason}
+    try:
+        error_class, _ = _assign_error_taxonomy(job_input_data, job_trace)
+    except Exception:
+        logger.exception("Failed to classify job %s", job_id)
+        return job_id, None
+
+    return job_id, error_class
+
+
+def get_project_ids(job_ids: list[int]) -> dict[int, int]:
+    return dict(get_gitlab_db().execute(PROJECT_IDS, job_ids))
+
+
+def fetch_trace(job_id: int, project_id: int | None) -> str | None:
+    """Read a job trace through the trace store, so that it's only fetched from gitlab once."""
+    if project_id is None:
+        return None
+
+    project = get_gitlab_handle().projects.get(project_id, lazy=True)
+    try:
+        return get_job_trace(project.jobs.get(job_id, lazy=True))
+    except GitlabError:
+        return None
+    except Exception:
+        # Skip the job, rather than aborting the whole run
+        logger.exception("Failed to read the trace of job %s", job_id)
+        return None
+
+
+class JobResultCache:
+    """Find or create the job result dimension rows that reclassified jobs should point to."""
+
+    def __init__(self, version: str) -> None:
+        self.version = version
+        self._cache: dict[tuple, JobResultDimension] = {}
+
+    def get(self, current: JobResultDimension, error_class: str) -> JobResultDimension:
+        values = {field: getattr(current, field) for field in JOB_RESULT_FIELDS}
+        key = (*values.values(), error_class)
+        if key not in self._cache:
+            self._cache[key], _ = JobResultDimension.objects.get_or_create(
+                **values, error_taxonomy=error_class, error_taxonomy_version=self.version
+            )
+
+        return self._cache[key]
+
+
+@click.command()
+@click.option("--start", type=click.DateTime(), required=True, help="The first day to reclassify")
+@click.option(
+    "--end",
+    type=click.DateTime(),
+    help="The last day to reclassify (inclusive). Defaults to today.",
+    default=datetime.now(),
+)
+@click.option(
+    "--fetch-workers", type=int, default=16, show_default=True, help="Concurrent trace fetches"
+)
+@click.option(
+    "--processes",
+    type=int,
+    default=os.cpu_count(),
+    show_default=True,
+    help="Processes to classify traces with",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Also reclassify jobs already classified with the current taxonomy version",
+)
+@click.option("--dry-run", "dry_run", is_flag=True, help="Only report the changes")
+def reclassify_failures(
+    start: datetime,
+    end: datetime,
+    fetch_workers: int,
+    processes: int,
+    force: bool,
+    dry_run: bool,
+) -> None:
+    """Reclassify failed jobs with the current error taxonomy, updating any that changed."""
+    version = load_error_taxonomy().version
+    start_key = DateDimension.date_key_from_datetime(start.astimezone(timezone.utc))
+    end_key = DateDimension.date_key_from_datetime(end.astimezone(timezone.utc))
+
+    job_facts = JobFact.objects.filter(
+        start_date__gte=start_key,
+        start_date__lte=end_key,
+        job_result__status="failed",
+    ).select_related("job_result")
+    if not force:
+        job_facts = job_facts.exclude(job_result__error_taxonomy_version=version)
+
+    total = job_facts.count()
+    click.echo(f"Reclassifying {total} failed jobs with error taxonomy version {version}")
+
+    job_results = JobResultCache(version)
+    changes: dict[tuple[str | None, str], int] = defaultdict(int)
+    affected_dates: set[str] = set()
+    missing_traces = 0
+    failed = 0
+
+    # The classifying processes are started while the fetching threads are running, which isn't
+    # safe to fork, so they're spawned instead, and set up django before importing this module
+    with (
+        ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool,
+        ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        ) as classify_pool,
+        tqdm(total=total) as pbar,
+    ):
+        job_fact_iter = job_facts.order_by("job_id").iterator(chunk_size=BATCH_SIZE)
+        for batch in batched(job_fact_iter, BATCH_SIZE):
+            facts = {fact.job_id: fact for fact in batch}
+            project_ids = get_project_ids(list(facts))
+            traces = fetch_pool.map(
+                lambda job_id: fetch_trace(job_id, project_ids.get(job_id)), facts
+            )
+
+            classify_args = []
+            for fact, trace in zip(facts.values(), traces):
+                if trace is None:
+                    missing_traces += 1
+                    continue
+
+                classify_args.append((fact.job_id, fact.job_result.gitlab_failure_reason, trace))
+
+            updated = []
+            for job_id, error_class in classify_pool.map(classify, classify_args, chunksize=8):
+                if error_class is None:
+                    failed += 1
+                    continue
+
+                fact = facts[job_id]
+                current = fact.job_result
+                if error_class != current.error_taxonomy:
+                    changes[(current.error_taxonomy, error_class)] += 1
+                    affected_dates.add(fact.start_date_id)
+                elif current.error_taxonomy_version == version:
+                    continue
+
+                # Unchanged classes are still updated, to record the taxonomy version
+                if not dry_run:
+                    fact.job_result = job_results.get(current, error_class)
+                    updated.append(fact)
+
+            JobFact.objects.bulk_update(updated, ["job_result"], batch_size=BATCH_SIZE)
+
+            pbar.update(len(batch))
+
+    for (old_class, new_class), count in sorted(changes.items(), key=lambda item: -item[1]):
+        click.echo(f"{old_class} -> {new_class}: {count}")
+    click.echo(
+        f"{sum(changes.values())} jobs changed class, {missing_traces} traces not found, "
+        f"{failed} jobs failed to classify"
+    )
+
+    if dry_run or not affected_dates:
+        return
+
+    # The daily rollups are keyed by error taxonomy, so recompute the days that changed
+    rows = refresh_job_rollups(sorted(affected_dates))
+    click.echo(f"Recomputed {rows} rollup rows for {len(affected_dates)} days")
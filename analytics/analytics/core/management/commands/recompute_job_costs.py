@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from itertools import batched
+
+import djclick as click
+from tqdm import tqdm
+
+from analytics.core.models.dimensions import DateDimension
+from analytics.core.models.facts import JobFact
+from analytics.job_processor.rollups import refresh_job_rollups
+from analytics.job_processor.spot_prices import get_stored_spot_price
+
+BATCH_SIZE = 500
+
+
+@click.command()
+@click.option("--start", type=click.DateTime(), required=True, help="The first day to recompute")
+@click.option(
+    "--end",
+    type=click.DateTime(),
+    help="The last day to recompute (inclusive). Defaults to today.",
+    default=datetime.now(),
+)
+@click.option("--dry-run", "dry_run", is_flag=True, help="Only report the changes")
+def recompute_job_costs(start: datetime, end: datetime, dry_run: bool) -> None:
+    """Recompute the node price and cost of jobs from the stored spot price history."""
+    start_key = DateDimension.date_key_from_datetime(start.astimezone(timezone.utc))
+    end_key = DateDimension.date_key_from_datetime(end.astimezone(timezone.utc))
+
+    # Only jobs with a known node zone can be matched to a price series
+    job_facts = JobFact.objects.filter(
+        start_date__gte=start_key,
+        start_date__lte=end_key,
+        node_price_per_second__isnull=False,
+        node__zone__isnull=False,
+    ).select_related("node")
+
+    total = job_facts.count()
+    click.echo(f"Recomputing the cost of {total} jobs")
+
+    changed = 0
+    missing_prices = 0
+    affected_dates: set[str] = set()
+    with tqdm(total=total) as pbar:
+        job_fact_iter = job_facts.order_by("job_id").iterator(chunk_size=BATCH_SIZE)
+        for batch in batched(job_fact_iter, BATCH_SIZE):
+            updated = []
+            for fact in batch:
+                price = get_stored_spot_price(
+                    capacity_type=fact.node.capacity_type,
+                    instance_type=fact.node.instance_type,
+                    zone=fact.node.zone,
+                    start=fact.started_at,
+                    end=fact.finished_at,
+                )
+                if price is None:
+                    missing_prices += 1
+                    continue
+
+                price_per_second = price / 3600
+                cost = fact.duration_seconds * fact.pod_node_occupancy * price_per_second
+                if fact.cost is not None and round(float(fact.cost), 8) == round(cost, 8):
+                    continue
+
+                fact.node_price_per_second = price_per_second
+                fact.cost = cost
+                updated.append(fact)
+                affected_dates.add(fact.start_date_id)
+
+            changed += len(updated)
+            if not dry_run:
+                JobFact.objects.bulk_update(
+                    updated, ["node_price_per_second", "cost"], batch_size=BATCH_SIZE
+                )
+
+            pbar.update(len(batch))
+
+    click.echo(f"{changed} job costs changed, {missing_prices} jobs have no stored prices")
+    if dry_run or not affected_dates:
+        return
+
+    # The daily rollups include the total cost, so recompute the days that changed
+    rows = refresh_job_rollups(sorted(affected_dates))
+    click.echo(f"Recomputed {rows} rollup rows for {len(affected_dates)} days")
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+import djclick as click
+
+from analytics.core.models.dimensions import DateDimension
+from analytics.core.models.rollups import JobDailyRollup
+from analytics.job_processor.rollups import (
+    ROLLUP_KEY_FIELDS,
+    ROLLUP_VALUE_FIELDS,
+    compute_job_rollups,
+    refresh_job_rollups,
+)
+
+
+def rollup_rows_by_key(rollups) -> dict[tuple, tuple]:
+    # Sums are rounded, since incrementally summed floats don't exactly match a single SUM
+    return {
+        tuple(getattr(r, field) for field in ROLLUP_KEY_FIELDS): tuple(
+            round(float(getattr(r, field)), 4) for field in ROLLUP_VALUE_FIELDS
+        )
+        for r in rollups
+    }
+
+
+@click.command()
+@click.option("--start", type=click.DateTime(), required=True, help="The first day to reconcile")
+@click.option(
+    "--end",
+    type=click.DateTime(),
+    help="The last day to reconcile (inclusive). Defaults to today.",
+    default=datetime.now(),
+)
+@click.option("--dry-run", "dry_run", is_flag=True, help="Only report the days that have drifted")
+def reconcile_rollups(start: datetime, end: datetime, dry_run: bool) -> None:
+    """Compare the daily rollups against the job facts, and recompute any days that differ."""
+    start_date = start.astimezone(timezone.utc).date()
+    end_date = end.astimezone(timezone.utc).date()
+
+    date_keys = [
+        DateDimension.date_key_from_datetime(start_date + timedelta(days=i))
+        for i in range((end_date - start_date).days + 1)
+    ]
+
+    drifted_keys = []
+    with click.progressbar(date_keys, label="Comparing rollups") as bar:
+        for date_key in bar:
+            expected = rollup_rows_by_key(compute_job_rollups([date_key]))
+            actual = rollup_rows_by_key(JobDailyRollup.objects.filter(date=date_key))
+            if expected != actual:
+                drifted_keys.append(date_key)
+
+    if not drifted_keys:
+        click.echo(f"All rollups between {start_date} and {end_date} are consistent.")
+        return
+
+    click.echo(f"Found {len(drifted_keys)} days with drifted rollups: {', '.join(drifted_keys)}")
+    if dry_run:
+        return
+
+    rows = refresh_job_rollups(drifted_keys)
+    click.echo(f"Recomputed {rows} rollup rows.")
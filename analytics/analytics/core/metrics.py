@@ -0,0 +1,163 @@
+"""
+Ingest lag and backlog metrics, exported in the prometheus format.
+
+The webhook handler and the job processor run in separate processes (and pods), so counters and
+lag histograms are accumulated in redis (the celery broker), and read back when `/metrics` is
+scraped. Queue depth and the number of finished jobs missing a fact are computed at scrape time.
+"""
+
+from datetime import datetime, timedelta
+from functools import cache
+import logging
+
+from celery import current_app
+from django.conf import settings
+from django.utils import timezone
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+)
+import redis
+
+from analytics.core.models.dimensions import DateDimension
+from analytics.core.models.facts import JobFact
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "analytics:metrics"
+
+# Upper bounds of the lag histogram buckets, in seconds
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+# The measured stages of ingestion lag. "webhook" is from the job finishing to its webhook being
+# received, "queue" is from the webhook being received to the fact being committed, and "fact" is
+# from the job finishing to the fact being committed.
+LAG_STAGES = ("webhook", "queue", "fact")
+
+# Upper bounds of the gitlab database query latency histogram buckets, in seconds
+QUERY_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Finished jobs are only counted as missing a fact after this long, to allow for normal processing
+MISSING_FACT_GRACE = timedelta(minutes=15)
+MISSING_FACT_WINDOW = timedelta(hours=6)
+
+
+@cache
+def get_redis() -> redis.Redis:
+    return redis.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def increment(counter: str) -> None:
+    """Increment a counter. Failures are logged, so that metrics never interrupt ingestion."""
+    try:
+        get_redis().incr(f"{KEY_PREFIX}:{counter}")
+    except redis.RedisError:
+        logger.exception("Failed to increment %s", counter)
+
+
+def _observe(key: str, value: float, buckets: tuple[float, ...]) -> None:
+    bucket = next((str(b) for b in buckets if value <= b), "+Inf")
+    try:
+        get_redis().pipeline().hincrby(key, bucket, 1).hincrbyfloat(key, "sum", value).execute()
+    except redis.RedisError:
+        logger.exception("Failed to observe %s", key)
+
+
+def _histogram_buckets(client: redis.Redis, key: str, buckets: tuple[float, ...]):
+    """Read back an observed histogram, as cumulative buckets and the sum of its values."""
+    values = {k.decode(): float(v) for k, v in client.hgetall(key).items()}
+    cumulative = []
+    total = 0.0
+    for bucket in (*map(str, buckets), "+Inf"):
+        total += values.get(bucket, 0)
+        cumulative.append((bucket, total))
+
+    return cumulative, values.get("sum", 0)
+
+
+def observe_lag(stage: str, start: datetime, end: datetime) -> None:
+    """Record the lag of an ingestion stage, from start to end."""
+    seconds = max((end - start).total_seconds(), 0)
+    _observe(f"{KEY_PREFIX}:lag:{stage}", seconds, LAG_BUCKETS)
+
+
+def observe_query_latency(statement: str, seconds: float) -> None:
+    """Record the latency of a gitlab database statement."""
+    _observe(f"{KEY_PREFIX}:gitlab_db:{statement}", seconds, QUERY_LATENCY_BUCKETS)
+
+
+def record_fact_written(finished_at: datetime, received_at: datetime | None) -> None:
+    """Record a job fact being committed, at the current time."""
+    now = timezone.now()
+    increment("facts_written")
+    observe_lag("fact", finished_at, now)
+    if received_at is not None:
+        observe_lag("queue", received_at, now)
+
+
+def get_missing_fact_count() -> int:
+    """Return the number of recently finished jobs that don't have a job fact."""
+    end = timezone.now() - MISSING_FACT_GRACE
+    start = end - MISSING_FACT_WINDOW
+    # Imported here, as the gitlab database layer records its query latency through this module
+    from analytics.job_processor.gitlab_db import FINISHED_JOBS, get_gitlab_db
+
+    job_ids = [row[0] for row in get_gitlab_db().execute(FINISHED_JOBS, start, end)]
+
+    if not job_ids:
+        return 0
+
+    # Only scan the partitions that these jobs could have started in
+    start_date = DateDimension.date_key_from_datetime(start - timedelta(days=1))
+    existing = JobFact.objects.filter(job_id__in=job_ids, start_date__gte=start_date).count()
+    return len(job_ids) - existing
+
+
+class IngestCollector:
+    def collect(self):
+        client = get_redis()
+
+        for counter, description in (
+            ("webhooks_received", "The number of finished job webhooks received."),
+            ("facts_written", "The number of job facts written."),
+        ):
+            metric = CounterMetricFamily(f"analytics_{counter}", description)
+            metric.add_metric([], float(client.get(f"{KEY_PREFIX}:{counter}") or 0))
+            yield metric
+
+        lag = HistogramMetricFamily(
+            "analytics_ingest_lag_seconds",
+            "The lag of each stage of job ingestion.",
+            labels=["stage"],
+        )
+        for stage in LAG_STAGES:
+            buckets, total = _histogram_buckets(client, f"{KEY_PREFIX}:lag:{stage}", LAG_BUCKETS)
+            lag.add_metric([stage], buckets, sum_value=total)
+        yield lag
+
+        query_latency = HistogramMetricFamily(
+            "analytics_gitlab_db_query_seconds",
+            "The latency of the prepared gitlab database statements.",
+            labels=["statement"],
+        )
+        for key in client.scan_iter(f"{KEY_PREFIX}:gitlab_db:*"):
+            statement = key.decode().rsplit(":", 1)[-1]
+            buckets, total = _histogram_buckets(client, key, QUERY_LATENCY_BUCKETS)
+            query_latency.add_metric([statement], buckets, sum_value=total)
+        yield query_latency
+
+        queue_depth = GaugeMetricFamily(
+            "analytics_celery_queue_depth", "The number of queued tasks.", labels=["queue"]
+        )
+        for queue in current_app.amqp.queues:
+            queue_depth.add_metric([queue], client.llen(queue))
+        yield queue_depth
+
+        missing = GaugeMetricFamily(
+            "analytics_missing_job_facts",
+            "The number of jobs that finished in the last "
+            f"{MISSING_FACT_WINDOW} (excluding the last {MISSING_FACT_GRACE}) without a job fact.",
+        )
+        missing.add_metric([], get_missing_fact_count())
+        yield missing
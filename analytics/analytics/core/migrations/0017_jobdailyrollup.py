@@ -0,0 +1,116 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Populate the rollup table from all existing job facts. Any facts created after this point
+# increment the rollup table directly.
+populate_rollups_sql = """
+INSERT INTO core_jobdailyrollup (
+    date_id,
+    stack,
+    job_type,
+    status,
+    error_taxonomy,
+    job_count,
+    retry_count,
+    manual_retry_count,
+    total_duration_seconds,
+    total_cost
+)
+SELECT
+    jf.start_date_id,
+    sjd.stack,
+    jr.job_type,
+    jr.status,
+    jr.error_taxonomy,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE jrt.is_retry),
+    COUNT(*) FILTER (WHERE jrt.is_manual_retry),
+    COALESCE(SUM(jf.duration_seconds), 0),
+    COALESCE(SUM(jf.cost), 0)
+FROM core_jobfact jf
+INNER JOIN core_spackjobdatadimension sjd ON sjd.id = jf.spack_job_data_id
+INNER JOIN core_jobresultdimension jr ON jr.id = jf.job_result_id
+INNER JOIN core_jobretrydimension jrt ON jrt.id = jf.job_retry_id
+GROUP BY jf.start_date_id, sjd.stack, jr.job_type, jr.status, jr.error_taxonomy;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0016_add_dotenv_job_type"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobDailyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("stack", models.CharField(max_length=128)),
+                (
+                    "job_type",
+                    models.CharField(
+                        choices=[
+                            ("build", "Build"),
+                            ("dotenv", "Dotenv"),
+                            ("generate", "Generate"),
+                            ("no-specs-to-rebuild", "No Specs to Rebuild"),
+                            ("rebuild-index", "Rebuild Index"),
+                            ("copy", "Copy"),
+                            ("unsupported-copy", "Unsupported Copy"),
+                            ("sign-pkgs", "Sign Packages"),
+                            ("protected-publish", "Protected Publish"),
+                        ],
+                        max_length=19,
+                    ),
+                ),
+                ("status", models.CharField(max_length=32)),
+                ("error_taxonomy", models.CharField(max_length=64, null=True)),
+                ("job_count", models.PositiveIntegerField(default=0)),
+                (
+                    "retry_count",
+                    models.PositiveIntegerField(
+                        db_comment="The number of jobs in this row that were retries of another job.",
+                        default=0,
+                    ),
+                ),
+                ("manual_retry_count", models.PositiveIntegerField(default=0)),
+                ("total_duration_seconds", models.FloatField(default=0)),
+                (
+                    "total_cost",
+                    models.DecimalField(
+                        db_comment="The sum of the cost of all jobs in this row. Jobs with no cost are not included.",
+                        decimal_places=10,
+                        default=0,
+                        max_digits=20,
+                    ),
+                ),
+                (
+                    "date",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="core.datedimension",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "stack", "job_type", "status", "error_taxonomy"),
+                        name="unique-job-daily-rollup",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(sql=populate_rollups_sql, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,188 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+from django.db import migrations
+
+# Rebuilds a fact table in place, copying all of its data, columns, constraints and indexes.
+#
+# If `key_column` is given, the new table is range partitioned on it by month (the column must be a
+# <YYYY><MM><DD> date key), with partitions for every month that contains data, the three months
+# following the current one, and a default partition. Otherwise, the new table is unpartitioned.
+#
+# Postgres requires the primary key of a partitioned table to include the partition key, so
+# `pk_columns` is specified explicitly. Partitioned tables also can't have identity columns (before
+# Postgres 17), so identity columns are replaced by a sequence default, and vice versa.
+rebuild_fact_table_sql = r"""
+CREATE SCHEMA IF NOT EXISTS core_unpartitioned;
+
+CREATE FUNCTION core_rebuild_fact_table(tbl text, key_column text, pk_columns text)
+    RETURNS void
+    AS $$
+DECLARE
+    legacy regclass;
+    col_list text;
+    seq text;
+    rec record;
+    min_key text;
+    max_key text;
+    month date;
+    last_month date;
+BEGIN
+    -- Move the existing table (and its indexes, constraints and sequences) out of the way
+    EXECUTE format('ALTER TABLE public.%I SET SCHEMA core_unpartitioned', tbl);
+    legacy := format('core_unpartitioned.%I', tbl)::regclass;
+
+    EXECUTE format(
+        'CREATE TABLE public.%I (LIKE core_unpartitioned.%I INCLUDING DEFAULTS INCLUDING GENERATED '
+        'INCLUDING COMMENTS INCLUDING STORAGE) %s',
+        tbl,
+        tbl,
+        CASE WHEN key_column IS NULL THEN '' ELSE format('PARTITION BY RANGE (%I)', key_column) END
+    );
+
+    -- Recreate auto-incrementing columns
+    FOR rec IN
+        SELECT a.attname
+        FROM pg_attribute a
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = legacy
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+            AND (a.attidentity <> '' OR pg_get_expr(d.adbin, d.adrelid) LIKE 'nextval(%')
+    LOOP
+        IF key_column IS NULL THEN
+            EXECUTE format('ALTER TABLE public.%I ALTER COLUMN %I DROP DEFAULT', tbl, rec.attname);
+            EXECUTE format(
+                'ALTER TABLE public.%I ALTER COLUMN %I ADD GENERATED BY DEFAULT AS IDENTITY',
+                tbl,
+                rec.attname
+            );
+            seq := pg_get_serial_sequence(format('public.%I', tbl), rec.attname);
+        ELSE
+            seq := format('public.%I', tbl || '_' || rec.attname || '_seq');
+            EXECUTE format('CREATE SEQUENCE %s', seq);
+            EXECUTE format(
+                'ALTER TABLE public.%I ALTER COLUMN %I SET DEFAULT nextval(%L::regclass)',
+                tbl,
+                rec.attname,
+                seq
+            );
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY public.%I.%I', seq, tbl, rec.attname);
+        END IF;
+
+        EXECUTE format(
+            'SELECT setval(%L, COALESCE(MAX(%I), 0) + 1, false) FROM core_unpartitioned.%I',
+            seq,
+            rec.attname,
+            tbl
+        );
+    END LOOP;
+
+    -- Create monthly partitions covering the existing data, and the next few months
+    IF key_column IS NOT NULL THEN
+        EXECUTE format(
+            'SELECT MIN(%I), MAX(%I) FROM core_unpartitioned.%I', key_column, key_column, tbl
+        ) INTO min_key, max_key;
+
+        month := date_trunc('month', COALESCE(to_date(min_key, 'YYYYMMDD'), current_date))::date;
+        last_month := GREATEST(
+            date_trunc('month', current_date + interval '3 months')::date,
+            date_trunc('month', to_date(max_key, 'YYYYMMDD'))::date
+        );
+        WHILE month <= last_month LOOP
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                tbl || '_p' || to_char(month, 'YYYYMM'),
+                tbl,
+                to_char(month, 'YYYYMMDD'),
+                to_char(month + interval '1 month', 'YYYYMMDD')
+            );
+            month := (month + interval '1 month')::date;
+        END LOOP;
+
+        EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', tbl || '_default', tbl);
+    END IF;
+
+    -- Copy the data. Generated columns are recomputed.
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+    INTO col_list
+    FROM information_schema.columns
+    WHERE table_schema = 'core_unpartitioned' AND table_name = tbl AND is_generated = 'NEVER';
+
+    EXECUTE format(
+        'INSERT INTO public.%I (%s) SELECT %s FROM core_unpartitioned.%I',
+        tbl,
+        col_list,
+        col_list,
+        tbl
+    );
+
+    -- Recreate the primary key, and all other constraints and indexes, with their original names
+    EXECUTE format('ALTER TABLE public.%I ADD PRIMARY KEY (%s)', tbl, pk_columns);
+
+    FOR rec IN
+        SELECT conname, pg_get_constraintdef(oid) AS def
+        FROM pg_constraint
+        WHERE conrelid = legacy AND contype IN ('c', 'f', 'u')
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I ADD CONSTRAINT %I %s', tbl, rec.conname, rec.def);
+    END LOOP;
+
+    FOR rec IN
+        SELECT i.indexdef
+        FROM pg_indexes i
+        WHERE i.schemaname = 'core_unpartitioned'
+            AND i.tablename = tbl
+            AND NOT EXISTS (
+                SELECT 1
+                FROM pg_constraint c
+                WHERE c.conrelid = legacy
+                    AND c.conindid = format('core_unpartitioned.%I', i.indexname)::regclass
+            )
+    LOOP
+        EXECUTE replace(rec.indexdef, ' ON core_unpartitioned.', ' ON public.');
+    END LOOP;
+
+    EXECUTE format('DROP TABLE core_unpartitioned.%I', tbl);
+END;
+$$
+    LANGUAGE plpgsql;
+"""
+
+drop_rebuild_fact_table_sql = """
+DROP FUNCTION core_rebuild_fact_table(text, text, text);
+DROP SCHEMA core_unpartitioned;
+"""
+
+partition_fact_tables_sql = (
+    rebuild_fact_table_sql
+    + """
+SELECT core_rebuild_fact_table('core_jobfact', 'start_date_id', 'job_id, start_date_id');
+SELECT core_rebuild_fact_table('core_timerfact', 'date_id', 'id, date_id');
+SELECT core_rebuild_fact_table('core_timerphasefact', 'date_id', 'id, date_id');
+"""
+    + drop_rebuild_fact_table_sql
+)
+
+unpartition_fact_tables_sql = (
+    rebuild_fact_table_sql
+    + """
+SELECT core_rebuild_fact_table('core_jobfact', NULL, 'job_id');
+SELECT core_rebuild_fact_table('core_timerfact', NULL, 'id');
+SELECT core_rebuild_fact_table('core_timerphasefact', NULL, 'id');
+"""
+    + drop_rebuild_fact_table_sql
+)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0017_jobdailyrollup"),
+    ]
+
+    # The model state is unchanged. Django still treats `job_id` and `id` as the primary keys,
+    # which remain unique in practice, as they are assigned by gitlab and a sequence respectively.
+    # The database only enforces uniqueness together with the partition key, so job facts are
+    # created by looking them up by (job_id, start_date), see `create_job_fact`.
+    operations = [
+        migrations.RunSQL(sql=partition_fact_tables_sql, reverse_sql=unpartition_fact_tables_sql),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+# `core_timerphasefact_packed` unpacks the phase arrays stored on timer facts into the same shape as
+# the timer phase fact table, and `core_timerphasefact_all` combines both storage modes.
+create_views_sql = """
+CREATE VIEW core_timerphasefact_packed AS
+SELECT
+    tf.job_id,
+    tf.date_id,
+    tf.time_id,
+    tf.timer_data_id,
+    tf.package_id,
+    tf.spec_id,
+    phase.phase_id,
+    phase.duration,
+    phase.duration / NULLIF(tf.total_duration, 0) AS ratio_of_total
+FROM core_timerfact tf
+CROSS JOIN LATERAL unnest(tf.phase_ids, tf.phase_durations) AS phase(phase_id, duration)
+WHERE tf.phase_ids IS NOT NULL;
+
+CREATE VIEW core_timerphasefact_all AS
+SELECT
+    job_id,
+    date_id,
+    time_id,
+    timer_data_id,
+    package_id,
+    spec_id,
+    phase_id,
+    duration,
+    ratio_of_total
+FROM core_timerphasefact
+UNION ALL
+SELECT * FROM core_timerphasefact_packed;
+"""
+
+drop_views_sql = """
+DROP VIEW core_timerphasefact_all;
+DROP VIEW core_timerphasefact_packed;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0018_partition_fact_tables"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="timerfact",
+            name="phase_ids",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.PositiveBigIntegerField(),
+                db_comment="The IDs of the TimerPhaseDimension rows of this timer's phases.",
+                default=None,
+                null=True,
+                size=None,
+            ),
+        ),
+        migrations.AddField(
+            model_name="timerfact",
+            name="phase_durations",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.FloatField(),
+                db_comment="The duration of each phase in phase_ids, in seconds.",
+                default=None,
+                null=True,
+                size=None,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="timerfact",
+            constraint=models.CheckConstraint(
+                condition=models.Q(
+                    models.Q(("phase_durations__isnull", True), ("phase_ids__isnull", True)),
+                    models.Q(
+                        ("phase_durations__isnull", False),
+                        ("phase_ids__isnull", False),
+                        ("phase_ids__len", models.F("phase_durations__len")),
+                    ),
+                    _connector="OR",
+                ),
+                name="packed-phase-consistency",
+            ),
+        ),
+        migrations.RunSQL(sql=create_views_sql, reverse_sql=drop_views_sql),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+# All existing failures were classified with the only taxonomy version that has existed so far
+set_existing_version_sql = """
+UPDATE core_jobresultdimension
+SET error_taxonomy_version = '0.0.0-dev'
+WHERE error_taxonomy IS NOT NULL;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0019_timerfact_packed_phases"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jobresultdimension",
+            name="error_taxonomy_version",
+            field=models.CharField(
+                db_comment="The version of the error taxonomy that error_taxonomy was assigned with.",
+                max_length=32,
+                null=True,
+            ),
+        ),
+        migrations.RunSQL(sql=set_existing_version_sql, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0020_jobresultdimension_error_taxonomy_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobTraceArchive",
+            fields=[
+                ("job_id", models.PositiveBigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "content_hash",
+                    models.CharField(
+                        db_comment="The SHA-256 hash of the uncompressed trace.", max_length=64
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        db_comment="The location of the trace, relative to the store root.",
+                        max_length=128,
+                    ),
+                ),
+                (
+                    "size",
+                    models.PositiveBigIntegerField(
+                        db_comment="The uncompressed size of the trace in bytes."
+                    ),
+                ),
+                ("compressed_size", models.PositiveBigIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
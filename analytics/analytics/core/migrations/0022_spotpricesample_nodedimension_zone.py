@@ -0,0 +1,47 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0021_jobtracearchive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpotPriceSample",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("capacity_type", models.CharField(max_length=12)),
+                ("instance_type", models.CharField(max_length=32)),
+                ("zone", models.CharField(max_length=32)),
+                ("timestamp", models.DateTimeField()),
+                (
+                    "price",
+                    models.FloatField(db_comment="The hourly price (in USD) of this offering."),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("capacity_type", "instance_type", "zone", "timestamp"),
+                        name="unique-spot-price-sample",
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="nodedimension",
+            name="zone",
+            field=models.CharField(max_length=32, null=True),
+        ),
+    ]
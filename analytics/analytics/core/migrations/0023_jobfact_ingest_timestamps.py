@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0022_spotpricesample_nodedimension_zone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jobfact",
+            name="webhook_received_at",
+            field=models.DateTimeField(
+                db_comment="When the webhook of this job was received. Null for backfilled jobs.",
+                default=None,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobfact",
+            name="processed_at",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
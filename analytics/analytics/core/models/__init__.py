@@ -1,2 +1,5 @@
 from analytics.core.models.dimensions import *  # noqa: F403
 from analytics.core.models.facts import *  # noqa: F403
+from analytics.core.models.rollups import *  # noqa: F403
+from analytics.core.models.spot_prices import *  # noqa: F403
+from analytics.core.models.traces import *  # noqa: F403
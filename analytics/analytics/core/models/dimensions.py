@@ -202,6 +202,11 @@ class JobResultDimension(models.Model):
 
     status = models.CharField(max_length=32)
     error_taxonomy = models.CharField(max_length=64, null=True)
+    error_taxonomy_version = models.CharField(
+        max_length=32,
+        null=True,
+        db_comment="The version of the error taxonomy that error_taxonomy was assigned with.",
+    )  # type: ignore
     unnecessary = models.BooleanField(
         default=False,
         db_comment="Whether this job has 'No need to rebuild' in its trace.",
@@ -280,6 +285,7 @@ class NodeDimension(models.Model):
     memory = models.PositiveBigIntegerField()
     capacity_type = models.CharField(max_length=12, choices=NodeCapacityType.choices)
     instance_type = models.CharField(max_length=32)
+    zone = models.CharField(max_length=32, null=True)
 
     class Meta:
         constraints = [
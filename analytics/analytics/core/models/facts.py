@@ -1,3 +1,4 @@
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.db.models import expressions
 from django.db.models.fields.generated import GeneratedField
@@ -34,6 +35,8 @@ iso_timestamp(  -- Custom function implemented in the migration
 """
 
 
+# The fact tables are partitioned by month on their date key, so time-bounded queries should filter
+# on that key (e.g. `start_date`) for partitions to be pruned. See `analytics.core.partitions`.
 class JobFact(models.Model):
     job_id = models.PositiveBigIntegerField(primary_key=True)
 
@@ -137,6 +140,14 @@ class JobFact(models.Model):
         default=None,
     )  # type: ignore
 
+    # Ingestion timestamps, for measuring ingestion lag
+    webhook_received_at = models.DateTimeField(
+        null=True,
+        default=None,
+        db_comment="When the webhook of this job was received. Null for backfilled jobs.",
+    )  # type: ignore
+    processed_at = models.DateTimeField(null=True, default=None)
+
     class Meta:
         indexes = [
             models.Index(fields=["started_at"], name="core_jobfact_started_at"),
@@ -180,6 +191,21 @@ class TimerFact(models.Model):
 
     total_duration = models.FloatField()
 
+    # Only populated when using packed phase storage, in which case there are no TimerPhaseFact
+    # rows for this timer. The `core_timerphasefact_all` view presents both storage modes as rows.
+    phase_ids = ArrayField(
+        models.PositiveBigIntegerField(),
+        null=True,
+        default=None,
+        db_comment="The IDs of the TimerPhaseDimension rows of this timer's phases.",
+    )  # type: ignore
+    phase_durations = ArrayField(
+        models.FloatField(),
+        null=True,
+        default=None,
+        db_comment="The duration of each phase in phase_ids, in seconds.",
+    )  # type: ignore
+
     class Meta:
         constraints = [
             # All FKs should make up the composite primary key
@@ -193,7 +219,19 @@ class TimerFact(models.Model):
                     "package",
                     "spec",
                 ],
-            )
+            ),
+            # Packed phase arrays must be parallel
+            models.CheckConstraint(
+                name="packed-phase-consistency",
+                condition=(
+                    models.Q(phase_ids__isnull=True, phase_durations__isnull=True)
+                    | models.Q(
+                        phase_ids__isnull=False,
+                        phase_durations__isnull=False,
+                        phase_ids__len=models.F("phase_durations__len"),
+                    )
+                ),
+            ),
         ]
 
 
@@ -0,0 +1,43 @@
+from django.db import models
+
+from analytics.core.models.dimensions import DateDimension, JobType
+
+
+class JobDailyRollup(models.Model):
+    """
+    Job facts pre-aggregated per day, stack, job type, status and error taxonomy.
+
+    Rows are incremented as job facts are created, and can be recomputed from the job facts of a
+    given set of days with the `reconcile_rollups` management command. Dashboards that only need
+    daily granularity should read from this table instead of scanning the job fact table.
+    """
+
+    date = models.ForeignKey(DateDimension, on_delete=models.PROTECT)
+    stack = models.CharField(max_length=128)
+    job_type = models.CharField(
+        max_length=max(len(c) for c, _ in JobType.choices), choices=JobType.choices
+    )
+    status = models.CharField(max_length=32)
+    error_taxonomy = models.CharField(max_length=64, null=True)
+
+    job_count = models.PositiveIntegerField(default=0)
+    retry_count = models.PositiveIntegerField(
+        default=0, db_comment="The number of jobs in this row that were retries of another job."
+    )  # type: ignore
+    manual_retry_count = models.PositiveIntegerField(default=0)
+    total_duration_seconds = models.FloatField(default=0)
+    total_cost = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+        default=0,
+        db_comment="The sum of the cost of all jobs in this row. Jobs with no cost are not included.",
+    )  # type: ignore
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                name="unique-job-daily-rollup",
+                fields=["date", "stack", "job_type", "status", "error_taxonomy"],
+                nulls_distinct=False,
+            ),
+        ]
@@ -0,0 +1,25 @@
+from django.db import models
+
+
+class SpotPriceSample(models.Model):
+    """
+    The estimated price of an instance type offering, sampled at a fixed resolution.
+
+    Samples are ingested from karpenter's price estimate metric by the `ingest_spot_prices` task,
+    so that job costs can be computed (and recomputed) without querying prometheus for each job.
+    """
+
+    capacity_type = models.CharField(max_length=12)
+    instance_type = models.CharField(max_length=32)
+    zone = models.CharField(max_length=32)
+    timestamp = models.DateTimeField()
+    price = models.FloatField(db_comment="The hourly price (in USD) of this offering.")
+
+    class Meta:
+        constraints = [
+            # Also serves as the index for looking up the prices of an offering over a time range
+            models.UniqueConstraint(
+                name="unique-spot-price-sample",
+                fields=["capacity_type", "instance_type", "zone", "timestamp"],
+            ),
+        ]
@@ -0,0 +1,21 @@
+from django.db import models
+
+
+class JobTraceArchive(models.Model):
+    """
+    An index of the job traces stored in the trace store.
+
+    The compressed traces themselves live on a filesystem or in a bucket (see
+    `analytics.job_processor.trace_store`), at `<job_id>/<content_hash>.log.zst`.
+    """
+
+    job_id = models.PositiveBigIntegerField(primary_key=True)
+    content_hash = models.CharField(
+        max_length=64, db_comment="The SHA-256 hash of the uncompressed trace."
+    )  # type: ignore
+    key = models.CharField(
+        max_length=128, db_comment="The location of the trace, relative to the store root."
+    )  # type: ignore
+    size = models.PositiveBigIntegerField(db_comment="The uncompressed size of the trace in bytes.")
+    compressed_size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,148 @@
+"""
+Maintenance of the monthly partitions of the fact tables.
+
+The fact tables are range partitioned on their date dimension key (see migration 0018), with one
+partition per month named `<table>_p<YYYY><MM>`, plus a `<table>_default` partition that catches
+any rows outside of the existing partitions. Queries only benefit from partition pruning if they
+filter on the partitioning column itself (e.g. `start_date`), not on `started_at`.
+"""
+
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Model
+
+from analytics.core.models.facts import JobFact, TimerFact, TimerPhaseFact
+
+# The partitioned fact tables, and the date key column each is partitioned on
+PARTITIONED_FACT_TABLES: dict[type[Model], str] = {
+    JobFact: "start_date_id",
+    TimerFact: "date_id",
+    TimerPhaseFact: "date_id",
+}
+
+
+def month_start(d: datetime.date) -> datetime.date:
+    return d.replace(day=1)
+
+
+def add_months(d: datetime.date, months: int) -> datetime.date:
+    month_index = d.year * 12 + (d.month - 1) + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def month_partition_name(table: str, month: datetime.date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def list_month_partitions(table: str) -> dict[datetime.date, str]:
+    """Return the attached monthly partitions of a table, keyed by month."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            JOIN pg_namespace ns ON ns.oid = parent.relnamespace
+            WHERE parent.relname = %s AND ns.nspname = 'public'
+            """,
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    prefix = f"{table}_p"
+    return {
+        datetime.datetime.strptime(name.removeprefix(prefix), "%Y%m").date(): name
+        for name in names
+        if name.startswith(prefix)
+    }
+
+
+def _insertable_columns(table: str) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = %s AND is_generated = 'NEVER'
+            ORDER BY ordinal_position
+            """,
+            [table],
+        )
+        return ", ".join(connection.ops.quote_name(row[0]) for row in cursor.fetchall())
+
+
+def create_month_partition(model: type[Model], month: datetime.date) -> bool:
+    """
+    Create the partition of `model` for the given month, if it doesn't exist yet.
+
+    Any rows for that month which have already landed in the default partition are moved into the
+    new partition. Returns True if the partition was created.
+    """
+    table = model._meta.db_table
+    key_column = PARTITIONED_FACT_TABLES[model]
+    month = month_start(month)
+    if month in list_month_partitions(table):
+        return False
+
+    qn = connection.ops.quote_name
+    partition = qn(month_partition_name(table, month))
+    default = qn(default_partition_name(table))
+    lower = f"{month:%Y%m%d}"
+    upper = f"{add_months(month, 1):%Y%m%d}"
+    in_range = f"{qn(key_column)} >= %s AND {qn(key_column)} < %s"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})", [lower, upper])
+        (default_has_rows,) = cursor.fetchone()
+
+        # Postgres refuses to create a partition if the default partition contains rows for it
+        if default_has_rows:
+            cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {default}")
+
+        cursor.execute(
+            f"CREATE TABLE {partition} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)",
+            [lower, upper],
+        )
+
+        if default_has_rows:
+            columns = _insertable_columns(table)
+            cursor.execute(
+                f"""
+                WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *)
+                INSERT INTO {partition} ({columns}) SELECT {columns} FROM moved
+                """,
+                [lower, upper],
+            )
+            cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {default} DEFAULT")
+
+    return True
+
+
+def detach_month_partition(
+    model: type[Model], month: datetime.date, archive_schema: str | None = None
+) -> str:
+    """
+    Detach the partition of `model` for the given month, so that it's no longer part of the table.
+
+    The detached partition is kept as a standalone table, which is moved to `archive_schema` if
+    given. Returns the (schema qualified) name of the detached table.
+    """
+    table = model._meta.db_table
+    name = month_partition_name(table, month_start(month))
+    qn = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+        if archive_schema is None:
+            return name
+
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {qn(archive_schema)}")
+        cursor.execute(f"ALTER TABLE {qn(name)} SET SCHEMA {qn(archive_schema)}")
+
+    return f"{archive_schema}.{name}"
@@ -0,0 +1,227 @@
+import json
+from pathlib import Path
+import uuid
+
+import pytest
+
+from analytics.core.models.dimensions import (
+    NodeDimension,
+    PackageDimension,
+    PackageSpecDimension,
+    RunnerDimension,
+    TimerDataDimension,
+)
+from analytics.job_processor import create_job_fact
+from analytics.job_processor.metadata import (
+    JobInfo,
+    JobMiscInfo,
+    NodeInfo,
+    PackageInfo,
+    PodInfo,
+)
+from analytics.job_processor.utils import RetryInfo
+
+SPEC_JSON_PATH = Path(__file__).parent / "data" / "spec.json"
+
+BUILD_JOB_NAME = "nccl@2.23.4 /qex2pp7 %gcc@13.2.0"
+
+
+@pytest.fixture()
+def spec_json():
+    with open(SPEC_JSON_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture()
+def empty_dimension_rows():
+    """Ensure the rows returned by the `get_empty_row` methods exist."""
+    NodeDimension.objects.get_or_create(
+        name="",
+        defaults={
+            "system_uuid": uuid.UUID(int=0),
+            "cpu": 0,
+            "memory": 0,
+            "capacity_type": "",
+            "instance_type": "",
+        },
+    )
+    RunnerDimension.objects.get_or_create(
+        name="",
+        defaults={
+            "runner_id": 0,
+            "platform": "",
+            "host": "",
+            "arch": "",
+            "in_cluster": False,
+        },
+    )
+    PackageDimension.objects.get_or_create(name="")
+    PackageSpecDimension.objects.get_or_create(
+        hash="",
+        defaults={
+            "name": "",
+            "version": "",
+            "compiler_name": "",
+            "compiler_version": "",
+            "arch": "",
+        },
+    )
+    TimerDataDimension.objects.get_or_create(cache=True)
+    TimerDataDimension.objects.get_or_create(cache=False)
+
+
+@pytest.fixture()
+def gitlab_db(mocker):
+    """Stub out the queries made against the gitlab database, which aren't counted."""
+    mocker.patch("analytics.job_processor.dimensions.get_job_exit_code", return_value=0)
+    mocker.patch(
+        "analytics.job_processor.dimensions.get_job_retry_data",
+        return_value=RetryInfo(
+            is_retry=False, is_manual_retry=False, attempt_number=1, final_attempt=True
+        ),
+    )
+
+
+@pytest.fixture()
+def gl(mocker):
+    gl = mocker.Mock()
+    gl.runners.get.return_value = mocker.Mock(
+        description="runner-abc123",
+        platform="linux",
+        architecture="amd64",
+        tag_list=["spack", "x86_64"],
+    )
+    return gl
+
+
+@pytest.fixture()
+def make_gljob(mocker):
+    def make_gljob(job_id: int, status: str):
+        return mocker.Mock(
+            id=job_id,
+            started_at="2025-01-15T12:30:45.000Z",
+            duration=600.0,
+            ref="develop",
+            tag_list=["spack", "x86_64"],
+            runner={"id": 1234},
+            runner_details=None,
+            status=status,
+        )
+
+    return make_gljob
+
+
+@pytest.fixture()
+def make_job_input_data():
+    def make_job_input_data(
+        job_id: int,
+        name: str,
+        stage: str,
+        status: str,
+        failure_reason: str | None = None,
+    ) -> dict:
+        if failure_reason is None:
+            failure_reason = "script_failure" if status == "failed" else "unknown_failure"
+
+        return {
+            "build_id": job_id,
+            "build_name": name,
+            "build_stage": stage,
+            "build_status": status,
+            "build_failure_reason": failure_reason,
+            "pipeline_id": 1000,
+            "project_id": 2,
+            "ref": "develop",
+        }
+
+    return make_job_input_data
+
+
+@pytest.fixture()
+def build_job_info(spec_json) -> JobInfo:
+    root = spec_json["spec"]["nodes"][0]
+    return JobInfo(
+        package=PackageInfo(
+            name=root["name"],
+            hash=root["hash"],
+            version=root["version"],
+            compiler_name=root["compiler"]["name"],
+            compiler_version=root["compiler"]["version"],
+            arch="linux-ubuntu24.04-x86_64_v3",
+            variants="+cuda",
+        ),
+        misc=JobMiscInfo(job_size="large", stack="ml-linux-x86_64-cuda", build_jobs=16),
+        pod=PodInfo(
+            name="runner-abc123-project-2-concurrent-0",
+            node_occupancy=0.5,
+            cpu_usage_seconds=1200.0,
+            max_memory=8 * 1024**3,
+            avg_memory=4 * 1024**3,
+        ),
+        node=NodeInfo(
+            name="ip-192-168-0-1.ec2.internal",
+            system_uuid=uuid.uuid4(),
+            cpu=32,
+            memory=128 * 1024**3,
+            capacity_type="spot",
+            instance_type="c6i.8xlarge",
+            spot_price=0.5,
+        ),
+    )
+
+
+@pytest.fixture()
+def empty_job_info() -> JobInfo:
+    """The job info of a job that didn't run in the cluster."""
+    return JobInfo()
+
+
+@pytest.fixture()
+def timings(spec_json) -> list[dict]:
+    return [
+        {
+            "name": node["name"],
+            "hash": node["hash"],
+            "cache": i > 0,
+            "total": 10.0,
+            "phases": [
+                {"path": "fetch", "seconds": 1.0},
+                {"path": "install", "seconds": 9.0},
+                {"path": "install/build", "seconds": 8.0},
+            ],
+        }
+        for i, node in enumerate(spec_json["spec"]["nodes"])
+    ]
+
+
+@pytest.fixture()
+def make_job_fact(mocker, empty_dimension_rows, gitlab_db, gl, make_gljob, make_job_input_data):
+    """
+    Create a job fact through `create_job_fact`, with its job info and gitlab data stubbed.
+
+    Jobs are named after the build of the package in `spec.json`, unless a name is given.
+    """
+
+    def make_job_fact(
+        job_id: int,
+        name: str | None = None,
+        stage: str = "stage-1",
+        status: str = "success",
+        job_info: JobInfo | None = None,
+        failure_reason: str | None = None,
+        job_trace: str = "",
+    ):
+        mocker.patch(
+            "analytics.job_processor.retrieve_job_info", return_value=job_info or JobInfo()
+        )
+        gljob = make_gljob(job_id=job_id, status=status)
+        job_input_data = make_job_input_data(
+            job_id,
+            name=name or BUILD_JOB_NAME,
+            stage=stage,
+            status=status,
+            failure_reason=failure_reason,
+        )
+        return create_job_fact(gl, gljob, job_input_data, job_trace=job_trace)
+
+    return make_job_fact
@@ -41,7 +41,15 @@ def build_json_string():
     )
 
 
+@pytest.fixture()
+def no_gitlab_db(mocker):
+    """Read jobs and their traces through the API, rather than from the gitlab database."""
+    mocker.patch("analytics.job_processor.utils.get_gitlab_db_job", return_value=None)
+    mocker.patch("analytics.job_processor.traces.get_archived_trace", return_value=None)
+
+
 @pytest.mark.django_db
+@pytest.mark.usefixtures("no_gitlab_db")
 @pytest.mark.parametrize(
     "job_json_string,unnecessary",
     [
@@ -62,6 +70,7 @@ def test_process_job_unnecessary_jobs(request, job_json_string, unnecessary):
 
 
 @pytest.mark.django_db
+@pytest.mark.usefixtures("no_gitlab_db")
 def test_upload_job_logs(build_json_string):
     store_job_data(build_json_string)
 
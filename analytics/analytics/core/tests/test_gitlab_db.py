@@ -0,0 +1,100 @@
+import psycopg2
+import pytest
+
+from analytics.job_processor.gitlab_db import EXIT_CODE, RETRY_CONFIG, GitlabDB
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=None):
+        if self.conn.error is not None and sql.startswith("EXECUTE"):
+            raise self.conn.error
+        self.conn.executed.append(sql)
+
+    def fetchall(self):
+        return [(0,)]
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.prepared: set[str] = set()
+        self.executed: list[str] = []
+        self.autocommit = False
+        self.closed = 0
+        self.error: BaseException | None = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture()
+def fake_connect(mocker):
+    mocker.patch("analytics.job_processor.gitlab_db.observe_query_latency")
+    return mocker.patch(
+        "analytics.job_processor.gitlab_db.psycopg2.connect",
+        side_effect=lambda **kwargs: FakeConnection(),
+    )
+
+
+def test_connection_reuse(fake_connect):
+    db = GitlabDB(pool_size=2, statement_timeout_ms=1000)
+    db.fetchone(EXIT_CODE, 1)
+    db.fetchone(EXIT_CODE, 2)
+    db.fetchone(RETRY_CONFIG, 3)
+
+    # Returned connections are kept open and reused
+    fake_connect.assert_called_once()
+    with db.connection() as conn:
+        assert conn.autocommit
+        assert not conn.closed
+        assert conn.executed[0] == "SET statement_timeout = %s"
+
+        # A second connection is only opened while the first is in use
+        with db.connection() as other:
+            assert other is not conn
+    assert fake_connect.call_count == 2
+
+    db.close()
+    assert conn.closed and other.closed
+
+
+def test_statements_prepared_once(fake_connect):
+    db = GitlabDB(pool_size=1, statement_timeout_ms=1000)
+    for job_id in range(3):
+        db.fetchone(EXIT_CODE, job_id)
+    db.fetchone(RETRY_CONFIG, 1)
+
+    with db.connection() as conn:
+        prepares = [sql.split()[1] for sql in conn.executed if sql.startswith("PREPARE")]
+        executes = [sql for sql in conn.executed if sql.startswith("EXECUTE")]
+    assert prepares == ["exit_code", "retry_config"]
+    assert len(executes) == 4
+    assert conn.prepared == {"exit_code", "retry_config"}
+
+
+@pytest.mark.parametrize(
+    "error", [psycopg2.OperationalError("gone"), ValueError("bad"), KeyboardInterrupt()]
+)
+def test_connection_released_on_error(fake_connect, error):
+    db = GitlabDB(pool_size=1, statement_timeout_ms=1000)
+    with db.connection() as conn:
+        conn.error = error
+
+    with pytest.raises(type(error)):
+        db.fetchone(EXIT_CODE, 1)
+
+    # The failed connection is closed rather than reused, and its slot in the pool is freed
+    assert conn.closed
+    assert db.fetchone(EXIT_CODE, 1) == (0,)
+    assert fake_connect.call_count == 2
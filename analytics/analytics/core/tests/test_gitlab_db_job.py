@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+import pytest
+
+from analytics.job_processor.gitlab_db import JOB
+from analytics.job_processor.utils import (
+    GitlabDBJob,
+    GitlabRunnerDetails,
+    get_gitlab_db_job,
+    get_job_metadata,
+)
+
+JOB_ID = 9708962
+
+
+def make_row(**kwargs) -> tuple:
+    """A row of the `get_gitlab_db_job` query, with any of its columns overridden."""
+    columns = {
+        "id": JOB_ID,
+        "project_id": 2,
+        "name": "nccl@2.23.4 /qex2pp7 %gcc@13.2.0",
+        "status": "success",
+        "ref": "develop",
+        "started_at": datetime(2025, 1, 15, 12, 30, 45),
+        "duration": 600.0,
+        "tag_list": ["spack", "x86_64"],
+        "runner_id": 1234,
+        "runner_description": "runner-abc123",
+        "runner_platform": "linux",
+        "runner_architecture": "amd64",
+        "runner_tag_list": ["spack", "x86_64", "x86_64_v3"],
+        **kwargs,
+    }
+    return tuple(columns.values())
+
+
+@pytest.fixture()
+def fetchone(mocker):
+    """The gitlab database's `fetchone`, which returns the row of the job query."""
+    return mocker.patch("analytics.job_processor.utils.get_gitlab_db").return_value.fetchone
+
+
+@pytest.fixture()
+def api_job(mocker):
+    mocker.patch("analytics.job_processor.utils.get_gitlab_project")
+    return mocker.patch("analytics.job_processor.utils.get_gitlab_job").return_value
+
+
+def test_get_gitlab_db_job(fetchone):
+    fetchone.return_value = make_row()
+    job = get_gitlab_db_job(JOB_ID)
+
+    fetchone.assert_called_once_with(JOB, JOB_ID)
+    assert job.id == JOB_ID
+    assert job.project_id == 2
+    assert job.status == "success"
+    assert job.ref == "develop"
+    assert job.duration == 600.0
+    assert job.tag_list == ["spack", "x86_64"]
+    assert job.runner == {"id": 1234, "description": "runner-abc123"}
+    assert job.runner_details == GitlabRunnerDetails(
+        description="runner-abc123",
+        platform="linux",
+        architecture="amd64",
+        tag_list=["spack", "x86_64", "x86_64_v3"],
+    )
+
+
+@pytest.mark.parametrize(
+    "started_at",
+    [
+        datetime(2025, 1, 15, 12, 30, 45),
+        datetime(2025, 1, 15, 12, 30, 45, tzinfo=timezone.utc),
+        datetime(2025, 1, 15, 7, 30, 45, tzinfo=timezone(timedelta(hours=-5))),
+    ],
+)
+def test_get_gitlab_db_job_started_at(fetchone, started_at):
+    fetchone.return_value = make_row(started_at=started_at)
+    job = get_gitlab_db_job(JOB_ID)
+
+    # The REST API's format, which is what the job processor parses
+    assert job.started_at == "2025-01-15T12:30:45+00:00"
+
+
+def test_get_gitlab_db_job_without_runner_machine(fetchone):
+    fetchone.return_value = make_row(
+        runner_description=None, runner_platform=None, runner_architecture=None
+    )
+    job = get_gitlab_db_job(JOB_ID)
+
+    assert job.runner == {"id": 1234, "description": None}
+    assert job.runner_details.description == ""
+    assert job.runner_details.platform == ""
+    assert job.runner_details.architecture == ""
+
+
+def test_get_gitlab_db_job_without_runner(fetchone):
+    fetchone.return_value = make_row(
+        runner_id=None,
+        runner_description=None,
+        runner_platform=None,
+        runner_architecture=None,
+        runner_tag_list=[],
+    )
+    job = get_gitlab_db_job(JOB_ID)
+
+    assert job.runner is None
+    assert job.runner_details is None
+
+
+def test_get_gitlab_db_job_missing(fetchone):
+    fetchone.return_value = None
+    assert get_gitlab_db_job(JOB_ID) is None
+
+
+def test_get_job_metadata(fetchone, api_job):
+    fetchone.return_value = make_row()
+    assert isinstance(get_job_metadata(2, JOB_ID), GitlabDBJob)
+
+
+@pytest.mark.parametrize(
+    "result",
+    [
+        pytest.param({"return_value": None}, id="missing"),
+        pytest.param({"return_value": make_row(duration=None)}, id="unfinished"),
+        pytest.param({"side_effect": psycopg2.OperationalError}, id="database-error"),
+    ],
+)
+def test_get_job_metadata_api_fallback(fetchone, api_job, result):
+    fetchone.configure_mock(**result)
+    assert get_job_metadata(2, JOB_ID) is api_job
@@ -0,0 +1,229 @@
+from collections import defaultdict
+from datetime import datetime
+
+from opensearchpy.exceptions import TransportError
+import pytest
+
+from analytics.core.job_log_uploader import indexer
+from analytics.core.job_log_uploader.indexer import BulkIndexError, BulkLogIndexer, split_job_log
+from analytics.core.job_log_uploader.windows import get_error_windows
+
+TIMESTAMP = datetime(2025, 1, 15, 12, 30, 45)
+
+
+class FakeRedis:
+    """An in-memory stand-in for the redis commands used to buffer documents."""
+
+    def __init__(self) -> None:
+        self.lists: dict[str, list[bytes]] = defaultdict(list)
+        self.values: dict[str, int] = defaultdict(int)
+        self.locks: set[str] = set()
+
+    def rpush(self, key, *values):
+        self.lists[key].extend(value.encode() for value in values)
+        return len(self.lists[key])
+
+    def lrange(self, key, start, end):
+        return self.lists[key][start : end + 1]
+
+    def ltrim(self, key, start, end):
+        assert end == -1
+        del self.lists[key][:start]
+
+    def incrby(self, key, amount):
+        self.values[key] += amount
+        return self.values[key]
+
+    def decrby(self, key, amount):
+        return self.incrby(key, -amount)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout):
+        return FakeLock(self, name)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis) -> None:
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name, args))
+            return self
+
+        return command
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args) for name, args in self.commands]
+
+
+class FakeLock:
+    def __init__(self, redis: FakeRedis, name: str) -> None:
+        self.redis = redis
+        self.name = name
+
+    def acquire(self, blocking):
+        if self.name in self.redis.locks:
+            return False
+        self.redis.locks.add(self.name)
+        return True
+
+    def reacquire(self):
+        assert self.name in self.redis.locks
+
+    def release(self):
+        self.redis.locks.remove(self.name)
+
+
+@pytest.fixture()
+def fake_redis():
+    return FakeRedis()
+
+
+def bulk_response(*statuses: int) -> dict:
+    return {
+        "errors": any(status >= 300 for status in statuses),
+        "items": [
+            {"index": {"_id": str(i), "status": status}} for i, status in enumerate(statuses)
+        ],
+    }
+
+
+def test_split_job_log(monkeypatch):
+    monkeypatch.setattr(indexer, "TRACE_CHUNK_SIZE", 4)
+
+    assert split_job_log("1", {"job_trace": "abcd"}) == [("1", {"job_trace": "abcd"})]
+    assert split_job_log("1", {"job_trace": "abcdefghij", "name": "job"}) == [
+        ("1-0", {"job_trace": "abcd", "name": "job", "chunk_index": 0, "chunk_count": 3}),
+        ("1-1", {"job_trace": "efgh", "name": "job", "chunk_index": 1, "chunk_count": 3}),
+        ("1-2", {"job_trace": "ij", "name": "job", "chunk_index": 2, "chunk_count": 3}),
+    ]
+
+
+def test_add_returns_whether_buffer_is_full(mocker, fake_redis):
+    client = mocker.Mock()
+    log_indexer = BulkLogIndexer(client, fake_redis, max_bytes=200)
+
+    assert not log_indexer.add("1", {"job_trace": "a" * 50}, TIMESTAMP)
+    assert log_indexer.add("2", {"job_trace": "b" * 50}, TIMESTAMP)
+    assert not log_indexer.add("3", {"job_trace": "c" * 50}, TIMESTAMP)
+
+    # Nothing is sent until the buffer is flushed
+    client.bulk.assert_not_called()
+    assert len(fake_redis.lists[indexer.BUFFER_KEY]) == 3
+    assert fake_redis.values[indexer.BUFFER_BYTES_KEY] == sum(
+        map(len, fake_redis.lists[indexer.BUFFER_KEY])
+    )
+
+
+def test_flush_sends_bounded_requests(mocker, fake_redis):
+    client = mocker.Mock()
+    client.bulk.side_effect = lambda body: bulk_response(*[201] * body.count('"index"'))
+    log_indexer = BulkLogIndexer(client, fake_redis, max_bytes=200)
+
+    for doc_id in ["1", "2", "3"]:
+        log_indexer.add(doc_id, {"job_trace": "a" * 50}, TIMESTAMP)
+    assert log_indexer.flush() == 3
+
+    # Requests are filled up to the maximum size, and the sent documents removed from the buffer
+    bodies = [call.kwargs["body"] for call in client.bulk.call_args_list]
+    assert [body.count('"index"') for body in bodies] == [2, 1]
+    assert '"_index": "gitlab-job-logs-20250115"' in bodies[0]
+    assert fake_redis.lists[indexer.BUFFER_KEY] == []
+    assert fake_redis.values[indexer.BUFFER_BYTES_KEY] == 0
+
+
+def test_flush_retries_only_failed_documents(mocker, fake_redis):
+    mocker.patch.object(indexer.time, "sleep")
+    client = mocker.Mock()
+    client.bulk.side_effect = [bulk_response(201, 429, 400), bulk_response(201)]
+    log_indexer = BulkLogIndexer(client, fake_redis)
+
+    for doc_id in ["1", "2", "3"]:
+        log_indexer.add(doc_id, {"job_trace": doc_id}, TIMESTAMP)
+    log_indexer.flush()
+
+    # Only the rate limited document is retried, not the rejected one
+    assert client.bulk.call_count == 2
+    retried_body = client.bulk.call_args.kwargs["body"]
+    assert '"_id": "2"' in retried_body
+    assert '"_id": "1"' not in retried_body and '"_id": "3"' not in retried_body
+    assert fake_redis.lists[indexer.BUFFER_KEY] == []
+
+
+def test_flush_keeps_documents_when_retries_are_exhausted(mocker, fake_redis):
+    mocker.patch.object(indexer.time, "sleep")
+    client = mocker.Mock()
+    client.bulk.side_effect = [bulk_response(201, 503)] + [bulk_response(503)] * indexer.MAX_RETRIES
+    log_indexer = BulkLogIndexer(client, fake_redis)
+
+    log_indexer.add("1", {"job_trace": "a"}, TIMESTAMP)
+    log_indexer.add("2", {"job_trace": "b"}, TIMESTAMP)
+    log_indexer.add("3", {"job_trace": "c"}, TIMESTAMP)
+    failed = fake_redis.lists[indexer.BUFFER_KEY][1]
+
+    with pytest.raises(BulkIndexError):
+        log_indexer.flush()
+    assert client.bulk.call_count == indexer.MAX_RETRIES + 1
+
+    # Only the failed document stays buffered, to be sent by the next flush
+    assert fake_redis.lists[indexer.BUFFER_KEY] == [failed]
+    assert fake_redis.values[indexer.BUFFER_BYTES_KEY] == len(failed)
+
+
+def test_flush_keeps_documents_when_interrupted(mocker, fake_redis):
+    client = mocker.Mock()
+    client.bulk.side_effect = RuntimeError("Worker lost")
+    log_indexer = BulkLogIndexer(client, fake_redis)
+
+    log_indexer.add("1", {"job_trace": "a"}, TIMESTAMP)
+    buffered = list(fake_redis.lists[indexer.BUFFER_KEY])
+
+    with pytest.raises(RuntimeError):
+        log_indexer.flush()
+    assert fake_redis.lists[indexer.BUFFER_KEY] == buffered
+    assert not fake_redis.locks
+
+
+def test_flush_drops_rejected_request(mocker, fake_redis):
+    client = mocker.Mock()
+    client.bulk.side_effect = [TransportError(400, "bad request"), bulk_response(201)]
+    log_indexer = BulkLogIndexer(client, fake_redis)
+
+    log_indexer.add("1", {"job_trace": "a"}, TIMESTAMP)
+    log_indexer.flush()
+    assert fake_redis.lists[indexer.BUFFER_KEY] == []
+
+    # The rejected document isn't sent along with the next one
+    log_indexer.add("2", {"job_trace": "b"}, TIMESTAMP)
+    log_indexer.flush()
+    body = client.bulk.call_args.kwargs["body"]
+    assert '"_id": "2"' in body and '"_id": "1"' not in body
+
+
+def test_flush_skipped_while_another_flush_runs(mocker, fake_redis):
+    client = mocker.Mock()
+    log_indexer = BulkLogIndexer(client, fake_redis)
+    log_indexer.add("1", {"job_trace": "a"}, TIMESTAMP)
+
+    fake_redis.locks.add(indexer.FLUSH_LOCK_KEY)
+    assert log_indexer.flush() == 0
+    client.bulk.assert_not_called()
+
+
+def test_get_error_windows():
+    trace_lines = [f"line {i}" for i in range(100)]
+    trace_lines[20] = "curl: (28) Operation timed out"
+    trace_lines[24] = "curl: (22) The requested URL returned error: 404"
+    trace_lines[80] = "Error: concretization failed for the following reasons:"
+
+    windows = get_error_windows("\n".join(trace_lines), context_lines=3)
+
+    # The first two matches are close enough to be merged
+    assert [(w["start_line"], w["end_line"]) for w in windows] == [(17, 27), (77, 83)]
+    assert windows[0]["error_classes"] == ["network_error", "network_timeout"]
+    assert windows[1]["error_classes"] == ["concretization_error"]
+    assert windows[1]["text"] == "\n".join(trace_lines[77:84])
@@ -0,0 +1,67 @@
+from django.utils import timezone
+from prometheus_client import CollectorRegistry
+import pytest
+
+from analytics.core.metrics import KEY_PREFIX, IngestCollector, get_missing_fact_count
+from analytics.core.models.dimensions import DateDimension
+from analytics.core.models.facts import JobFact
+from analytics.job_processor.gitlab_db import FINISHED_JOBS
+
+
+class FakeRedis:
+    def __init__(self, values: dict, hashes: dict[str, dict]) -> None:
+        self.values = values
+        self.hashes = hashes
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def hgetall(self, key):
+        return {k.encode(): str(v).encode() for k, v in self.hashes.get(key, {}).items()}
+
+    def llen(self, key):
+        return 7
+
+    def scan_iter(self, pattern):
+        return []
+
+
+def test_ingest_metrics(mocker):
+    fake_redis = FakeRedis(
+        values={f"{KEY_PREFIX}:webhooks_received": b"10", f"{KEY_PREFIX}:facts_written": b"8"},
+        hashes={f"{KEY_PREFIX}:lag:fact": {"5": 2, "60": 1, "+Inf": 1, "sum": 100000.5}},
+    )
+    mocker.patch("analytics.core.metrics.get_redis", return_value=fake_redis)
+    mocker.patch("analytics.core.metrics.get_missing_fact_count", return_value=3)
+
+    registry = CollectorRegistry()
+    registry.register(IngestCollector())
+
+    assert registry.get_sample_value("analytics_webhooks_received_total") == 10
+    assert registry.get_sample_value("analytics_facts_written_total") == 8
+    assert registry.get_sample_value("analytics_missing_job_facts") == 3
+    assert registry.get_sample_value("analytics_celery_queue_depth", {"queue": "celery"}) == 7
+
+    # Buckets are stored individually, and exported cumulatively
+    def bucket(le: str) -> float | None:
+        return registry.get_sample_value(
+            "analytics_ingest_lag_seconds_bucket", {"stage": "fact", "le": le}
+        )
+
+    assert bucket("1") == 0
+    assert bucket("5") == 2
+    assert bucket("60") == 3
+    assert bucket("+Inf") == 4
+    assert registry.get_sample_value("analytics_ingest_lag_seconds_count", {"stage": "fact"}) == 4
+
+
+@pytest.mark.django_db
+def test_missing_fact_count(mocker, make_job_fact):
+    make_job_fact(9708962)
+    JobFact.objects.update(start_date=DateDimension.ensure_exists(timezone.now()))
+
+    db = mocker.patch("analytics.job_processor.gitlab_db.get_gitlab_db").return_value
+    db.execute.return_value = [(9708961,), (9708962,), (9708963,)]
+
+    assert get_missing_fact_count() == 2
+    assert db.execute.call_args.args[0] == FINISHED_JOBS
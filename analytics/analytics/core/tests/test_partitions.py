@@ -0,0 +1,79 @@
+import datetime
+
+from django.db import connection
+import pytest
+
+from analytics.core.models.dimensions import DateDimension
+from analytics.core.models.facts import JobFact, TimerFact, TimerPhaseFact
+from analytics.core.partitions import (
+    create_month_partition,
+    default_partition_name,
+    detach_month_partition,
+    list_month_partitions,
+    month_partition_name,
+)
+
+# Far enough in the future that the migration won't have created these partitions
+JANUARY = datetime.date(2099, 1, 1)
+FEBRUARY = datetime.date(2099, 2, 1)
+MARCH = datetime.date(2099, 3, 1)
+
+
+def partition_job_ids(partition: str) -> list[int]:
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT job_id FROM {connection.ops.quote_name(partition)} ORDER BY job_id")
+        return [row[0] for row in cursor.fetchall()]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("model", [JobFact, TimerFact, TimerPhaseFact])
+def test_create_and_detach_month_partition(model):
+    table = model._meta.db_table
+    assert JANUARY not in list_month_partitions(table)
+
+    assert create_month_partition(model, JANUARY)
+    assert not create_month_partition(model, JANUARY)
+    assert list_month_partitions(table)[JANUARY] == month_partition_name(table, JANUARY)
+
+    name = detach_month_partition(model, JANUARY, archive_schema="core_archive")
+    assert name == f"core_archive.{month_partition_name(table, JANUARY)}"
+    assert JANUARY not in list_month_partitions(table)
+
+
+@pytest.mark.django_db
+def test_date_range_query_prunes_partitions():
+    create_month_partition(JobFact, JANUARY)
+    create_month_partition(JobFact, FEBRUARY)
+
+    table = JobFact._meta.db_table
+    plan = JobFact.objects.filter(start_date__gte="20990110", start_date__lt="20990120").explain()
+
+    assert month_partition_name(table, JANUARY) in plan
+    assert month_partition_name(table, FEBRUARY) not in plan
+    assert default_partition_name(table) not in plan
+
+
+@pytest.mark.django_db
+def test_create_month_partition_moves_default_rows(make_job_fact):
+    table = JobFact._meta.db_table
+    default = default_partition_name(table)
+
+    # Without a partition for their month, facts land in the default partition
+    for job_id in [9708962, 9708963]:
+        make_job_fact(job_id)
+    JobFact.objects.filter(job_id=9708962).update(
+        start_date=DateDimension.ensure_exists(JANUARY.replace(day=15))
+    )
+    assert 9708962 in partition_job_ids(default)
+
+    assert create_month_partition(JobFact, JANUARY)
+    assert partition_job_ids(month_partition_name(table, JANUARY)) == [9708962]
+    assert 9708962 not in partition_job_ids(default)
+    assert JobFact.objects.get(job_id=9708962).start_date_id == "20990115"
+
+    # The default partition is attached again, and still receives rows for other months
+    JobFact.objects.filter(job_id=9708963).update(
+        start_date=DateDimension.ensure_exists(MARCH.replace(day=15))
+    )
+    assert 9708963 in partition_job_ids(default)
+    assert JobFact.objects.count() == 2
@@ -0,0 +1,178 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import uuid
+
+import pytest
+
+from analytics.job_processor.prometheus import PrometheusClient
+from analytics.job_processor.prometheus_bulk import BulkPrometheusExtractor
+
+# A recorded range query of container_cpu_usage_seconds_total for every pod on a node
+NODE_CPU_USAGE_PATH = Path(__file__).parent / "data" / "node_cpu_usage.json"
+
+T0 = datetime(2025, 1, 15, 12, 0, tzinfo=timezone.utc)
+NODE_UUID = str(uuid.uuid4())
+
+ANNOTATIONS = {
+    "pod": "runner-abc-project-2-concurrent-0",
+    "annotation_gitlab_ci_job_id": "100",
+    "annotation_metrics_spack_job_spec_hash": "abcdef",
+    "annotation_metrics_spack_job_spec_pkg_name": "zlib",
+    "annotation_metrics_spack_job_spec_pkg_version": "1.3",
+    "annotation_metrics_spack_job_spec_arch": "linux-ubuntu24.04-x86_64_v3",
+    "annotation_metrics_spack_job_spec_variants": "+shared",
+}
+POD = ANNOTATIONS["pod"]
+LABELS = {
+    "pod": POD,
+    "label_gitlab_ci_job_size": "large",
+    "label_metrics_spack_ci_stack_name": "e4s",
+}
+NODE_LABELS = {
+    "node": "node-1",
+    "label_karpenter_k8s_aws_instance_cpu": "32",
+    "label_karpenter_k8s_aws_instance_memory": "131072",
+    "label_karpenter_sh_capacity_type": "spot",
+    "label_node_kubernetes_io_instance_type": "c6i.8xlarge",
+    "label_topology_kubernetes_io_zone": "us-east-1a",
+}
+
+
+def instant(metric: dict, value) -> dict:
+    return {"metric": metric, "value": [T0.timestamp(), str(value)]}
+
+
+class FakePrometheusClient:
+    """Answers the bulk extraction queries for a single job, sharing its node with another pod."""
+
+    instant_results = [
+        ("kube_pod_labels", [instant(LABELS, 1)]),
+        ("kube_pod_info", [instant({"pod": POD, "node": "node-1"}, 1)]),
+        (
+            "resource_requests",
+            [
+                instant({"pod": POD, "resource": "cpu"}, 2),
+                instant({"pod": POD, "resource": "memory"}, 4e9),
+            ],
+        ),
+        ("resource_limits", [instant({"pod": POD, "resource": "memory"}, 8e9)]),
+        ("container_cpu_usage", [instant({"pod": POD}, 600)]),
+        ("max_over_time(container_memory", [instant({"pod": POD}, 3e9)]),
+        ("sum_over_time(container_memory", [instant({"pod": POD}, 4e9)]),
+        ("count_over_time(container_memory", [instant({"pod": POD}, 2)]),
+        ("kube_node_info", [instant({"node": "node-1", "system_uuid": NODE_UUID}, 1)]),
+        ("kube_node_labels", [instant(NODE_LABELS, 1)]),
+        ("kube_pod_annotations", [instant(ANNOTATIONS, 1)]),
+    ]
+
+    def query_single(self, query: str, time: datetime):
+        return next(results for metric, results in self.instant_results if metric in query)
+
+    def query_range(self, query: str, start: datetime, end: datetime, step: int):
+        # Two pods for the first half of the window, then only this one
+        timestamps = range(int(start.timestamp()), int(end.timestamp()) + 1, step)
+        midpoint = start.timestamp() + (end - start).total_seconds() / 2
+        return [
+            {
+                "metric": {"node": "node-1"},
+                "values": [[ts, "2" if ts < midpoint else "1"] for ts in timestamps],
+            }
+        ]
+
+
+def test_bulk_extraction(mocker):
+    mocker.patch("analytics.job_processor.prometheus_bulk.get_spot_price", return_value=0.5)
+
+    extractor = BulkPrometheusExtractor(FakePrometheusClient(), step=60)
+    job_infos = extractor.extract({100: (T0, T0 + timedelta(minutes=10)), 200: (T0, T0)})
+
+    # Job 200 has no pod
+    assert list(job_infos) == [100]
+    info = job_infos[100]
+
+    assert info.pod.name == POD
+    assert info.pod.cpu_usage_seconds == 600
+    assert info.pod.max_memory == 3e9
+    assert info.pod.avg_memory == 2e9
+    assert info.pod.cpu_request == 2
+    assert info.pod.cpu_limit is None
+    assert info.pod.memory_limit == 8e9
+    assert info.pod.node_occupancy == pytest.approx(0.8)
+
+    assert info.node.system_uuid == uuid.UUID(NODE_UUID)
+    assert info.node.zone == "us-east-1a"
+    assert info.node.spot_price == 0.5
+    assert info.package.name == "zlib"
+    assert info.misc.stack == "e4s"
+
+
+def test_bulk_extraction_naive_windows(mocker):
+    """Windows read from the gitlab database are naive datetimes, in UTC."""
+    mocker.patch("analytics.job_processor.prometheus_bulk.get_spot_price", return_value=0.5)
+
+    naive_t0 = T0.replace(tzinfo=None)
+    extractor = BulkPrometheusExtractor(FakePrometheusClient(), step=60)
+    job_infos = extractor.extract({100: (naive_t0, naive_t0 + timedelta(minutes=10))})
+
+    assert list(job_infos) == [100]
+    assert job_infos[100].pod.node_occupancy == pytest.approx(0.8)
+
+
+def test_pod_usage_pushdown(mocker):
+    recording = json.loads(NODE_CPU_USAGE_PATH.read_text())
+    series = recording["result"]
+    pod = series[0]["metric"]["pod"]
+    node = series[0]["metric"]["node"]
+    start = datetime.fromtimestamp(recording["start"], timezone.utc)
+    end = datetime.fromtimestamp(recording["end"], timezone.utc)
+    memory = [1_000_000 + (i % 7) * 250_000 for i in range(len(series[0]["values"]))]
+
+    # What prometheus returns for each of the queries, evaluated on the recorded series
+    node_cpu = f"container_cpu_usage_seconds_total{{container='build', node='{node}'}}"
+    pod_cpu = f"container_cpu_usage_seconds_total{{container='build', pod='{pod}'}}"
+    pod_memory = f"container_memory_working_set_bytes{{container='build', pod='{pod}'}}"
+    pod_counts = Counter(ts for result in series for ts, _ in result["values"])
+    instant_results = {
+        f"count(last_over_time({node_cpu}[1200s]))": [
+            {"metric": {}, "value": [recording["end"], str(len(series))]}
+        ],
+        (
+            f'label_replace(last_over_time({pod_cpu}[1200s]), "stat", "cpu_usage_seconds", "", "")'
+            f' or label_replace(max_over_time({pod_memory}[1200s]), "stat", "max_memory", "", "")'
+            f' or label_replace(avg_over_time({pod_memory}[1200s]), "stat", "avg_memory", "", "")'
+        ): [
+            {"metric": {"stat": "cpu_usage_seconds"}, "value": [0, series[0]["values"][-1][1]]},
+            {"metric": {"stat": "max_memory"}, "value": [0, str(max(memory))]},
+            {"metric": {"stat": "avg_memory"}, "value": [0, str(sum(memory) / len(memory))]},
+        ],
+    }
+    range_results = {
+        f"count by (node) ({node_cpu})": [
+            {
+                "metric": {"node": node},
+                "values": [[ts, str(count)] for ts, count in sorted(pod_counts.items())],
+            }
+        ],
+    }
+
+    client = PrometheusClient("http://prometheus")
+    query_single = mocker.patch.object(
+        client, "query_single", side_effect=lambda query, time: instant_results[query]
+    )
+    query_range = mocker.patch.object(
+        client, "query_range", side_effect=lambda query, **kwargs: range_results[query]
+    )
+
+    usage = client.get_pod_usage_and_occupancy(pod=pod, node=node, start=start, end=end)
+    assert [call.args[0] for call in query_single.call_args_list] == list(instant_results)
+    assert [call.args[0] for call in query_range.call_args_list] == list(range_results)
+    assert query_range.call_args.kwargs == {"start": start, "end": end, "step": recording["step"]}
+
+    # The results of the previous implementation, which reduced the series of every pod on the
+    # node, and the pod's memory series, in python
+    assert usage.node_occupancy == pytest.approx(0.6541666666666663)
+    assert usage.cpu_usage_seconds == 442.628
+    assert usage.max_memory == 2_500_000
+    assert usage.avg_memory == pytest.approx(1735148.5148514851)
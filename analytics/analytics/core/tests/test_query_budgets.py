@@ -0,0 +1,123 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import pytest
+
+from analytics.core.models.dimensions import JobType
+from analytics.core.models.facts import JobFact, TimerFact, TimerPhaseFact
+from analytics.core.models.rollups import JobDailyRollup
+from analytics.job_processor.build_timings import create_build_timing_facts
+from analytics.job_processor.query_budgets import (
+    BUILD_TIMING_FACTS_QUERY_BUDGET,
+    job_fact_query_budget,
+)
+
+
+class assert_query_budget(CaptureQueriesContext):
+    """Fail if more than `budget` queries are executed, printing every query that was run."""
+
+    def __init__(self, budget: int, label: str):
+        super().__init__(connection)
+        self.budget = budget
+        self.label = label
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None or len(self) <= self.budget:
+            return
+
+        queries = "\n".join(
+            f"{i}. {query['sql']}" for i, query in enumerate(self.captured_queries, start=1)
+        )
+        pytest.fail(
+            f"{self.label} executed {len(self)} queries, exceeding its budget of {self.budget}:"
+            f"\n{queries}"
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "name,stage,status,job_type,job_info",
+    [
+        # Build jobs are named after the package in spec.json
+        [None, "stage-1", "success", JobType.BUILD, "build_job_info"],
+        [None, "stage-1", "failed", JobType.BUILD, "build_job_info"],
+        ["ml-linux-x86_64-generate", "generate", "success", JobType.GENERATE, "empty_job_info"],
+        ["rebuild-index", "stage-rebuild-index", "failed", JobType.REBUILD_INDEX, "empty_job_info"],
+    ],
+)
+def test_create_job_fact_query_budget(
+    request, make_job_fact, name, stage, status, job_type, job_info
+):
+    job_info = request.getfixturevalue(job_info)
+
+    budget = job_fact_query_budget(job_type)
+    with assert_query_budget(budget, label=f"create_job_fact ({job_type})"):
+        job_fact = make_job_fact(9708962, name=name, stage=stage, status=status, job_info=job_info)
+
+    assert job_fact.job_result.job_type == job_type
+
+
+@pytest.mark.django_db
+def test_create_job_fact_once(make_job_fact):
+    job_fact = make_job_fact(9708962, name="rebuild-index", stage="stage-rebuild-index")
+    again = make_job_fact(9708962, name="rebuild-index", stage="stage-rebuild-index")
+
+    assert again.pk == job_fact.pk
+    assert again.start_date_id == job_fact.start_date_id
+    assert JobFact.objects.filter(job_id=9708962).count() == 1
+
+    # The existing fact isn't counted in the rollups again
+    assert sum(JobDailyRollup.objects.values_list("job_count", flat=True)) == 1
+
+
+@pytest.fixture()
+def build_timings_job(mocker, spec_json, build_job_info, make_job_fact, make_gljob):
+    """A successful build job fact, and its gitlab job, with its spec and timings stubbed."""
+    mocker.patch("analytics.job_processor.build_timings.get_spec_json", return_value=spec_json)
+    job_fact = make_job_fact(9708962, job_info=build_job_info)
+    return job_fact, make_gljob(job_id=9708962, status="success")
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("storage", ["rows", "packed"])
+@pytest.mark.parametrize("timer_count", [1, 45])
+def test_create_build_timing_facts_query_budget(
+    mocker, settings, timings, build_timings_job, timer_count, storage
+):
+    settings.TIMER_PHASE_STORAGE = storage
+    mocker.patch(
+        "analytics.job_processor.build_timings.get_timings_json",
+        return_value=timings[:timer_count],
+    )
+    job_fact, gljob = build_timings_job
+
+    # The budget is independent of the number of timers, so that N+1 patterns are caught
+    with assert_query_budget(
+        BUILD_TIMING_FACTS_QUERY_BUDGET,
+        label=f"create_build_timing_facts ({timer_count} timers, {storage} storage)",
+    ):
+        create_build_timing_facts(job_fact=job_fact, gljob=gljob)
+
+
+@pytest.mark.django_db
+def test_packed_phase_storage_matches_rows(mocker, settings, timings, build_timings_job):
+    mocker.patch("analytics.job_processor.build_timings.get_timings_json", return_value=timings)
+    job_fact, gljob = build_timings_job
+
+    def phase_rows():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM core_timerphasefact_all ORDER BY spec_id, phase_id")
+            return cursor.fetchall()
+
+    settings.TIMER_PHASE_STORAGE = "rows"
+    create_build_timing_facts(job_fact=job_fact, gljob=gljob)
+    rows = phase_rows()
+    assert rows
+
+    TimerPhaseFact.objects.all().delete()
+    TimerFact.objects.all().delete()
+
+    settings.TIMER_PHASE_STORAGE = "packed"
+    create_build_timing_facts(job_fact=job_fact, gljob=gljob)
+    assert not TimerPhaseFact.objects.exists()
+    assert phase_rows() == rows
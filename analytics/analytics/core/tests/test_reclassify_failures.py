@@ -0,0 +1,69 @@
+from django.core.management import call_command
+import pytest
+
+from analytics.core.management.commands.reclassify_failures import classify
+from analytics.core.models.facts import JobFact
+
+COMMAND_MODULE = "analytics.core.management.commands.reclassify_failures"
+
+
+@pytest.fixture()
+def failed_jobs(mocker, make_job_fact):
+    """Two failed jobs, classified as "other", with their project ids stubbed."""
+    job_ids = [9708962, 9708963]
+    for job_id in job_ids:
+        make_job_fact(job_id, status="failed")
+
+    mocker.patch(f"{COMMAND_MODULE}.get_gitlab_handle")
+    mocker.patch(
+        f"{COMMAND_MODULE}.get_project_ids",
+        side_effect=lambda ids: {job_id: 2 for job_id in ids},
+    )
+    return job_ids
+
+
+def reclassify(*args: str) -> None:
+    call_command("reclassify_failures", "--start", "2025-01-15", "--processes", "1", *args)
+
+
+def error_classes(job_ids: list[int]) -> dict[int, str]:
+    return dict(
+        JobFact.objects.filter(job_id__in=job_ids).values_list(
+            "job_id", "job_result__error_taxonomy"
+        )
+    )
+
+
+@pytest.mark.django_db
+def test_reclassify_failures(mocker, failed_jobs):
+    mocker.patch(f"{COMMAND_MODULE}.get_job_trace", return_value="curl: (28) Operation timed out")
+    assert set(error_classes(failed_jobs).values()) == {"other"}
+
+    reclassify("--force", "--dry-run")
+    assert set(error_classes(failed_jobs).values()) == {"other"}
+
+    reclassify("--force")
+    assert set(error_classes(failed_jobs).values()) == {"network_timeout"}
+
+
+@pytest.mark.django_db
+def test_reclassify_failures_skips_failing_jobs(mocker, failed_jobs):
+    failing_job_id, job_id = failed_jobs
+
+    def get_job_trace(job):
+        if job.id == failing_job_id:
+            raise RuntimeError("Failed to decode the trace")
+        return "curl: (28) Operation timed out"
+
+    # The project and job are lazy, so their ids are set from the arguments given to them
+    gl = mocker.patch(f"{COMMAND_MODULE}.get_gitlab_handle").return_value
+    gl.projects.get.return_value.jobs.get.side_effect = lambda id, lazy: mocker.Mock(id=id)
+    mocker.patch(f"{COMMAND_MODULE}.get_job_trace", side_effect=get_job_trace)
+
+    reclassify("--force")
+    assert error_classes(failed_jobs) == {failing_job_id: "other", job_id: "network_timeout"}
+
+
+def test_classify_failure(mocker):
+    mocker.patch(f"{COMMAND_MODULE}._assign_error_taxonomy", side_effect=ValueError)
+    assert classify((9708962, "script_failure", "")) == (9708962, None)
@@ -0,0 +1,37 @@
+import pytest
+
+from analytics.job_processor.retries import (
+    DEFAULT_RETRY_CONFIG,
+    RetryInfo,
+    compute_retry_info,
+    parse_retry_config,
+)
+
+RETRY_ON_SYSTEM_FAILURE = {"max": 2, "when": ["runner_system_failure"]}
+
+
+@pytest.mark.parametrize(
+    "attempt_number,retry_config,failure_reason,expected",
+    [
+        # Not retryable
+        (1, DEFAULT_RETRY_CONFIG, "script_failure", RetryInfo(False, False, 1, True)),
+        (1, {"max": None}, "script_failure", RetryInfo(False, False, 1, True)),
+        # Retried automatically, until the max is reached
+        (1, RETRY_ON_SYSTEM_FAILURE, "runner_system_failure", RetryInfo(False, False, 1, False)),
+        (2, RETRY_ON_SYSTEM_FAILURE, "runner_system_failure", RetryInfo(True, False, 2, False)),
+        (3, RETRY_ON_SYSTEM_FAILURE, "runner_system_failure", RetryInfo(True, False, 3, True)),
+        # Not retried for other reasons
+        (1, RETRY_ON_SYSTEM_FAILURE, "script_failure", RetryInfo(False, False, 1, True)),
+        # Attempts past the automatic retries were retried manually
+        (4, RETRY_ON_SYSTEM_FAILURE, "script_failure", RetryInfo(True, True, 4, True)),
+        (2, {"max": 1, "when": ["always"]}, "script_failure", RetryInfo(True, False, 2, True)),
+    ],
+)
+def test_compute_retry_info(attempt_number, retry_config, failure_reason, expected):
+    assert compute_retry_info(attempt_number, retry_config, failure_reason) == expected
+
+
+def test_parse_retry_config():
+    assert parse_retry_config(None) == DEFAULT_RETRY_CONFIG
+    assert parse_retry_config('{"max": 2, "when": ["always"]}') == {"max": 2, "when": ["always"]}
+    assert parse_retry_config({"max": 1}) == {"max": 1}
@@ -0,0 +1,54 @@
+from django.core.management import call_command
+import pytest
+
+from analytics.core.models.rollups import JobDailyRollup
+from analytics.job_processor.rollups import compute_job_rollups, refresh_job_rollups
+
+DATE_KEY = "20250115"
+
+
+def rollup_counts() -> dict[str, int]:
+    return dict(JobDailyRollup.objects.filter(date=DATE_KEY).values_list("status", "job_count"))
+
+
+@pytest.fixture()
+def job_facts(make_job_fact):
+    """Two successful jobs and one failed job, all started on the same day."""
+    make_job_fact(9708962)
+    make_job_fact(9708963)
+    make_job_fact(9708964, status="failed")
+
+
+@pytest.mark.django_db
+def test_update_job_rollup(job_facts):
+    # Jobs with the same key are added to a single row
+    assert rollup_counts() == {"success": 2, "failed": 1}
+
+    # The incrementally maintained rows match those computed from the job facts
+    computed = compute_job_rollups([DATE_KEY])
+    assert sorted((r.status, r.job_count) for r in computed) == [("failed", 1), ("success", 2)]
+
+
+@pytest.mark.django_db
+def test_refresh_job_rollups(job_facts):
+    JobDailyRollup.objects.filter(status="success").update(job_count=5)
+    JobDailyRollup.objects.filter(status="failed").delete()
+
+    assert refresh_job_rollups([DATE_KEY]) == 2
+    assert rollup_counts() == {"success": 2, "failed": 1}
+
+
+@pytest.mark.django_db
+def test_reconcile_rollups(capsys, job_facts):
+    call_command("reconcile_rollups", "--start", "2025-01-14", "--end", "2025-01-16")
+    assert "All rollups between 2025-01-14 and 2025-01-16 are consistent" in capsys.readouterr().out
+
+    JobDailyRollup.objects.filter(status="success").update(job_count=5)
+
+    call_command("reconcile_rollups", "--start", "2025-01-14", "--end", "2025-01-16", "--dry-run")
+    assert f"Found 1 days with drifted rollups: {DATE_KEY}" in capsys.readouterr().out
+    assert rollup_counts() == {"success": 5, "failed": 1}
+
+    call_command("reconcile_rollups", "--start", "2025-01-14", "--end", "2025-01-16")
+    assert "Recomputed 2 rollup rows" in capsys.readouterr().out
+    assert rollup_counts() == {"success": 2, "failed": 1}
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from analytics.core.models.spot_prices import SpotPriceSample
+from analytics.job_processor.spot_prices import get_spot_price, get_stored_spot_price
+
+OFFERING = {"capacity_type": "spot", "instance_type": "c6i.8xlarge", "zone": "us-east-1a"}
+T0 = datetime(2025, 1, 15, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture()
+def samples():
+    SpotPriceSample.objects.bulk_create(
+        [
+            SpotPriceSample(**OFFERING, timestamp=T0, price=1.0),
+            SpotPriceSample(**OFFERING, timestamp=T0 + timedelta(minutes=10), price=3.0),
+        ]
+    )
+
+
+@pytest.mark.django_db
+def test_stored_spot_price_is_time_weighted(samples):
+    price = get_stored_spot_price(
+        **OFFERING, start=T0 + timedelta(minutes=5), end=T0 + timedelta(minutes=15)
+    )
+    assert price == pytest.approx(2.0)
+
+    # A window within a single sample has that sample's price
+    price = get_stored_spot_price(
+        **OFFERING, start=T0 + timedelta(minutes=1), end=T0 + timedelta(minutes=2)
+    )
+    assert price == pytest.approx(1.0)
+
+
+@pytest.mark.django_db
+def test_stored_spot_price_not_covered(samples):
+    assert get_stored_spot_price(**OFFERING, start=T0 - timedelta(hours=1), end=T0) is None
+    assert (
+        get_stored_spot_price(
+            **OFFERING, start=T0 + timedelta(hours=3), end=T0 + timedelta(hours=4)
+        )
+        is None
+    )
+    assert (
+        get_stored_spot_price(
+            **{**OFFERING, "zone": "us-east-1b"}, start=T0, end=T0 + timedelta(minutes=5)
+        )
+        is None
+    )
+
+
+@pytest.mark.django_db
+def test_spot_price_falls_back_to_prometheus(mocker, samples):
+    client = mocker.Mock()
+    client.get_spot_price.return_value = 0.25
+
+    start = T0 + timedelta(hours=3)
+    assert get_spot_price(client, **OFFERING, start=start, end=start) == 0.25
+    client.get_spot_price.assert_called_once()
+
+    client.reset_mock()
+    assert get_spot_price(client, **OFFERING, start=T0, end=T0 + timedelta(minutes=5)) == 1.0
+    client.get_spot_price.assert_not_called()
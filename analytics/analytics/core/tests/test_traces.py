@@ -0,0 +1,204 @@
+import datetime
+import gzip
+import io
+import uuid
+
+from django.db import connection
+import pytest
+from urllib3.response import HTTPResponse
+import zstandard
+
+from analytics.core.models.traces import JobTraceArchive
+from analytics.job_processor.gitlab_db import ARCHIVED_TRACE
+from analytics.job_processor.trace_store import get_trace_store
+from analytics.job_processor.traces import (
+    REMOTE_FILE_STORE,
+    TRACE_FILE_TYPE,
+    ArchivedTrace,
+    get_archived_trace,
+    get_job_trace,
+    get_object_storage_client,
+)
+
+TRACE = "Running with gitlab-runner 17.4.0\nJob succeeded\n"
+
+
+def make_archived_trace(job_id: int, legacy_location=False) -> ArchivedTrace:
+    return ArchivedTrace(
+        artifact_id=555,
+        job_id=job_id,
+        project_id=2,
+        file="job.log",
+        created_at=datetime.datetime(2025, 1, 15, 12, 30, 45),
+        legacy_location=legacy_location,
+    )
+
+
+@pytest.fixture()
+def artifacts_bucket(settings):
+    """A fresh bucket in the local object storage stand-in (minio in docker compose)."""
+    settings.GITLAB_ARTIFACTS_BUCKET = f"test-artifacts-{uuid.uuid4().hex[:8]}"
+    client = get_object_storage_client()
+    client.make_bucket(settings.GITLAB_ARTIFACTS_BUCKET)
+    yield client
+
+    for obj in client.list_objects(settings.GITLAB_ARTIFACTS_BUCKET, recursive=True):
+        client.remove_object(settings.GITLAB_ARTIFACTS_BUCKET, obj.object_name)
+    client.remove_bucket(settings.GITLAB_ARTIFACTS_BUCKET)
+
+
+def test_archived_trace_object_key():
+    trace = make_archived_trace(job_id=1234)
+    assert trace.object_key == (
+        "d4/73/d4735e3a265e16eee03f59718b9b5d03019c07d8b6c51f90da3a666eec13ab35"
+        "/2025_01_15/1234/555/job.log"
+    )
+
+    legacy_trace = make_archived_trace(job_id=1234, legacy_location=True)
+    assert legacy_trace.object_key == "2025_01/2/1234/job.log"
+
+
+def test_get_archived_trace(mocker):
+    trace = make_archived_trace(job_id=1234, legacy_location=True)
+    db = mocker.patch("analytics.job_processor.traces.get_gitlab_db").return_value
+    db.fetchone.return_value = (555, 1234, 2, "job.log", trace.created_at, 1)
+
+    assert get_archived_trace(1234) == trace
+    db.fetchone.assert_called_once_with(ARCHIVED_TRACE, 1234, TRACE_FILE_TYPE, REMOTE_FILE_STORE)
+
+    db.fetchone.return_value = None
+    assert get_archived_trace(1234) is None
+
+
+def test_object_storage_client_is_shared():
+    assert get_object_storage_client() is get_object_storage_client()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_get_job_trace_from_object_storage(mocker, settings, artifacts_bucket, compress):
+    trace = make_archived_trace(job_id=1234)
+    mocker.patch("analytics.job_processor.traces.get_archived_trace", return_value=trace)
+
+    data = TRACE.encode()
+    if compress:
+        data = gzip.compress(data)
+    artifacts_bucket.put_object(
+        settings.GITLAB_ARTIFACTS_BUCKET, trace.object_key, io.BytesIO(data), len(data)
+    )
+
+    gljob = mocker.Mock(id=1234)
+    assert get_job_trace(gljob) == TRACE
+    gljob.trace.assert_not_called()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_get_job_trace_streamed_response(mocker, settings, compress):
+    """Read the trace from a streamed response, which is only closed once the trace is read."""
+    settings.GITLAB_ARTIFACTS_BUCKET = "artifacts"
+    mocker.patch(
+        "analytics.job_processor.traces.get_archived_trace",
+        return_value=make_archived_trace(job_id=1234),
+    )
+
+    data = TRACE.encode()
+    if compress:
+        data = gzip.compress(data)
+    response = HTTPResponse(body=io.BytesIO(data), preload_content=False)
+    client = mocker.patch("analytics.job_processor.traces.get_object_storage_client")
+    client.return_value.get_object.return_value = response
+
+    mocker.patch("analytics.job_processor.traces.TRACE_CHUNK_SIZE", 8)
+    read = mocker.spy(response, "read")
+
+    gljob = mocker.Mock(id=1234)
+    assert get_job_trace(gljob) == TRACE
+    gljob.trace.assert_not_called()
+    assert response.closed
+
+    # The response is never read to its end at once
+    assert all(call.args and call.args[0] is not None for call in read.call_args_list)
+
+
+def test_get_job_trace_missing_object(mocker, artifacts_bucket):
+    mocker.patch(
+        "analytics.job_processor.traces.get_archived_trace",
+        return_value=make_archived_trace(job_id=1234),
+    )
+
+    gljob = mocker.Mock(id=1234)
+    gljob.trace.return_value = TRACE.encode()
+    assert get_job_trace(gljob) == TRACE
+
+
+def test_get_job_trace_not_archived(mocker, artifacts_bucket):
+    mocker.patch("analytics.job_processor.traces.get_archived_trace", return_value=None)
+
+    gljob = mocker.Mock(id=1234)
+    gljob.trace.return_value = TRACE.encode()
+    assert get_job_trace(gljob) == TRACE
+
+
+@pytest.fixture()
+def trace_store(settings, tmp_path):
+    settings.JOB_TRACE_STORE = str(tmp_path)
+    get_trace_store.cache_clear()
+    yield tmp_path
+    get_trace_store.cache_clear()
+
+
+@pytest.mark.django_db
+def test_get_job_trace_through_store(mocker, trace_store):
+    mocker.patch("analytics.job_processor.traces.get_archived_trace", return_value=None)
+
+    gljob = mocker.Mock(id=1234)
+    gljob.trace.return_value = TRACE.encode()
+    assert get_job_trace(gljob) == TRACE
+
+    archive = JobTraceArchive.objects.get(job_id=1234)
+    assert archive.size == len(TRACE)
+    assert (trace_store / archive.key).exists()
+
+    # Subsequent reads are served from the store
+    assert get_job_trace(gljob) == TRACE
+    gljob.trace.assert_called_once()
+
+
+@pytest.mark.django_db
+def test_get_job_trace_indexes_unindexed_traces(mocker, trace_store):
+    (trace_store / "1234").mkdir()
+    (trace_store / "1234" / "abc.log.zst").write_bytes(zstandard.compress(TRACE.encode()))
+
+    gljob = mocker.Mock(id=1234)
+    assert get_job_trace(gljob) == TRACE
+    gljob.trace.assert_not_called()
+    assert JobTraceArchive.objects.filter(job_id=1234).exists()
+
+
+def advisory_locks(job_id: int) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = %s", [job_id]
+        )
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("fails", [False, True])
+def test_trace_store_fetches_outside_transaction(trace_store, fails):
+    def fetch():
+        # Concurrent fetches of the same trace are serialized, without holding a transaction open
+        assert not connection.in_atomic_block
+        assert advisory_locks(1234) == 1
+        if fails:
+            raise ConnectionError("Failed to fetch the trace")
+        return TRACE.encode()
+
+    store = get_trace_store()
+    if fails:
+        with pytest.raises(ConnectionError):
+            store.get(1234, fetch=fetch)
+    else:
+        assert store.get(1234, fetch=fetch) == TRACE.encode()
+
+    assert advisory_locks(1234) == 0
+    assert JobTraceArchive.objects.filter(job_id=1234).exists() != fails
@@ -1,11 +1,15 @@
 import json
 from typing import Any
 
+from dateutil.parser import parse
 from django.http import HttpRequest, HttpResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
 import sentry_sdk
 
+from analytics.core.metrics import IngestCollector, increment, observe_lag
 from analytics.job_processor import process_job
 
 
@@ -21,12 +25,26 @@ def webhook_handler(request: HttpRequest) -> HttpResponse:
     if job_input_data["build_status"] not in ["success", "failed"]:
         return HttpResponse("Build job not finished. Skipping.", status=200)
 
+    # Stamp the webhook with the time it was received, to measure ingestion lag
+    received_at = timezone.now()
+    job_input_data["webhook_received_at"] = received_at.isoformat()
+    increment("webhooks_received")
+    if job_input_data.get("build_finished_at"):
+        observe_lag("webhook", parse(job_input_data["build_finished_at"]), received_at)
+
     # Store gitlab job log and failure data in opensearch
     # TODO: Re-enable once opensearch is fixed
     # from analytics.core.job_log_uploader import store_job_data
     # store_job_data.delay(request.body)
 
     # Store job data in postgres DB
-    process_job.delay(request.body)
+    process_job.delay(json.dumps(job_input_data))
 
     return HttpResponse("OK", status=200)
+
+
+@require_http_methods(["GET"])
+def metrics(request: HttpRequest) -> HttpResponse:
+    registry = CollectorRegistry()
+    registry.register(IngestCollector())
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -1,16 +1,19 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 import json
 import logging
 import re
 
 from celery import shared_task
+from dateutil.parser import isoparse
 from django.db import transaction
+from django.utils import timezone
 import gitlab
 import gitlab.exceptions
 from gitlab.v4.objects import ProjectJob
 from requests.exceptions import RequestException
 
 from analytics import setup_gitlab_job_sentry_tags
+from analytics.core.metrics import record_fact_written
 from analytics.core.models.dimensions import JobType
 from analytics.core.models.facts import JobFact
 from analytics.job_processor.build_timings import create_build_timing_facts
@@ -33,11 +36,9 @@ from analytics.job_processor.metadata import (
     MissingPodInfo,
     retrieve_job_info,
 )
-from analytics.job_processor.utils import (
-    get_gitlab_handle,
-    get_gitlab_job,
-    get_gitlab_project,
-)
+from analytics.job_processor.rollups import update_job_rollup
+from analytics.job_processor.traces import get_job_trace
+from analytics.job_processor.utils import get_gitlab_handle, get_job_metadata
 
 logger = logging.getLogger(__name__)
 
@@ -54,9 +55,16 @@ def create_job_fact(
     gljob: ProjectJob,
     job_input_data: dict,
     job_trace: str,
+    job_info: JobInfo | None = None,
 ) -> JobFact:
     is_build = re.match(BUILD_STAGE_REGEX, job_input_data["build_stage"]) is not None
-    job_info = retrieve_job_info(gljob=gljob, is_build=is_build)
+
+    # Precomputed job info (e.g. from a bulk backfill) lacks the package of builds whose pod
+    # labels weren't found, which can still be retrieved from the job artifacts
+    if job_info is None or (is_build and job_info.package is None):
+        job_info = retrieve_job_info(gljob=gljob, is_build=is_build)
+    elif not is_build:
+        job_info = JobInfo(pod=job_info.pod, node=job_info.node)
 
     start_date, start_time = create_date_time_dimensions(gljob=gljob)
     spack_job = create_spack_job_data_dimension(data=job_info.misc, job_input_data=job_input_data)
@@ -79,69 +87,90 @@ def create_job_fact(
         job_info.node.spot_price / 3600 if job_info.node is not None else None
     )
 
-    # Check that this fact hasn't already been created. If it has, return that value
     job_id = job_input_data["build_id"]
-    existing_job_fact = JobFact.objects.filter(job_id=job_id).first()
-    if existing_job_fact is not None:
-        return existing_job_fact
-
     pod_info = job_info.pod or MissingPodInfo()
     node_info = job_info.node or MissingNodeInfo()
     section_timers = get_gitlab_section_timers(job_trace=job_trace)
 
-    # Hasn't been created yet, create and return it
-    return JobFact.objects.create(
+    # Backfilled jobs weren't received through a webhook
+    webhook_received_at = job_input_data.get("webhook_received_at")
+    if webhook_received_at is not None:
+        webhook_received_at = datetime.fromisoformat(webhook_received_at)
+
+    # The job fact table is partitioned by start date, so its primary key is (job_id, start_date),
+    # and job_id alone isn't unique. A job's start date never changes, so looking it up by both
+    # finds the fact if it was already created, and the primary key stops a concurrent worker from
+    # creating it twice.
+    job_fact, created = JobFact.objects.get_or_create(
         job_id=job_id,
-        # Foreign Keys
         start_date=start_date,
-        start_time=start_time,
-        node=node,
-        runner=runner,
-        package=package,
-        spec=spec,
-        spack_job_data=spack_job,
-        gitlab_job_data=gitlab_job_data,
-        job_result=job_result,
-        job_retry=job_retry_data,
-        # small descriptive data
-        name=job_input_data["build_name"],
-        pod_name=pod_info.name or "",
-        job_url=f"https://gitlab.spack.io/spack/spack-packages/-/jobs/{job_id}",
-        # numeric
-        duration=timedelta(seconds=gljob.duration),
-        duration_seconds=gljob.duration,
-        # Will be null on non-cluster jobs
-        cost=job_cost,
-        pod_node_occupancy=pod_info.node_occupancy,
-        pod_cpu_usage_seconds=pod_info.cpu_usage_seconds,
-        pod_max_mem=pod_info.max_memory,
-        pod_avg_mem=pod_info.avg_memory,
-        node_price_per_second=node_price_per_second,
-        node_cpu=node_info.cpu,
-        node_memory=node_info.memory,
-        # Can be null on any job
-        build_jobs=job_info.misc.build_jobs if job_info.misc else None,
-        pod_cpu_request=pod_info.cpu_request,
-        pod_cpu_limit=pod_info.cpu_limit,
-        pod_memory_request=pod_info.memory_request,
-        pod_memory_limit=pod_info.memory_limit,
-        # Section timer data
-        gitlab_clear_worktree=section_timers.get("clear_worktree", 0),
-        gitlab_after_script=section_timers.get("after_script", 0),
-        gitlab_cleanup_file_variables=section_timers.get("cleanup_file_variables", 0),
-        gitlab_download_artifacts=section_timers.get("download_artifacts", 0),
-        gitlab_get_sources=section_timers.get("get_sources", 0),
-        gitlab_prepare_executor=section_timers.get("prepare_executor", 0),
-        gitlab_prepare_script=section_timers.get("prepare_script", 0),
-        gitlab_resolve_secrets=section_timers.get("resolve_secrets", 0),
-        gitlab_step_script=section_timers.get("step_script", 0),
-        gitlab_upload_artifacts_on_failure=section_timers.get(
-            "upload_artifacts_on_failure", 0
-        ),
-        gitlab_upload_artifacts_on_success=section_timers.get(
-            "upload_artifacts_on_success", 0
-        ),
+        defaults={
+            # Foreign Keys
+            "start_time": start_time,
+            "node": node,
+            "runner": runner,
+            "package": package,
+            "spec": spec,
+            "spack_job_data": spack_job,
+            "gitlab_job_data": gitlab_job_data,
+            "job_result": job_result,
+            "job_retry": job_retry_data,
+            # small descriptive data
+            "name": job_input_data["build_name"],
+            "pod_name": pod_info.name or "",
+            "job_url": f"https://gitlab.spack.io/spack/spack-packages/-/jobs/{job_id}",
+            # numeric
+            "duration": timedelta(seconds=gljob.duration),
+            "duration_seconds": gljob.duration,
+            # Will be null on non-cluster jobs
+            "cost": job_cost,
+            "pod_node_occupancy": pod_info.node_occupancy,
+            "pod_cpu_usage_seconds": pod_info.cpu_usage_seconds,
+            "pod_max_mem": pod_info.max_memory,
+            "pod_avg_mem": pod_info.avg_memory,
+            "node_price_per_second": node_price_per_second,
+            "node_cpu": node_info.cpu,
+            "node_memory": node_info.memory,
+            # Can be null on any job
+            "build_jobs": job_info.misc.build_jobs if job_info.misc else None,
+            "pod_cpu_request": pod_info.cpu_request,
+            "pod_cpu_limit": pod_info.cpu_limit,
+            "pod_memory_request": pod_info.memory_request,
+            "pod_memory_limit": pod_info.memory_limit,
+            # Section timer data
+            "gitlab_clear_worktree": section_timers.get("clear_worktree", 0),
+            "gitlab_after_script": section_timers.get("after_script", 0),
+            "gitlab_cleanup_file_variables": section_timers.get("cleanup_file_variables", 0),
+            "gitlab_download_artifacts": section_timers.get("download_artifacts", 0),
+            "gitlab_get_sources": section_timers.get("get_sources", 0),
+            "gitlab_prepare_executor": section_timers.get("prepare_executor", 0),
+            "gitlab_prepare_script": section_timers.get("prepare_script", 0),
+            "gitlab_resolve_secrets": section_timers.get("resolve_secrets", 0),
+            "gitlab_step_script": section_timers.get("step_script", 0),
+            "gitlab_upload_artifacts_on_failure": section_timers.get(
+                "upload_artifacts_on_failure", 0
+            ),
+            "gitlab_upload_artifacts_on_success": section_timers.get(
+                "upload_artifacts_on_success", 0
+            ),
+            # Ingestion timestamps
+            "webhook_received_at": webhook_received_at,
+            "processed_at": timezone.now(),
+        },
     )
+    if not created:
+        return job_fact
+
+    # Keep the daily rollups in sync, as part of the same transaction
+    update_job_rollup(job_fact)
+
+    # The finished_at field is generated by the database, so compute it here
+    finished_at = isoparse(gljob.started_at) + timedelta(seconds=gljob.duration)
+    transaction.on_commit(
+        lambda: record_fact_written(finished_at=finished_at, received_at=webhook_received_at)
+    )
+
+    return job_fact
 
 
 @shared_task(
@@ -152,21 +181,30 @@ def create_job_fact(
 def process_job(job_input_data_json: str):
     # Read input data and extract params
     job_input_data = json.loads(job_input_data_json)
+    process_job_data(job_input_data)
+
+
+def process_job_data(job_input_data: dict, job_info: JobInfo | None = None) -> None:
+    """
+    Process a job from its webhook payload.
+
+    `job_info` may be given if it's already been retrieved, e.g. by a bulk backfill. Otherwise it's
+    retrieved from prometheus (or the job artifacts).
+    """
     setup_gitlab_job_sentry_tags(job_input_data)
 
-    # Retrieve project and job from gitlab API
+    # Retrieve the job from the gitlab DB, or the gitlab API if that fails
     gl = get_gitlab_handle()
-    gl_project = get_gitlab_project(job_input_data["project_id"])
-    gl_job = get_gitlab_job(gl_project, job_input_data["build_id"])
+    gl_job = get_job_metadata(job_input_data["project_id"], job_input_data["build_id"])
 
     # In this case, don't bother processing the job, as it likely never started.
     if gl_job.started_at is None:
         logger.info("Build found with no start time. Skipping...")
         return
 
-    job_trace: str = gl_job.trace().decode()  # type: ignore
+    job_trace = get_job_trace(gl_job)
     with transaction.atomic():
-        job = create_job_fact(gl, gl_job, job_input_data, job_trace)
+        job = create_job_fact(gl, gl_job, job_input_data, job_trace, job_info=job_info)
 
     # Create build timing facts in a separate transaction, in case this fails
     with transaction.atomic():
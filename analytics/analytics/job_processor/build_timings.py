@@ -1,5 +1,6 @@
 import json
 
+from django.conf import settings
 from gitlab.v4.objects import ProjectJob
 
 from analytics.core.models.dimensions import (
@@ -129,6 +130,7 @@ def create_build_timing_facts(job_fact: JobFact, gljob: ProjectJob):
     phase_mapping = get_phase_mapping(timings=timings)
 
     # Now that we have all the dimensions covered, go through and construct facts to bulk create
+    packed = settings.TIMER_PHASE_STORAGE == "packed"
     timer_facts = []
     phase_facts = []
     for entry in timings:
@@ -140,17 +142,22 @@ def create_build_timing_facts(job_fact: JobFact, gljob: ProjectJob):
 
         timer_data = timer_data_mapping[entry["cache"]]
         total_time = entry["total"]
-        timer_facts.append(
-            TimerFact(
-                job_id=job_fact.job_id,
-                date=job_fact.start_date,
-                time=job_fact.start_time,
-                timer_data=timer_data,
-                package=package,
-                spec=spec,
-                total_duration=total_time,
-            )
+        timer_fact = TimerFact(
+            job_id=job_fact.job_id,
+            date=job_fact.start_date,
+            time=job_fact.start_time,
+            timer_data=timer_data,
+            package=package,
+            spec=spec,
+            total_duration=total_time,
         )
+        timer_facts.append(timer_fact)
+
+        # In packed mode, all phases are stored on the timer fact itself
+        if packed:
+            timer_fact.phase_ids = [phase_mapping[phase["path"]].id for phase in entry["phases"]]
+            timer_fact.phase_durations = [phase["seconds"] for phase in entry["phases"]]
+            continue
 
         # Add all phases to bulk phase list
         for phase in entry["phases"]:
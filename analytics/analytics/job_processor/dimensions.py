@@ -1,10 +1,8 @@
 import re
-from pathlib import Path
 from typing import Any
 
 import gitlab
 import gitlab.exceptions
-import yaml
 from gitlab.v4.objects import ProjectJob
 
 from analytics.core.models.dimensions import (
@@ -21,6 +19,7 @@ from analytics.core.models.dimensions import (
     TimeDimension,
 )
 from analytics.job_processor.metadata import JobMiscInfo, NodeInfo, PackageInfo
+from analytics.job_processor.taxonomy import load_error_taxonomy
 from analytics.job_processor.utils import get_job_exit_code, get_job_retry_data
 
 UNNECESSARY_JOB_REGEX = re.compile(r"No need to rebuild [^,]+, found hash match")
@@ -37,26 +36,18 @@ def _assign_error_taxonomy(job_input_data: dict[str, Any], job_trace: str):
     if job_input_data["build_status"] != "failed":
         raise ValueError("This function should only be called for failed jobs")
 
-    # Read taxonomy file
-    with open(Path(__file__).parent / "error_taxonomy.yaml") as f:
-        taxonomy = yaml.load(f, Loader=yaml.CSafeLoader)["taxonomy"]
+    taxonomy = load_error_taxonomy()
+    error_taxonomy_version = taxonomy.version
 
-    error_taxonomy_version = taxonomy["version"]
-
-    # Compile matching patterns from job trace
-    matching_patterns = set()
-    for error_class, lookups in taxonomy["error_classes"].items():
-        if lookups:
-            for grep_expr in lookups.get("grep_for", []):
-                if re.compile(grep_expr).search(job_trace):
-                    matching_patterns.add(error_class)
+    # Find the error classes with patterns matching the job trace
+    matching_patterns = taxonomy.matching_classes(job_trace)
 
     # If the job logs matched any regexes, assign it the taxonomy
     # with the highest priority in the "deconflict order".
     # Otherwise, assign it a taxonomy of "other".
     job_error_class = None
     if len(matching_patterns):
-        for error_class in taxonomy["deconflict_order"]:
+        for error_class in taxonomy.deconflict_order:
             if error_class in matching_patterns:
                 job_error_class = error_class
                 break
@@ -151,10 +142,10 @@ def create_gitlab_job_data_dimension(
 
 def create_job_result_dimension(job_input_data: dict, job_trace: str):
     status = job_input_data["build_status"]
-    error_taxonomy = (
-        _assign_error_taxonomy(job_input_data, job_trace)[0]
+    error_taxonomy, error_taxonomy_version = (
+        _assign_error_taxonomy(job_input_data, job_trace)
         if status == "failed"
-        else None
+        else (None, None)
     )
     job_exit_code = get_job_exit_code(job_id=job_input_data["build_id"])
     job_failure_reason: str = job_input_data["build_failure_reason"]
@@ -162,6 +153,7 @@ def create_job_result_dimension(job_input_data: dict, job_trace: str):
     res, _ = JobResultDimension.objects.get_or_create(
         status=status,
         error_taxonomy=error_taxonomy,
+        error_taxonomy_version=error_taxonomy_version,
         unnecessary=unnecessary,
         job_type=determine_job_type(job_input_data=job_input_data),
         job_exit_code=job_exit_code,
@@ -214,6 +206,7 @@ def create_node_dimension(info: NodeInfo | None) -> NodeDimension:
             "memory": info.memory,
             "capacity_type": info.capacity_type,
             "instance_type": info.instance_type,
+            "zone": info.zone,
         },
     )
 
@@ -232,14 +225,17 @@ def create_runner_dimension(gl: gitlab.Gitlab, gljob: ProjectJob) -> RunnerDimen
     if existing_runner is not None:
         return existing_runner
 
-    # Attempt to fetch this runner from gitlab
-    try:
-        runner = gl.runners.get(runner_id)
-    except gitlab.exceptions.GitlabGetError as e:
-        if e.response_code != 404:
-            raise
-
-        return empty_runner
+    # Jobs read from the gitlab database already include the runner details. Otherwise, attempt
+    # to fetch this runner from gitlab.
+    runner = getattr(gljob, "runner_details", None)
+    if runner is None:
+        try:
+            runner = gl.runners.get(runner_id)
+        except gitlab.exceptions.GitlabGetError as e:
+            if e.response_code != 404:
+                raise
+
+            return empty_runner
 
     in_cluster = False
     host = "unknown"
@@ -0,0 +1,243 @@
+"""
+Pooled access to the gitlab database replica, for the queries run for every job (or every scrape
+of the metrics).
+
+Connections are kept in a bounded pool for the lifetime of each worker process, and the hot
+queries are prepared once per connection and then executed by name, so that the replica can reuse
+their plans. Every statement runs with the configured timeout, and its latency is recorded.
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import cache
+import logging
+import threading
+import time
+
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+from django.db import connections
+import psycopg2
+import psycopg2.extensions
+
+from analytics.core.metrics import observe_query_latency
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Statement:
+    name: str
+    sql: str
+
+
+RETRY_ATTEMPTS = Statement(
+    name="retry_attempts",
+    # In gitlab, the pipeline ID is stored as `commit_id`.
+    # The prior attempts for a given job are all jobs with a lower id, the same commit_id, and
+    # the same name.
+    # It's important to filter for a lower job id in the event that the webhook is delayed or
+    # received out of order.
+    sql="""
+    SELECT COUNT(*)
+    FROM p_ci_builds
+    WHERE id < $1
+    AND commit_id = $2
+    AND name = $3
+    """,
+)
+RETRY_CONFIG = Statement(
+    name="retry_config",
+    sql="""
+    SELECT jd.config->'options'->'retry'
+    FROM p_ci_job_definition_instances jdi
+    INNER JOIN p_ci_job_definitions jd on jd.id = jdi.job_definition_id
+    WHERE jdi.job_id = $1
+    """,
+)
+# For jobs earlier than Nov 12 2025, the retry config may exist in the old table
+# TODO: Remove once sufficient time has passed.
+LEGACY_RETRY_CONFIG = Statement(
+    name="legacy_retry_config",
+    sql="""
+    SELECT bm.config_options->>'retry'
+    FROM p_ci_builds_metadata bm
+    WHERE bm.build_id = $1
+    """,
+)
+EXIT_CODE = Statement(
+    name="exit_code",
+    sql="""
+    SELECT exit_code
+    FROM p_ci_builds_metadata
+    WHERE build_id = $1
+    """,
+)
+# A finished job and its runner, with the columns used by `get_gitlab_db_job`
+JOB = Statement(
+    name="job",
+    sql="""
+    SELECT
+        b.id,
+        b.project_id,
+        b.name,
+        b.status,
+        b.ref,
+        b.started_at,
+        EXTRACT(EPOCH FROM (b.finished_at - b.started_at))::float AS duration,
+        ARRAY(
+            SELECT t.name
+            FROM p_ci_build_tags bt
+            INNER JOIN tags t ON t.id = bt.tag_id
+            WHERE bt.build_id = b.id AND bt.partition_id = b.partition_id
+            ORDER BY t.name
+        ) AS tag_list,
+        r.id AS runner_id,
+        r.description AS runner_description,
+        rm.platform AS runner_platform,
+        rm.architecture AS runner_architecture,
+        ARRAY(
+            SELECT t.name
+            FROM ci_runner_taggings rt
+            INNER JOIN tags t ON t.id = rt.tag_id
+            WHERE rt.runner_id = r.id
+            ORDER BY t.name
+        ) AS runner_tag_list
+    FROM p_ci_builds b
+    LEFT JOIN ci_runners r ON r.id = b.runner_id
+    LEFT JOIN p_ci_runner_machine_builds rmb
+        ON rmb.build_id = b.id AND rmb.partition_id = b.partition_id
+    LEFT JOIN ci_runner_machines rm ON rm.id = rmb.runner_machine_id
+    WHERE b.id = $1
+    """,
+)
+# The latest trace artifact of a job with the given file type, in the given file store
+ARCHIVED_TRACE = Statement(
+    name="archived_trace",
+    sql="""
+    SELECT id, job_id, project_id, file, created_at, file_location
+    FROM p_ci_job_artifacts
+    WHERE job_id = $1
+    AND file_type = $2
+    AND file_store = $3
+    ORDER BY id DESC
+    LIMIT 1
+    """,
+)
+# Finished jobs of spack/spack-packages, matching what backfill_jobs considers
+FINISHED_JOBS = Statement(
+    name="finished_jobs",
+    sql="""
+    SELECT id
+    FROM p_ci_builds
+    WHERE project_id = 57
+    AND type = 'Ci::Build'
+    AND status IN ('success', 'failed')
+    AND finished_at BETWEEN $1 AND $2
+    """,
+)
+PROJECT_IDS = Statement(
+    name="project_ids",
+    sql="""
+    SELECT id, project_id
+    FROM p_ci_builds
+    WHERE id = ANY($1)
+    """,
+)
+
+
+class GitlabDBConnection(psycopg2.extensions.connection):
+    """A connection that tracks the statements prepared on it."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared: set[str] = set()
+
+
+class GitlabDB:
+    def __init__(self, pool_size: int, statement_timeout_ms: int) -> None:
+        # The connection parameters of the "gitlab" database, as configured for Django
+        self.params = connections["gitlab"].get_connection_params()
+        self.statement_timeout_ms = statement_timeout_ms
+
+        # Connections are opened on demand, up to `pool_size` of them, and kept open once returned
+        self._idle: list[GitlabDBConnection] = []
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self) -> GitlabDBConnection:
+        conn = psycopg2.connect(connection_factory=GitlabDBConnection, **self.params)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", [self.statement_timeout_ms])
+
+            # Gitlab stores timestamps in UTC, so compare and return them in UTC, like Django does
+            cursor.execute("SET TIME ZONE 'UTC'")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._available:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None or conn.closed:
+                conn = self._connect()
+
+            try:
+                yield conn
+            except BaseException:
+                # The connection may be broken or mid-query, so don't reuse it
+                conn.close()
+                raise
+
+            with self._lock:
+                self._idle.append(conn)
+
+    def execute(self, statement: Statement, *params) -> list[tuple]:
+        """Execute a prepared statement, preparing it first if this connection hasn't yet."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            if statement.name not in conn.prepared:
+                cursor.execute(f"PREPARE {statement.name} AS {statement.sql}")
+                conn.prepared.add(statement.name)
+
+            start = time.perf_counter()
+            if params:
+                placeholders = ", ".join(["%s"] * len(params))
+                cursor.execute(f"EXECUTE {statement.name} ({placeholders})", params)
+            else:
+                cursor.execute(f"EXECUTE {statement.name}")
+            rows = cursor.fetchall()
+
+        observe_query_latency(statement.name, time.perf_counter() - start)
+        return rows
+
+    def fetchone(self, statement: Statement, *params) -> tuple | None:
+        rows = self.execute(statement, *params)
+        return rows[0] if rows else None
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+@cache
+def get_gitlab_db() -> GitlabDB:
+    """Return the gitlab database pool of this process, creating it if necessary."""
+    return GitlabDB(
+        pool_size=settings.GITLAB_DB_POOL_SIZE,
+        statement_timeout_ms=settings.GITLAB_DB_STATEMENT_TIMEOUT,
+    )
+
+
+@worker_process_init.connect
+def reset_gitlab_db(**kwargs) -> None:
+    # Connections can't be shared with the parent process, so each worker creates its own pool
+    get_gitlab_db.cache_clear()
+
+
+@worker_process_shutdown.connect
+def close_gitlab_db(**kwargs) -> None:
+    if get_gitlab_db.cache_info().currsize:
+        get_gitlab_db().close()
@@ -18,6 +18,7 @@ from analytics.job_processor.prometheus import (
     PrometheusClient,
     UnexpectedPrometheusResult,
 )
+from analytics.job_processor.spot_prices import get_spot_price
 
 
 @dataclass(frozen=True)
@@ -75,6 +76,7 @@ class NodeInfo:
     capacity_type: str
     instance_type: str
     spot_price: float
+    zone: str | None = None
 
 
 @dataclass(frozen=True)
@@ -88,6 +90,7 @@ class MissingNodeInfo:
     capacity_type = None
     instance_type = None
     spot_price = None
+    zone = None
 
 
 @dataclass(frozen=True)
@@ -112,6 +115,14 @@ def retrieve_job_prometheus_info(gljob: ProjectJob, is_build: bool):
         pod=pod_name, start=start, end=end
     )
     node_data = client.get_pod_node_data(pod=pod_name, start=start, end=end)
+    spot_price = get_spot_price(
+        client,
+        capacity_type=node_data.capacity_type,
+        instance_type=node_data.instance_type,
+        zone=node_data.zone,
+        start=start,
+        end=end,
+    )
     resource_usage = client.get_pod_usage_and_occupancy(
         pod=pod_name, node=node_data.name, start=start, end=end
     )
@@ -123,7 +134,8 @@ def retrieve_job_prometheus_info(gljob: ProjectJob, is_build: bool):
         memory=node_data.memory,
         capacity_type=node_data.capacity_type,
         instance_type=node_data.instance_type,
-        spot_price=node_data.spot_price,
+        spot_price=spot_price,
+        zone=node_data.zone,
     )
     pod_info = PodInfo(
         name=pod_name,
@@ -74,7 +74,7 @@ class NodeData:
     memory: int
     capacity_type: str
     instance_type: str
-    spot_price: float
+    zone: str
 
 
 def calculate_node_occupancy(data: list[dict], step: int):
@@ -103,6 +103,18 @@ def calculate_node_occupancy(data: list[dict], step: int):
 
             timeline[val] += 1
 
+    return calculate_node_occupancy_from_counts(timeline, step)
+
+
+def calculate_node_occupancy_from_counts(timeline: dict[float, int], step: int):
+    """
+    Determine node occupancy from the number of pods present on the node at each timestamp.
+
+    This is the same computation as `calculate_node_occupancy`, for when the pod counts have
+    already been computed (e.g. by prometheus).
+    """
+    # Don't modify the caller's timeline
+    timeline = dict(timeline)
     start = min(timeline.keys())
     end = max(timeline.keys())
 
@@ -250,62 +262,65 @@ class PrometheusClient:
 
         # Custom step for finer grain results
         step = math.ceil(duration.total_seconds() / 100)
-
-        # Get cpu seconds usage
-        cpu_seconds_query = f"container_cpu_usage_seconds_total{{container='build', node='{node}'}}"
-        results = self.query_range(
-            cpu_seconds_query,
-            start=start,
-            end=end,
-            step=step,
-        )
-
-        # Require more than one timeline value for the node, as we
-        # need a range of values, not just a single point in time.
-        if len(results) == 1:
+        window = f"{max(math.ceil(duration.total_seconds()), 1)}s"
+
+        # Require more than one pod on the node, as we need a range of values, not just a
+        # single point in time.
+        node_cpu_seconds = f"container_cpu_usage_seconds_total{{container='build', node='{node}'}}"
+        pod_count_query = f"count(last_over_time({node_cpu_seconds}[{window}]))"
+        pod_count = self.query_single(pod_count_query, time=end)
+        if not pod_count or int(pod_count[0]["value"][1]) == 1:
             raise UnexpectedPrometheusResult(
                 message=f"Node {node} only returned 1 timeline value",
-                query=cpu_seconds_query,
+                query=pod_count_query,
             )
 
-        # First, get the cpu utlization by the pod we care about
-        # To do this, just get the last value from the response, since that'll be the total of the counter
-        pod_results = next((res for res in results if res["metric"]["pod"] == pod), None)
-        if pod_results is None:
+        # The number of pods on the node at each step gives the node occupancy, without
+        # retrieving the usage of every pod
+        counts_query = f"count by (node) ({node_cpu_seconds})"
+        counts = self.query_range(counts_query, start=start, end=end, step=step)
+        if not counts:
             raise UnexpectedPrometheusResult(
-                message=f"Pod {pod} not found in cpu usage query",
-                query=cpu_seconds_query,
+                message=f"Node {node} not found in pod count query",
+                query=counts_query,
             )
 
-        cpu_usage_seconds = float(pod_results["values"][-1][1])
-
-        # Then use the same cpu usage results to determine node occupancy, since it gives us a timline of pods on this node
-        node_occupancy = calculate_node_occupancy(results, step)
+        timeline = {ts: int(count) for ts, count in counts[0]["values"]}
+        node_occupancy = calculate_node_occupancy_from_counts(timeline, step)
+
+        # The cpu usage is the last value of the counter, and memory usage is summarized over the
+        # lifetime of the pod. Each statistic is labeled, so they can be retrieved at once.
+        cpu_seconds = f"container_cpu_usage_seconds_total{{container='build', pod='{pod}'}}"
+        memory = f"container_memory_working_set_bytes{{container='build', pod='{pod}'}}"
+        stats = {
+            "cpu_usage_seconds": f"last_over_time({cpu_seconds}[{window}])",
+            "max_memory": f"max_over_time({memory}[{window}])",
+            "avg_memory": f"avg_over_time({memory}[{window}])",
+        }
+        stats_query = " or ".join(
+            f'label_replace({query}, "stat", "{stat}", "", "")' for stat, query in stats.items()
+        )
+        values = {
+            result["metric"]["stat"]: float(result["value"][1])
+            for result in self.query_single(stats_query, time=end)
+        }
 
-        # Finally, determine the node memory usage
-        memory_usage: list = self.query_range(
-            f"container_memory_working_set_bytes{{container='build', pod='{pod}'}}",
-            start=start,
-            end=end,
-            step=step,
-            single_result=True,
-        )["values"]
-        if not memory_usage:
+        if "cpu_usage_seconds" not in values:
+            raise UnexpectedPrometheusResult(
+                message=f"Pod {pod} not found in cpu usage query",
+                query=stats_query,
+            )
+        if "max_memory" not in values or "avg_memory" not in values:
             raise UnexpectedPrometheusResult(
                 message=f"Pod {pod} not found in memory usage query",
-                query=cpu_seconds_query,
+                query=stats_query,
             )
 
-        # Results consist of arrays: [timestamp, "value"]
-        byte_values = [int(x) for _, x in memory_usage]
-        max_mem = max(byte_values)
-        avg_mem = statistics.mean(byte_values)
-
         return PodResourceUsage(
-            cpu_usage_seconds=cpu_usage_seconds,
+            cpu_usage_seconds=values["cpu_usage_seconds"],
             node_occupancy=node_occupancy,
-            max_memory=max_mem,
-            avg_memory=avg_mem,
+            max_memory=int(values["max_memory"]),
+            avg_memory=values["avg_memory"],
         )
 
     def get_pod_name_from_gitlab_job(self, gljob: ProjectJob) -> str | None:
@@ -342,6 +357,11 @@ class PrometheusClient:
             f"kube_pod_labels{{pod='{pod}'}}", start=start, end=end, single_result=True
         )["metric"]
 
+        return self.parse_pod_labels(pod=pod, annotations=annotations, labels=labels)
+
+    @staticmethod
+    def parse_pod_labels(pod: str, annotations: dict, labels: dict) -> PodLabels:
+        """Extract the spack job labels from the annotations and labels of a pod."""
         try:
             package_hash = annotations["annotation_metrics_spack_job_spec_hash"]
             package_name = annotations["annotation_metrics_spack_job_spec_pkg_name"]
@@ -415,10 +435,24 @@ class PrometheusClient:
         memory = int(parse_quantity(f"{node_labels['label_karpenter_k8s_aws_instance_memory']}M"))
         capacity_type = node_labels["label_karpenter_sh_capacity_type"]
         instance_type = node_labels["label_node_kubernetes_io_instance_type"]
-
-        # Retrieve the price of this node. Since this price can change in the middle of this job's
-        # lifetime, we return all values from this query and average them.
         zone = node_labels["label_topology_kubernetes_io_zone"]
+
+        # Save and set as job node
+        return NodeData(
+            name=node_name,
+            system_uuid=node_system_uuid,
+            cpu=cpu,
+            memory=memory,
+            capacity_type=capacity_type,
+            instance_type=instance_type,
+            zone=zone,
+        )
+
+    def get_spot_price(
+        self, capacity_type: str, instance_type: str, zone: str, start: datetime, end: datetime
+    ) -> float:
+        # Since this price can change in the middle of this job's lifetime, we return all values
+        # from this query and average them.
         price_query = f"""
             karpenter_cloudprovider_instance_type_offering_price_estimate{{
                 capacity_type='{capacity_type}',
@@ -433,17 +467,6 @@ class PrometheusClient:
                 query=price_query,
             )
 
-        spot_price = statistics.mean(
+        return statistics.mean(
             [float(val[1]) for result in spot_prices_result for val in result["values"]]
         )
-
-        # Save and set as job node
-        return NodeData(
-            name=node_name,
-            system_uuid=node_system_uuid,
-            cpu=cpu,
-            memory=memory,
-            capacity_type=capacity_type,
-            instance_type=instance_type,
-            spot_price=spot_price,
-        )
@@ -0,0 +1,286 @@
+"""
+Bulk extraction of job info from prometheus, for backfilling many jobs at once.
+
+Retrieving the info of a single job takes about ten narrow queries. Instead, the bulk extractor
+retrieves the annotations, labels, pod info and usage of every CI pod within a time window, split
+into sub-windows, and joins them to jobs locally by the `annotation_gitlab_ci_job_id` annotation.
+This takes a fixed number of queries per sub-window, regardless of the number of jobs.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import logging
+import uuid
+
+from kubernetes.utils.quantity import parse_quantity
+
+from analytics.job_processor.metadata import (
+    JobInfo,
+    JobMiscInfo,
+    NodeInfo,
+    PackageInfo,
+    PodInfo,
+)
+from analytics.job_processor.prometheus import (
+    PodLabelNotFound,
+    PrometheusClient,
+    UnexpectedPrometheusResult,
+    calculate_node_occupancy_from_counts,
+)
+from analytics.job_processor.spot_prices import get_spot_price
+
+logger = logging.getLogger(__name__)
+
+# The amount of time covered by each set of queries
+BULK_SUB_WINDOW = timedelta(hours=1)
+
+# The resolution of the pod count series that node occupancy is computed from
+BULK_STEP = 30
+
+CI_POD_ANNOTATIONS = "kube_pod_annotations{annotation_gitlab_ci_job_id=~'.+'}"
+
+NODE_LABELS = (
+    "kube_node_labels{label_karpenter_sh_initialized='true', "
+    "label_topology_ebs_csi_aws_com_zone=~'.+'}"
+)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # Gitlab stores timestamps in UTC, without a timezone
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _as_number(value: str) -> int | float:
+    num = float(value)
+    return int(num) if num.is_integer() else num
+
+
+@dataclass
+class _PodData:
+    job_id: int
+    pod: str
+    annotations: dict
+    labels: dict | None = None
+    node: str | None = None
+    requests: dict[str, int | float] = field(default_factory=dict)
+    limits: dict[str, int | float] = field(default_factory=dict)
+    cpu_usage_seconds: float | None = None
+    max_memory: int | None = None
+    memory_sum: float = 0
+    memory_samples: int = 0
+
+
+class BulkPrometheusExtractor:
+    def __init__(
+        self,
+        client: PrometheusClient,
+        sub_window: timedelta = BULK_SUB_WINDOW,
+        step: int = BULK_STEP,
+    ) -> None:
+        self.client = client
+        self.sub_window = sub_window
+        self.step = step
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pods: dict[str, _PodData] = {}
+        self._node_uuids: dict[str, str] = {}
+        self._node_labels: dict[str, dict] = {}
+        self._node_counts: dict[str, dict[float, int]] = defaultdict(dict)
+
+    def _ci_pods(self, query: str, window: str, time: datetime) -> list[dict]:
+        """Run an instant query, restricted to CI pods present in the window ending at time."""
+        ci_pods = f"last_over_time({CI_POD_ANNOTATIONS}[{window}])"
+        return self.client.query_single(f"({query}) and on (pod) {ci_pods}", time=time)
+
+    def _extract_sub_window(self, start: datetime, end: datetime, job_ids: set[int]) -> None:
+        # The range of the instant queries at the end of this sub-window, which must not overlap
+        # the previous sub-window, as samples are summed across sub-windows
+        window = f"{int((end - start).total_seconds())}s"
+
+        for result in self.client.query_single(
+            f"last_over_time({CI_POD_ANNOTATIONS}[{window}])", time=end
+        ):
+            metric = result["metric"]
+            job_id = int(metric["annotation_gitlab_ci_job_id"])
+            if job_id not in job_ids:
+                continue
+
+            pod = self._pods.setdefault(
+                metric["pod"], _PodData(job_id=job_id, pod=metric["pod"], annotations=metric)
+            )
+            pod.annotations = metric
+
+        def pod_results(query: str):
+            for result in self._ci_pods(query, window=window, time=end):
+                pod = self._pods.get(result["metric"].get("pod"))
+                if pod is not None:
+                    yield pod, result
+
+        for pod, result in pod_results(f"last_over_time(kube_pod_labels[{window}])"):
+            pod.labels = result["metric"]
+
+        pod_info = f"last_over_time(kube_pod_info{{node=~'.+', pod_ip=~'.+'}}[{window}])"
+        for pod, result in pod_results(pod_info):
+            pod.node = result["metric"]["node"]
+
+        for kind in ("requests", "limits"):
+            resources = f"kube_pod_container_resource_{kind}{{container='build'}}"
+            for pod, result in pod_results(f"last_over_time({resources}[{window}])"):
+                getattr(pod, kind)[result["metric"]["resource"]] = _as_number(result["value"][1])
+
+        # The cpu usage counter only increases, so its maximum is its last value
+        cpu_usage = "container_cpu_usage_seconds_total{container='build'}"
+        for pod, result in pod_results(f"max_over_time({cpu_usage}[{window}])"):
+            pod.cpu_usage_seconds = max(pod.cpu_usage_seconds or 0, float(result["value"][1]))
+
+        memory = f"container_memory_working_set_bytes{{container='build'}}[{window}]"
+        for pod, result in pod_results(f"max_over_time({memory})"):
+            pod.max_memory = max(pod.max_memory or 0, int(float(result["value"][1])))
+        for pod, result in pod_results(f"sum_over_time({memory})"):
+            pod.memory_sum += float(result["value"][1])
+        for pod, result in pod_results(f"count_over_time({memory})"):
+            pod.memory_samples += int(result["value"][1])
+
+        for result in self.client.query_single(f"last_over_time(kube_node_info[{window}])", end):
+            self._node_uuids[result["metric"]["node"]] = result["metric"]["system_uuid"]
+        for result in self.client.query_single(f"last_over_time({NODE_LABELS}[{window}])", end):
+            self._node_labels[result["metric"]["node"]] = result["metric"]
+
+        # The number of CI pods on each node at each step, for node occupancy
+        for result in self.client.query_range(
+            "count by (node) (container_cpu_usage_seconds_total{container='build'})",
+            start=start,
+            end=end,
+            step=self.step,
+        ):
+            counts = self._node_counts[result["metric"]["node"]]
+            for timestamp, value in result["values"]:
+                counts[float(timestamp)] = int(value)
+
+    def _job_info(self, pod: _PodData, start: datetime, end: datetime) -> JobInfo | None:
+        node = pod.node
+        if (
+            node is None
+            or node not in self._node_uuids
+            or node not in self._node_labels
+            or pod.cpu_usage_seconds is None
+            or pod.max_memory is None
+            or not pod.memory_samples
+        ):
+            return None
+
+        counts = {
+            timestamp: count
+            for timestamp, count in self._node_counts[node].items()
+            if start.timestamp() <= timestamp <= end.timestamp()
+        }
+
+        # Lone pods are treated as unexpected when retrieving a single job's info, so leave them
+        # to that path, so that backfilled jobs match the jobs processed as they finish
+        if not counts or all(count == 1 for count in counts.values()):
+            return None
+
+        node_labels = self._node_labels[node]
+        capacity_type = node_labels["label_karpenter_sh_capacity_type"]
+        instance_type = node_labels["label_node_kubernetes_io_instance_type"]
+        zone = node_labels["label_topology_kubernetes_io_zone"]
+
+        # It seems these values are in Megabytes (base 1000)
+        memory = int(parse_quantity(f"{node_labels['label_karpenter_k8s_aws_instance_memory']}M"))
+        try:
+            spot_price = get_spot_price(
+                self.client,
+                capacity_type=capacity_type,
+                instance_type=instance_type,
+                zone=zone,
+                start=start,
+                end=end,
+            )
+        except UnexpectedPrometheusResult:
+            return None
+
+        node_info = NodeInfo(
+            name=node,
+            system_uuid=uuid.UUID(self._node_uuids[node]),
+            cpu=int(node_labels["label_karpenter_k8s_aws_instance_cpu"]),
+            memory=memory,
+            capacity_type=capacity_type,
+            instance_type=instance_type,
+            spot_price=spot_price,
+            zone=zone,
+        )
+        pod_info = PodInfo(
+            name=pod.pod,
+            node_occupancy=calculate_node_occupancy_from_counts(counts, self.step),
+            cpu_usage_seconds=pod.cpu_usage_seconds,
+            max_memory=pod.max_memory,
+            avg_memory=pod.memory_sum / pod.memory_samples,
+            cpu_request=pod.requests.get("cpu"),
+            cpu_limit=pod.limits.get("cpu"),
+            memory_request=pod.requests.get("memory"),
+            memory_limit=pod.limits.get("memory"),
+        )
+
+        # Non-build pods don't have the spack job labels
+        try:
+            pod_labels = PrometheusClient.parse_pod_labels(
+                pod=pod.pod, annotations=pod.annotations, labels=pod.labels or {}
+            )
+        except PodLabelNotFound:
+            return JobInfo(pod=pod_info, node=node_info)
+
+        return JobInfo(
+            pod=pod_info,
+            node=node_info,
+            package=PackageInfo(
+                name=pod_labels.package_name,
+                hash=pod_labels.package_hash,
+                version=pod_labels.package_version,
+                compiler_name=pod_labels.compiler_name,
+                compiler_version=pod_labels.compiler_version,
+                arch=pod_labels.arch,
+                variants=pod_labels.package_variants,
+            ),
+            misc=JobMiscInfo(
+                job_size=pod_labels.job_size,
+                stack=pod_labels.stack,
+                build_jobs=pod_labels.build_jobs,
+            ),
+        )
+
+    def extract(self, job_windows: dict[int, tuple[datetime, datetime]]) -> dict[int, JobInfo]:
+        """
+        Retrieve the info of the given jobs, keyed by job ID, from their start and end times.
+
+        Jobs whose info can't be fully assembled are omitted, and should be retrieved individually.
+        """
+        if not job_windows:
+            return {}
+
+        job_windows = {
+            job_id: (_as_utc(start), _as_utc(end)) for job_id, (start, end) in job_windows.items()
+        }
+
+        # Align to the step, so that the pod count timestamps of each sub-window line up
+        start = min(start for start, _ in job_windows.values())
+        start = datetime.fromtimestamp(start.timestamp() // self.step * self.step, timezone.utc)
+        end = max(end for _, end in job_windows.values())
+
+        self._reset()
+        job_ids = set(job_windows)
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + self.sub_window, end)
+            self._extract_sub_window(window_start, window_end, job_ids)
+            window_start = window_end
+
+        job_infos = {}
+        for pod in self._pods.values():
+            info = self._job_info(pod, *job_windows[pod.job_id])
+            if info is not None:
+                job_infos[pod.job_id] = info
+
+        logger.info("Extracted the info of %s of %s jobs", len(job_infos), len(job_windows))
+        return job_infos
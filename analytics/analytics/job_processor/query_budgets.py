@@ -0,0 +1,30 @@
+"""
+Upper bounds on the number of SQL statements the ingestion path may issue per job.
+
+These budgets are enforced by `analytics/core/tests/test_query_budgets.py`, which runs the
+processing functions against fixtures with every dimension row missing (the worst case). If a
+change legitimately needs more queries, raise the budget here in the same commit, so that the
+increase is visible in review. Queries against the `gitlab` database are not counted.
+"""
+
+from analytics.core.models.dimensions import JobType
+
+# Creating a dimension row through `get_or_create` inside a transaction costs four statements
+# (SELECT, SAVEPOINT, INSERT, RELEASE SAVEPOINT), which is what most of this budget consists of.
+# One more statement increments the daily rollup table.
+BUILD_JOB_FACT_QUERY_BUDGET = 41
+
+# Non-build jobs use the empty package, spec and spack job data rows, but may still run in the
+# cluster, and so create a node dimension.
+NON_BUILD_JOB_FACT_QUERY_BUDGET = 33
+
+# Build timing facts are created in bulk, so this must not depend on the number of timers or phases.
+BUILD_TIMING_FACTS_QUERY_BUDGET = 10
+
+
+def job_fact_query_budget(job_type: JobType | str) -> int:
+    """Return the maximum number of queries `create_job_fact` may issue for this job type."""
+    if job_type == JobType.BUILD:
+        return BUILD_JOB_FACT_QUERY_BUDGET
+
+    return NON_BUILD_JOB_FACT_QUERY_BUDGET
@@ -0,0 +1,59 @@
+"""
+Determine the retry state of a job from its attempt number and retry configuration.
+
+This doesn't depend on Django or the gitlab database, so that it can be tested in isolation.
+"""
+
+from dataclasses import dataclass
+import json
+
+# The default retry configuration for gitlab
+# see https://docs.gitlab.com/ee/ci/yaml/#retry
+DEFAULT_RETRY_CONFIG = {
+    "max": 0,
+    "when": ["always"],
+}
+
+
+@dataclass(frozen=True)
+class RetryInfo:
+    is_retry: bool
+    is_manual_retry: bool
+    attempt_number: int
+    final_attempt: bool
+
+
+def parse_retry_config(raw: str | dict | None) -> dict:
+    """Parse a retry config as stored by gitlab, which may be JSON text or already decoded."""
+    if raw is None:
+        return DEFAULT_RETRY_CONFIG
+
+    return json.loads(raw) if isinstance(raw, str) else raw
+
+
+def compute_retry_info(
+    attempt_number: int, retry_config: dict, job_failure_reason: str
+) -> RetryInfo:
+    retry_max = retry_config["max"]
+    # A non-retryable job can either have an explicit max of zero, or no max at all.
+    # If the job is not retryable, the 'when' key will not exist
+    if retry_max in (0, None):
+        retry_max = 0
+        retry_reasons = []
+    # If the job is retryable, the 'when' key will be a list of reasons to retry
+    else:
+        retry_reasons = retry_config["when"]
+
+    # final_attempt is defined as an attempt that won't be retried for the retry_reasons
+    # or because it's gone beyond the max number of retries.
+    retryable_by_reason = "always" in retry_reasons or job_failure_reason in retry_reasons
+    retryable_by_number = attempt_number <= retry_max
+    final_attempt = not (retryable_by_reason and retryable_by_number)
+
+    return RetryInfo(
+        is_retry=attempt_number > 1,
+        # manual retries are all retries that are not part of the original job
+        is_manual_retry=attempt_number > retry_max + 1,
+        attempt_number=attempt_number,
+        final_attempt=final_attempt,
+    )
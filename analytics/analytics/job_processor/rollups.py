@@ -0,0 +1,117 @@
+from collections.abc import Iterable
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from analytics.core.models.facts import JobFact
+from analytics.core.models.rollups import JobDailyRollup
+
+ROLLUP_KEY_FIELDS = ["date_id", "stack", "job_type", "status", "error_taxonomy"]
+ROLLUP_VALUE_FIELDS = [
+    "job_count",
+    "retry_count",
+    "manual_retry_count",
+    "total_duration_seconds",
+    "total_cost",
+]
+
+_ROLLUP_TABLE = JobDailyRollup._meta.db_table
+_ROLLUP_INCREMENTS = ",\n    ".join(
+    f"{field} = {_ROLLUP_TABLE}.{field} + EXCLUDED.{field}" for field in ROLLUP_VALUE_FIELDS
+)
+
+# Increment the matching rollup row, creating it if necessary. This is a single statement, so
+# that concurrent workers processing jobs for the same day can't lose each other's updates.
+UPSERT_ROLLUP_SQL = f"""
+INSERT INTO {_ROLLUP_TABLE} (
+    {", ".join(ROLLUP_KEY_FIELDS + ROLLUP_VALUE_FIELDS)}
+)
+VALUES (
+    %(date_id)s,
+    %(stack)s,
+    %(job_type)s,
+    %(status)s,
+    %(error_taxonomy)s,
+    1,
+    %(retry_count)s,
+    %(manual_retry_count)s,
+    %(duration_seconds)s,
+    %(cost)s
+)
+ON CONFLICT ON CONSTRAINT "unique-job-daily-rollup" DO UPDATE SET
+    {_ROLLUP_INCREMENTS}
+"""
+
+
+def update_job_rollup(job_fact: JobFact) -> None:
+    """Add a newly created job fact to the daily rollup table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_ROLLUP_SQL,
+            {
+                "date_id": job_fact.start_date_id,
+                "stack": job_fact.spack_job_data.stack,
+                "job_type": job_fact.job_result.job_type,
+                "status": job_fact.job_result.status,
+                "error_taxonomy": job_fact.job_result.error_taxonomy,
+                "retry_count": int(job_fact.job_retry.is_retry),
+                "manual_retry_count": int(job_fact.job_retry.is_manual_retry),
+                "duration_seconds": job_fact.duration_seconds,
+                "cost": job_fact.cost or 0,
+            },
+        )
+
+
+def compute_job_rollups(date_keys: Iterable[str]) -> list[JobDailyRollup]:
+    """Aggregate the job facts started on the given days into (unsaved) rollup rows."""
+    rows = (
+        JobFact.objects.filter(start_date__in=list(date_keys))
+        .values(
+            "start_date",
+            "spack_job_data__stack",
+            "job_result__job_type",
+            "job_result__status",
+            "job_result__error_taxonomy",
+        )
+        .annotate(
+            job_count=Count("job_id"),
+            retry_count=Count("job_id", filter=Q(job_retry__is_retry=True)),
+            manual_retry_count=Count("job_id", filter=Q(job_retry__is_manual_retry=True)),
+            total_duration_seconds=Coalesce(Sum("duration_seconds"), 0.0),
+            total_cost=Coalesce(Sum("cost"), Decimal(0)),
+        )
+        .order_by()
+    )
+
+    return [
+        JobDailyRollup(
+            date_id=row["start_date"],
+            stack=row["spack_job_data__stack"],
+            job_type=row["job_result__job_type"],
+            status=row["job_result__status"],
+            error_taxonomy=row["job_result__error_taxonomy"],
+            job_count=row["job_count"],
+            retry_count=row["retry_count"],
+            manual_retry_count=row["manual_retry_count"],
+            total_duration_seconds=row["total_duration_seconds"],
+            total_cost=row["total_cost"],
+        )
+        for row in rows
+    ]
+
+
+def refresh_job_rollups(date_keys: Iterable[str]) -> int:
+    """Recompute the rollup rows of the given days from the job fact table.
+
+    Returns the number of rollup rows written. Facts committed by other workers while this runs
+    may be missed for days that are still receiving jobs, in which case it can simply be re-run.
+    """
+    date_keys = list(date_keys)
+    with transaction.atomic():
+        rollups = compute_job_rollups(date_keys)
+        JobDailyRollup.objects.filter(date__in=date_keys).delete()
+        JobDailyRollup.objects.bulk_create(rollups)
+
+    return len(rollups)
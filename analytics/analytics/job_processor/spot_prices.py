@@ -0,0 +1,175 @@
+"""
+Spot price history, ingested from prometheus into the analytics database.
+
+The price series of an instance type offering is shared by every job that runs on it, so instead
+of querying prometheus for each job, the series are periodically ingested into the
+`SpotPriceSample` table at a fixed resolution. This also allows the cost of jobs to be recomputed
+after prometheus retention has expired.
+"""
+
+from datetime import datetime, timedelta, timezone
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from analytics.core.models.spot_prices import SpotPriceSample
+from analytics.job_processor.prometheus import PrometheusClient
+
+logger = logging.getLogger(__name__)
+
+SPOT_PRICE_METRIC = "karpenter_cloudprovider_instance_type_offering_price_estimate"
+
+# The interval between ingested samples, in seconds
+SPOT_PRICE_RESOLUTION = 300
+
+# The amount of time queried from prometheus at once
+INGEST_WINDOW = timedelta(days=1)
+
+# How far back to ingest when the table is empty
+DEFAULT_INGEST_LOOKBACK = timedelta(days=1)
+
+# Prices change rarely, so the latest sample is assumed to hold for this long. Past this, the table
+# is considered to not cover the requested time range.
+SPOT_PRICE_MAX_STALENESS = timedelta(hours=1)
+
+# The time weighted mean price over [start, end]. Each sample holds until the next one, and the
+# sample in effect at the start of the range is included.
+TIME_WEIGHTED_PRICE_SQL = """
+WITH samples AS (
+    SELECT
+        timestamp,
+        price,
+        LEAD(timestamp) OVER (ORDER BY timestamp) AS next_timestamp
+    FROM core_spotpricesample
+    WHERE capacity_type = %(capacity_type)s
+    AND instance_type = %(instance_type)s
+    AND zone = %(zone)s
+    AND timestamp >= COALESCE(
+        (
+            SELECT MAX(timestamp) FROM core_spotpricesample
+            WHERE capacity_type = %(capacity_type)s
+            AND instance_type = %(instance_type)s
+            AND zone = %(zone)s
+            AND timestamp <= %(start)s
+        ),
+        %(start)s
+    )
+    AND timestamp <= %(end)s
+),
+weighted AS (
+    SELECT
+        timestamp,
+        price,
+        EXTRACT(
+            EPOCH FROM LEAST(COALESCE(next_timestamp, %(end)s), %(end)s)
+            - GREATEST(timestamp, %(start)s)
+        ) AS seconds
+    FROM samples
+)
+SELECT
+    COALESCE(SUM(price * seconds) / NULLIF(SUM(seconds), 0), AVG(price)),
+    MIN(timestamp),
+    MAX(timestamp)
+FROM weighted
+"""
+
+
+def get_stored_spot_price(
+    capacity_type: str, instance_type: str, zone: str, start: datetime, end: datetime
+) -> float | None:
+    """
+    Return the time weighted mean price of an offering between start and end, from the stored
+    samples. None is returned if the stored samples don't cover this time range.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TIME_WEIGHTED_PRICE_SQL,
+            {
+                "capacity_type": capacity_type,
+                "instance_type": instance_type,
+                "zone": zone,
+                "start": start,
+                "end": end,
+            },
+        )
+        price, first_sample, last_sample = cursor.fetchone()
+
+    if price is None:
+        return None
+
+    resolution = timedelta(seconds=SPOT_PRICE_RESOLUTION)
+    if first_sample > start + resolution or last_sample < end - SPOT_PRICE_MAX_STALENESS:
+        return None
+
+    return float(price)
+
+
+def get_spot_price(
+    client: PrometheusClient,
+    capacity_type: str,
+    instance_type: str,
+    zone: str,
+    start: datetime,
+    end: datetime,
+) -> float:
+    """Return the mean price of an offering between start and end, falling back to prometheus."""
+    price = get_stored_spot_price(capacity_type, instance_type, zone, start, end)
+    if price is not None:
+        return price
+
+    return client.get_spot_price(capacity_type, instance_type, zone, start=start, end=end)
+
+
+def ingest_spot_prices(start: datetime | None = None, end: datetime | None = None) -> int:
+    """
+    Ingest the price samples of all offerings between start and end, returning the number of
+    samples read. By default, this continues from the latest stored sample.
+    """
+    end = end or datetime.now(timezone.utc)
+    if start is None:
+        latest = SpotPriceSample.objects.aggregate(latest=Max("timestamp"))["latest"]
+        start = latest if latest is not None else end - DEFAULT_INGEST_LOOKBACK
+
+    # Align to the resolution, so that repeated ingestion of the same range yields the same
+    # timestamps, which are then ignored as duplicates
+    start = datetime.fromtimestamp(
+        start.timestamp() // SPOT_PRICE_RESOLUTION * SPOT_PRICE_RESOLUTION, timezone.utc
+    )
+
+    # Several karpenter replicas can export the same series, so merge them
+    query = f"max by (capacity_type, instance_type, zone) ({SPOT_PRICE_METRIC})"
+    client = PrometheusClient(settings.PROMETHEUS_URL)
+
+    total = 0
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + INGEST_WINDOW, end)
+        results = client.query_range(
+            query, start=window_start, end=window_end, step=SPOT_PRICE_RESOLUTION
+        )
+        samples = [
+            SpotPriceSample(
+                capacity_type=result["metric"]["capacity_type"],
+                instance_type=result["metric"]["instance_type"],
+                zone=result["metric"]["zone"],
+                timestamp=datetime.fromtimestamp(float(timestamp), timezone.utc),
+                price=float(value),
+            )
+            for result in results
+            for timestamp, value in result["values"]
+        ]
+        SpotPriceSample.objects.bulk_create(samples, batch_size=5000, ignore_conflicts=True)
+
+        total += len(samples)
+        window_start = window_end
+
+    logger.info("Ingested %s spot price samples between %s and %s", total, start, end)
+    return total
+
+
+@shared_task(name="ingest_spot_prices")
+def ingest_spot_prices_task() -> None:
+    ingest_spot_prices()
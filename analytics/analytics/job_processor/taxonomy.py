@@ -0,0 +1,59 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+import re
+
+import yaml
+
+ERROR_TAXONOMY_PATH = Path(__file__).parent / "error_taxonomy.yaml"
+
+
+@dataclass(frozen=True)
+class ErrorTaxonomy:
+    version: str
+    patterns: dict[str, list[re.Pattern]]
+    deconflict_order: list[str]
+
+    def matching_classes(self, job_trace: str) -> set[str]:
+        return {
+            error_class
+            for error_class, patterns in self.patterns.items()
+            if any(pattern.search(job_trace) for pattern in patterns)
+        }
+
+    def match_lines(self, job_trace: str, max_matches: int = 20) -> dict[int, set[str]]:
+        """
+        Return the (zero based) line numbers of the trace that match any error class.
+
+        At most `max_matches` matches are returned per pattern, so that a pattern that matches on
+        every line of a trace doesn't select the entire trace.
+        """
+        line_starts = [0] + [m.end() for m in re.finditer("\n", job_trace)]
+        lines: dict[int, set[str]] = {}
+        for error_class, patterns in self.patterns.items():
+            for pattern in patterns:
+                for i, match in enumerate(pattern.finditer(job_trace)):
+                    if i >= max_matches:
+                        break
+
+                    line = bisect_right(line_starts, match.start()) - 1
+                    lines.setdefault(line, set()).add(error_class)
+
+        return lines
+
+
+@cache
+def load_error_taxonomy() -> ErrorTaxonomy:
+    """Load and compile the error taxonomy. This is cached, as it never changes at runtime."""
+    with open(ERROR_TAXONOMY_PATH) as f:
+        taxonomy = yaml.load(f, Loader=yaml.CSafeLoader)["taxonomy"]
+
+    return ErrorTaxonomy(
+        version=taxonomy["version"],
+        patterns={
+            error_class: [re.compile(expr) for expr in (lookups or {}).get("grep_for", [])]
+            for error_class, lookups in taxonomy["error_classes"].items()
+        },
+        deconflict_order=taxonomy["deconflict_order"],
+    )
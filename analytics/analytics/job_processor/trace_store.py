@@ -0,0 +1,173 @@
+"""
+A shared, compressed archive of job traces.
+
+Every consumer of job traces reads them through the trace store, so that each trace is only
+fetched from gitlab once. Traces are stored zstd compressed, at `<job_id>/<sha256>.log.zst`
+relative to the store root, which is either a local directory or a bucket prefix. The
+`JobTraceArchive` table indexes the stored traces.
+"""
+
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import cache
+import hashlib
+import io
+import os
+from pathlib import Path
+import tempfile
+import typing
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import connection
+from minio import Minio
+import zstandard
+
+from analytics.core.models.traces import JobTraceArchive
+
+COMPRESSION_LEVEL = 10
+
+
+def trace_key(job_id: int, content_hash: str) -> str:
+    return f"{job_id}/{content_hash}.log.zst"
+
+
+class TraceStoreBackend(typing.Protocol):
+    def read(self, key: str) -> bytes: ...
+
+    def write(self, key: str, data: bytes) -> None: ...
+
+    def find(self, job_id: int) -> str | None:
+        """Return the key of a stored trace of this job, if there is one."""
+        ...
+
+
+class FilesystemBackend:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def read(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+    def write(self, key: str, data: bytes) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first, so that partially written traces are never visible
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def find(self, job_id: int) -> str | None:
+        paths = sorted((self.root / str(job_id)).glob("*.log.zst"))
+        return str(paths[0].relative_to(self.root)) if paths else None
+
+
+class S3Backend:
+    def __init__(self, client: Minio, bucket: str, prefix: str) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def read(self, key: str) -> bytes:
+        response = self.client.get_object(self.bucket, f"{self.prefix}{key}")
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def write(self, key: str, data: bytes) -> None:
+        self.client.put_object(self.bucket, f"{self.prefix}{key}", io.BytesIO(data), len(data))
+
+    def find(self, job_id: int) -> str | None:
+        for obj in self.client.list_objects(self.bucket, prefix=f"{self.prefix}{job_id}/"):
+            return obj.object_name.removeprefix(self.prefix)
+
+        return None
+
+
+@contextmanager
+def job_trace_lock(job_id: int) -> Iterator[None]:
+    """
+    Hold a session level advisory lock on the trace of a job.
+
+    Unlike a transaction level lock, this doesn't keep a transaction open while it's held, which
+    would otherwise last as long as the trace takes to download.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", [job_id])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [job_id])
+
+
+class TraceStore:
+    def __init__(self, backend: TraceStoreBackend) -> None:
+        self.backend = backend
+
+    def _read(self, key: str) -> bytes:
+        return zstandard.decompress(self.backend.read(key))
+
+    def _archive(self, job_id: int, trace: bytes, compressed: bytes | None = None) -> None:
+        content_hash = hashlib.sha256(trace).hexdigest()
+        key = trace_key(job_id, content_hash)
+        if compressed is None:
+            compressed = zstandard.compress(trace, COMPRESSION_LEVEL)
+            self.backend.write(key, compressed)
+
+        JobTraceArchive.objects.create(
+            job_id=job_id,
+            content_hash=content_hash,
+            key=key,
+            size=len(trace),
+            compressed_size=len(compressed),
+        )
+
+    def get(self, job_id: int, fetch: Callable[[], bytes]) -> bytes:
+        """Return the trace of a job from the store, calling `fetch` to retrieve it if missing."""
+        archive = JobTraceArchive.objects.filter(job_id=job_id).first()
+        if archive is not None:
+            return self._read(archive.key)
+
+        # Serialize concurrent requests for the same missing trace (e.g. by the job processor and
+        # the log uploader), so that it's only fetched once
+        with job_trace_lock(job_id):
+            archive = JobTraceArchive.objects.filter(job_id=job_id).first()
+            if archive is not None:
+                return self._read(archive.key)
+
+            # The trace may have been stored without being indexed (e.g. by the error
+            # classification script), in which case it only needs to be indexed
+            key = self.backend.find(job_id)
+            if key is not None:
+                compressed = self.backend.read(key)
+                trace = zstandard.decompress(compressed)
+                self._archive(job_id, trace, compressed=compressed)
+                return trace
+
+            trace = fetch()
+            self._archive(job_id, trace)
+            return trace
+
+
+@cache
+def get_trace_store() -> TraceStore | None:
+    """Return the configured trace store, or None if traces shouldn't be stored."""
+    if settings.JOB_TRACE_STORE is None:
+        return None
+
+    url = urlparse(settings.JOB_TRACE_STORE)
+    if url.scheme == "s3":
+        # Imported here, as the traces module reads through the trace store
+        from analytics.job_processor.traces import get_object_storage_client
+
+        prefix = url.path.strip("/")
+        if prefix:
+            prefix += "/"
+
+        return TraceStore(S3Backend(get_object_storage_client(), bucket=url.netloc, prefix=prefix))
+
+    return TraceStore(FilesystemBackend(Path(url.path)))
@@ -0,0 +1,158 @@
+"""
+Read archived job traces directly from gitlab's object storage.
+
+Once a job finishes, gitlab archives its trace as a job artifact, which is stored in the artifacts
+bucket. Reading it from there avoids having the gitlab rails app proxy the entire trace through
+`/jobs/:id/trace`. Live or not yet archived traces are still read through the API.
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+import datetime
+from functools import cache
+import gzip
+import hashlib
+import io
+import logging
+import shutil
+import typing
+
+from django.conf import settings
+from gitlab.v4.objects import ProjectJob
+from minio import Minio
+from minio.credentials import IamAwsProvider
+from minio.error import S3Error
+
+from analytics.job_processor.gitlab_db import ARCHIVED_TRACE, get_gitlab_db
+from analytics.job_processor.trace_store import get_trace_store
+
+logger = logging.getLogger(__name__)
+
+# Values of the `file_type`, `file_store` and `file_location` enums of `p_ci_job_artifacts`
+TRACE_FILE_TYPE = 3
+REMOTE_FILE_STORE = 2
+LEGACY_FILE_LOCATION = 1
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# The size of the reads from an archived trace, which bounds how much of the (compressed) object is
+# held in memory at a time, besides the trace itself
+TRACE_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ArchivedTrace:
+    artifact_id: int
+    job_id: int
+    project_id: int
+    file: str
+    created_at: datetime.datetime
+    legacy_location: bool
+
+    @property
+    def object_key(self) -> str:
+        """The key of this artifact within the artifacts bucket, as determined by gitlab."""
+        if self.legacy_location:
+            return f"{self.created_at:%Y_%m}/{self.project_id}/{self.job_id}/{self.file}"
+
+        disk_hash = hashlib.sha256(str(self.project_id).encode()).hexdigest()
+        return (
+            f"{disk_hash[0:2]}/{disk_hash[2:4]}/{disk_hash}/{self.created_at:%Y_%m_%d}"
+            f"/{self.job_id}/{self.artifact_id}/{self.file}"
+        )
+
+
+def get_archived_trace(job_id: int) -> ArchivedTrace | None:
+    """Return the archived trace artifact of a job, if it's been archived to object storage."""
+    row = get_gitlab_db().fetchone(ARCHIVED_TRACE, job_id, TRACE_FILE_TYPE, REMOTE_FILE_STORE)
+
+    if row is None:
+        return None
+
+    artifact_id, job_id, project_id, file, created_at, file_location = row
+    return ArchivedTrace(
+        artifact_id=artifact_id,
+        job_id=job_id,
+        project_id=project_id,
+        file=file,
+        created_at=created_at,
+        legacy_location=file_location == LEGACY_FILE_LOCATION,
+    )
+
+
+@cache
+def get_object_storage_client() -> Minio:
+    """Return the object storage client, which is shared so that its connections are pooled."""
+    # Without static credentials, use the IAM role of the service account
+    credentials = None
+    if settings.GITLAB_OBJECT_STORAGE_ACCESS_KEY is None:
+        credentials = IamAwsProvider()
+
+    return Minio(
+        settings.GITLAB_OBJECT_STORAGE_ENDPOINT,
+        access_key=settings.GITLAB_OBJECT_STORAGE_ACCESS_KEY,
+        secret_key=settings.GITLAB_OBJECT_STORAGE_SECRET_KEY,
+        region=settings.GITLAB_OBJECT_STORAGE_REGION,
+        secure=settings.GITLAB_OBJECT_STORAGE_SECURE,
+        credentials=credentials,
+    )
+
+
+@contextmanager
+def open_archived_trace(job_id: int) -> Iterator[typing.BinaryIO | None]:
+    """
+    Yield a stream of the archived trace of a job, or None if it can't be read from object storage.
+
+    The trace is decompressed if it was stored gzipped.
+    """
+    if settings.GITLAB_ARTIFACTS_BUCKET is None:
+        yield None
+        return
+
+    trace = get_archived_trace(job_id)
+    if trace is None:
+        yield None
+        return
+
+    try:
+        response = get_object_storage_client().get_object(
+            settings.GITLAB_ARTIFACTS_BUCKET, trace.object_key
+        )
+    except S3Error as e:
+        logger.warning("Failed to read archived trace of job %s: %s", job_id, e)
+        yield None
+        return
+
+    # By default the response closes itself once the body is exhausted, which fails the reads made
+    # past the end of the body by the buffered and gzip readers
+    response.auto_close = False
+    try:
+        stream = io.BufferedReader(response)  # type: ignore
+        if stream.peek(len(GZIP_MAGIC)).startswith(GZIP_MAGIC):
+            stream = gzip.GzipFile(fileobj=stream)  # type: ignore
+
+        yield stream
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def fetch_job_trace(gljob: ProjectJob) -> bytes:
+    """Fetch the trace of a job, from object storage if it's been archived, or the gitlab API."""
+    with open_archived_trace(gljob.id) as stream:
+        if stream is not None:
+            trace = io.BytesIO()
+            shutil.copyfileobj(stream, trace, TRACE_CHUNK_SIZE)
+            return trace.getvalue()
+
+    return gljob.trace()  # type: ignore
+
+
+def get_job_trace(gljob: ProjectJob) -> str:
+    """Return the trace of a job, reading it through the trace store if one is configured."""
+    store = get_trace_store()
+    if store is None:
+        return fetch_job_trace(gljob).decode()
+
+    return store.get(gljob.id, fetch=lambda: fetch_job_trace(gljob)).decode()
@@ -1,126 +1,61 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import timezone
 from functools import wraps
-import json
+import logging
 import typing
 
 from cachetools import TTLCache, cached
 from django.conf import settings
-from django.db import connections
 import gitlab
-from gitlab.v4.objects import Project
+from gitlab.v4.objects import Project, ProjectJob
+import psycopg2
 import requests
 import sentry_sdk
 
+from analytics.job_processor.gitlab_db import (
+    EXIT_CODE,
+    JOB,
+    LEGACY_RETRY_CONFIG,
+    RETRY_ATTEMPTS,
+    RETRY_CONFIG,
+    get_gitlab_db,
+)
+from analytics.job_processor.retries import RetryInfo, compute_retry_info, parse_retry_config
+
 T = typing.TypeVar("T")
 P = typing.ParamSpec("P")
 
-
-@dataclass(frozen=True)
-class RetryInfo:
-    is_retry: bool
-    is_manual_retry: bool
-    attempt_number: int
-    final_attempt: bool
+logger = logging.getLogger(__name__)
 
 
 def get_job_retry_data(
     job_id: int, job_name: str, job_pipeline_id: int, job_failure_reason: str
 ) -> RetryInfo:
-    with connections["gitlab"].cursor() as cursor:
-        # In gitlab, the pipeline ID is stored as `commit_id`.
-        # The prior attempts for a given job are all jobs with a lower id, the same commit_id, and
-        # the same name. 
-        # It's important to filter for a lower job id in the event that the webhook is delayed or
-        # received out of order.
-        cursor.execute(
-            """
-            SELECT COUNT(*)
-            FROM p_ci_builds
-            WHERE id < %(job_id)s
-            AND commit_id = %(commit_id)s
-            AND name = %(job_name)s
-            """,
-            {"job_id": job_id, "job_name": job_name, "commit_id": job_pipeline_id},
-        )
-        attempt_number = cursor.fetchone()[0] + 1
-
-        # Retrieve retry config
-        cursor.execute(
-            """
-            SELECT jd.config->'options'->'retry'
-            FROM p_ci_job_definition_instances jdi
-            INNER JOIN p_ci_job_definitions jd on jd.id = jdi.job_definition_id
-            WHERE jdi.job_id = %(job_id)s;
-            """,
-            {"job_id": job_id},
-        )
-        job: tuple[str | None] | None = cursor.fetchone()
-
-        # For jobs earlier than Nov 12 2025, the retry config may exist in the old table
-        # TODO: Remove once sufficient time has passed.
-        if job is None:
-            cursor.execute(
-                """
-                SELECT bm.config_options->>'retry'
-                FROM p_ci_builds_metadata bm
-                WHERE bm.build_id = %(job_id)s
-                """,
-                {"job_id": job_id},
-            )
-            job = cursor.fetchone()
-
-        # A value of tuple[None] means the retry config for this job is set to empty,
-        # while a value of None means no retry config was found at all.
-        if job is None or job[0] is None:
-            # A retry config should always be defined for non-trigger (aka Ci::Bridge)
-            # jobs in spack. This is an edge case where a job in gitlab isn't explicitly
-            # configured for retries at all.
-            sentry_sdk.capture_message(f"Job {job_id} missing retry configuration.")
-
-            # this is the default retry configuration for gitlab
-            # see https://docs.gitlab.com/ee/ci/yaml/#retry
-            retry_config = {
-                "max": 0,
-                "when": ["always"],
-            }
-        else:
-            retry_config = json.loads(job[0])
-
-        retry_max = retry_config["max"]
-        # A non-retryable job can either have an explicit max of zero, or no max at all.
-        # If the job is not retryable, the 'when' key will not exist
-        if retry_max in (0, None):
-            retry_reasons = []
-        # If the job is retryable, the 'when' key will be a list of reasons to retry
-        else:
-            retry_reasons = retry_config["when"]
-        # final_attempt is defined as an attempt that won't be retried for the retry_reasons
-        # or because it's gone beyond the max number of retries.
-        retryable_by_reason = "always" in retry_reasons or job_failure_reason in retry_reasons
-        retryable_by_number = attempt_number <= retry_max
-        final_attempt = not (retryable_by_reason and retryable_by_number)
-
-        return RetryInfo(
-            is_retry=attempt_number > 1,
-            # manual retries are all retries that are not part of the original job
-            is_manual_retry=attempt_number > retry_max + 1,
-            attempt_number=attempt_number,
-            final_attempt=final_attempt,
-        )
+    db = get_gitlab_db()
+    attempt_number = db.fetchone(RETRY_ATTEMPTS, job_id, job_pipeline_id, job_name)[0] + 1
+
+    # Retrieve retry config
+    job = db.fetchone(RETRY_CONFIG, job_id)
+    if job is None:
+        job = db.fetchone(LEGACY_RETRY_CONFIG, job_id)
+
+    # A value of tuple[None] means the retry config for this job is set to empty,
+    # while a value of None means no retry config was found at all.
+    if job is None or job[0] is None:
+        # A retry config should always be defined for non-trigger (aka Ci::Bridge)
+        # jobs in spack. This is an edge case where a job in gitlab isn't explicitly
+        # configured for retries at all.
+        sentry_sdk.capture_message(f"Job {job_id} missing retry configuration.")
+
+    return compute_retry_info(
+        attempt_number=attempt_number,
+        retry_config=parse_retry_config(job[0] if job is not None else None),
+        job_failure_reason=job_failure_reason,
+    )
 
 
 def get_job_exit_code(job_id: int) -> int | None:
-    with connections["gitlab"].cursor() as cursor:
-        cursor.execute(
-            """
-            SELECT exit_code
-            FROM p_ci_builds_metadata
-            WHERE build_id = %(job_id)s
-            """,
-            {"job_id": job_id},
-        )
-        result = cursor.fetchone()
-
+    result = get_gitlab_db().fetchone(EXIT_CODE, job_id)
     return result[0] if result else None
 
 
@@ -163,3 +98,123 @@ def get_gitlab_project(project_id: int):
 @cached(cache=TTLCache(maxsize=1024, ttl=60 * 30))
 def get_gitlab_job(project: Project, job_id: int):
     return project.jobs.get(job_id)
+
+
+@dataclass(frozen=True)
+class GitlabRunnerDetails:
+    """The attributes of a runner that are otherwise retrieved with `gl.runners.get`."""
+
+    description: str
+    platform: str
+    architecture: str
+    tag_list: list[str]
+
+
+@dataclass(eq=False)
+class GitlabDBJob:
+    """
+    A gitlab job read from the gitlab database.
+
+    This provides the same attributes as a `ProjectJob` that are used during job processing, in
+    the same format as the REST API returns them. The trace and artifacts are still retrieved
+    through the REST API, using a lazy job object, so that the job itself is never fetched.
+    """
+
+    id: int
+    project_id: int
+    name: str
+    status: str
+    ref: str
+    tag_list: list[str]
+    started_at: str | None
+    duration: float | None
+    runner: dict | None
+    runner_details: GitlabRunnerDetails | None
+    _rest_job: ProjectJob | None = field(default=None, repr=False)
+
+    def get_id(self) -> int:
+        return self.id
+
+    def rest_job(self) -> ProjectJob:
+        if self._rest_job is None:
+            project = get_gitlab_handle().projects.get(self.project_id, lazy=True)
+            self._rest_job = project.jobs.get(self.id, lazy=True)
+
+        return self._rest_job
+
+    def trace(self, **kwargs):
+        return self.rest_job().trace(**kwargs)
+
+    def artifacts(self, **kwargs):
+        return self.rest_job().artifacts(**kwargs)
+
+
+def get_gitlab_db_job(job_id: int) -> GitlabDBJob | None:
+    """Read a finished job and its runner from the gitlab database, in a single query."""
+    row = get_gitlab_db().fetchone(JOB, job_id)
+    if row is None:
+        return None
+
+    (
+        _,
+        project_id,
+        name,
+        status,
+        ref,
+        started_at,
+        duration,
+        tag_list,
+        runner_id,
+        runner_description,
+        runner_platform,
+        runner_architecture,
+        runner_tag_list,
+    ) = row
+
+    # Gitlab stores timestamps in UTC, without a timezone, though newer columns have one
+    if started_at is not None:
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        started_at = started_at.astimezone(timezone.utc).isoformat()
+
+    runner = runner_details = None
+    if runner_id is not None:
+        runner = {"id": runner_id, "description": runner_description}
+        runner_details = GitlabRunnerDetails(
+            description=runner_description or "",
+            platform=runner_platform or "",
+            architecture=runner_architecture or "",
+            tag_list=runner_tag_list,
+        )
+
+    return GitlabDBJob(
+        id=job_id,
+        project_id=project_id,
+        name=name,
+        status=status,
+        ref=ref,
+        tag_list=tag_list,
+        started_at=started_at,
+        duration=duration,
+        runner=runner,
+        runner_details=runner_details,
+    )
+
+
+def get_job_metadata(project_id: int, job_id: int) -> GitlabDBJob | ProjectJob:
+    """
+    Retrieve a job from the gitlab database, falling back to the REST API.
+
+    The REST API is used if the job can't be read from the database, or hasn't finished yet (in
+    which case the database has no duration for it).
+    """
+    try:
+        job = get_gitlab_db_job(job_id)
+    except psycopg2.Error:
+        logger.exception("Failed to read job %s from the gitlab database", job_id)
+        job = None
+
+    if job is not None and (job.started_at is None or job.duration is not None):
+        return job
+
+    return get_gitlab_job(get_gitlab_project(project_id), job_id)
@@ -65,4 +65,46 @@ OPENSEARCH_PASSWORD = os.environ["OPENSEARCH_PASSWORD"]
 GITLAB_ENDPOINT = os.environ["GITLAB_ENDPOINT"]
 GITLAB_TOKEN = os.environ["GITLAB_TOKEN"]
 
+# The hot per-job queries against the gitlab database use a separate, bounded pool of connections
+# in each worker process. Statements that take longer than the timeout (in milliseconds) fail.
+GITLAB_DB_POOL_SIZE = int(os.environ.get("GITLAB_DB_POOL_SIZE", "4"))
+GITLAB_DB_STATEMENT_TIMEOUT = int(os.environ.get("GITLAB_DB_STATEMENT_TIMEOUT", "5000"))
+
 PROMETHEUS_URL = os.environ["PROMETHEUS_URL"]
+
+# Periodic tasks, run by celery beat
+CELERY_BEAT_SCHEDULE = {
+    "ingest-spot-prices": {
+        "task": "ingest_spot_prices",
+        "schedule": 300,
+    },
+    # Buffered job log documents are sent at least this often, as well as whenever the buffer fills
+    "flush-job-logs": {
+        "task": "flush_job_logs",
+        "schedule": 10,
+    },
+}
+
+# The bucket gitlab stores job artifacts (including archived traces) in. If not set, job traces are
+# always retrieved through the gitlab API. If no access key is given, the IAM role is used.
+GITLAB_ARTIFACTS_BUCKET = os.environ.get("GITLAB_ARTIFACTS_BUCKET")
+GITLAB_OBJECT_STORAGE_ENDPOINT = os.environ.get(
+    "GITLAB_OBJECT_STORAGE_ENDPOINT", "s3.amazonaws.com"
+)
+GITLAB_OBJECT_STORAGE_REGION = os.environ.get("GITLAB_OBJECT_STORAGE_REGION")
+GITLAB_OBJECT_STORAGE_ACCESS_KEY = os.environ.get("GITLAB_OBJECT_STORAGE_ACCESS_KEY")
+GITLAB_OBJECT_STORAGE_SECRET_KEY = os.environ.get("GITLAB_OBJECT_STORAGE_SECRET_KEY")
+GITLAB_OBJECT_STORAGE_SECURE = os.environ.get("GITLAB_OBJECT_STORAGE_SECURE", "true") == "true"
+
+# Where fetched job traces are archived, so that each trace is only fetched from gitlab once. Either
+# a local directory or an s3://bucket/prefix URL, on the object storage configured above. If unset,
+# traces are always fetched from gitlab.
+JOB_TRACE_STORE = os.environ.get("JOB_TRACE_STORE")
+
+# How job traces are indexed in opensearch. "full" indexes the entire trace, while "error-window"
+# only indexes the lines around error taxonomy matches and the end of the trace.
+JOB_LOG_INDEX_MODE = os.environ.get("JOB_LOG_INDEX_MODE", "full")
+
+# How the per-phase build timings are stored. "rows" creates a TimerPhaseFact for each phase, while
+# "packed" stores the phases of each timer as parallel arrays on its TimerFact.
+TIMER_PHASE_STORAGE = os.environ.get("TIMER_PHASE_STORAGE", "rows")
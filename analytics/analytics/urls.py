@@ -18,10 +18,11 @@ Including another URLconf
 from django.conf import settings
 from django.urls import include, path
 
-from analytics.core.views import webhook_handler
+from analytics.core.views import metrics, webhook_handler
 
 urlpatterns = [
     path("", webhook_handler),
+    path("metrics", metrics),
 ]
 
 if settings.DEBUG:
@@ -53,12 +53,14 @@ setup(
         "kubernetes",
         "sentry-sdk[django,pure_eval]",
         "rich",
+        "prometheus-client",
         "psycopg2-binary",
         "python-gitlab>=5.2.0",
         "pyyaml",
         "requests",
         "tqdm",
         "whitenoise[brotli]",
+        "zstandard",
     ],
     extras_require={
         "dev": [
@@ -6,12 +6,16 @@ import re
 import shutil
 import subprocess
 import tempfile
+import threading
 from collections import defaultdict
+from datetime import datetime
 from typing import Dict, Optional
 
 import boto3
 import boto3.session
 from boto3.s3.transfer import TransferConfig
+import botocore.exceptions
+from botocore.config import Config
 
 
 SPACK_REPO = "https://github.com/spack/spack"
@@ -30,6 +34,15 @@ REGEX_V3_SIGNED_SPECFILE_RELATIVE = re.compile(
     rf"{TIMESTAMP_AND_SIZE}(.+)(/v3/manifests/spec/.+-)([^-\.]+)(\.spec\.manifest\.json)$"
 )
 
+#: the same expressions, designed to match bare object keys
+REGEX_V2_SIGNED_SPECFILE_KEY = re.compile(
+    r"^(.+)(/build_cache/.+-)([^\.]+)(\.spec\.json\.sig)$"
+)
+REGEX_V2_ARCHIVE_KEY = re.compile(r"^(.+)(/build_cache/.+-)([^\.]+)(\.spack)$")
+REGEX_V3_SIGNED_SPECFILE_KEY = re.compile(
+    r"^(.+)(/v3/manifests/spec/.+-)([^-\.]+)(\.spec\.manifest\.json)$"
+)
+
 #: Regular expression to pull spec contents out of clearsigned signature
 #: file.
 CLEARSIGN_FILE_REGEX = re.compile(
@@ -50,6 +63,16 @@ MULTIPART_CHUNKSIZE = 20 * MB
 MAX_CONCURRENCY = 10
 USE_THREADS = True
 
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=MAX_CONCURRENCY,
+    use_threads=USE_THREADS,
+)
+
+#: Size of the connection pool of the shared client
+SHARED_POOL_SIZE = 64
+
 
 ################################################################################
 # Encapsulate information about a built spec in a mirror
@@ -71,6 +94,16 @@ class BuiltSpec:
         self.archive = archive
         self.manifest_prefix = manifest_prefix
         self.manifest_path = manifest_path
+        # Size of each object belonging to the spec, keyed by object key, and
+        # the most recent modification time among them.  Only populated when
+        # the spec comes from an object listing that has this information.
+        self.sizes: Dict[str, int] = {}
+        self.last_modified: Optional[datetime] = None
+
+    def add_object(self, key: str, size: int, last_modified: datetime):
+        self.sizes[key] = size
+        if self.last_modified is None or last_modified > self.last_modified:
+            self.last_modified = last_modified
 
 
 ################################################################################
@@ -175,6 +208,12 @@ def extract_json_from_clearsig(file_path):
     with open(file_path) as fd:
         data = fd.read()
 
+    return extract_json_from_clearsig_text(data)
+
+
+################################################################################
+#
+def extract_json_from_clearsig_text(data: str):
     m = CLEARSIGN_FILE_REGEX.search(data)
     if not m:
         return {}
@@ -194,34 +233,29 @@ def clone_spack(ref: str = "develop", repo: str = SPACK_REPO, clone_dir: str = "
     if os.path.isdir(spack_path):
         shutil.rmtree(spack_path)
 
-    owd = os.getcwd()
-
-    try:
-        os.chdir(clone_dir)
-        subprocess.run(
-            [
-                "git",
-                "clone",
-                "--depth",
-                "1",
-                "--single-branch",
-                "--branch",
-                f"{ref}",
-                f"{repo}",
-            ],
-            check=True,
-        )
-    finally:
-        os.chdir(owd)
+    # Run git in clone_dir, rather than changing the working directory of the
+    # process, so that clones can run concurrently
+    subprocess.run(
+        [
+            "git",
+            "clone",
+            "--depth",
+            "1",
+            "--single-branch",
+            "--branch",
+            f"{ref}",
+            f"{repo}",
+        ],
+        cwd=clone_dir,
+        check=True,
+    )
 
 
 ################################################################################
 # Download a file from s3
 def s3_download_file(bucket: str, prefix: str, save_path: str, force: bool = False):
     if not os.path.isfile(save_path) or force is True:
-        session = boto3.session.Session()
-        s3_resource = session.resource("s3")
-        s3_client = s3_resource.meta.client
+        s3_client = s3_shared_client()
 
         with open(save_path, "wb") as f:
             s3_client.download_fileobj(bucket, prefix, f)
@@ -231,41 +265,58 @@ def s3_download_file(bucket: str, prefix: str, save_path: str, force: bool = Fal
 ################################################################################
 # Create and return a new s3 client by first creating a Session, using that to
 # create a new "s3" resource, and return the client stored within the resources
-# metadata.
-def s3_create_client():
+# metadata.  Clients shared between threads should be created with a connection
+# pool at least as large as the number of threads.
+def s3_create_client(max_pool_connections: Optional[int] = None):
     session = boto3.session.Session()
-    s3_resource = session.resource("s3")
+    if max_pool_connections:
+        config = Config(max_pool_connections=max_pool_connections)
+        s3_resource = session.resource("s3", config=config)
+    else:
+        s3_resource = session.resource("s3")
     return s3_resource.meta.client
 
+
+################################################################################
+# Return a client shared by everything that doesn't bring its own.  Clients are
+# thread-safe (sessions are not), so there's no need to create one per call.
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def s3_shared_client():
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = s3_create_client(max_pool_connections=SHARED_POOL_SIZE)
+        return _shared_client
+
+
 ################################################################################
 # Copy objects between s3 buckets/prefixes
 def s3_copy_file(copy_source: Dict[str, str], bucket: str, dest_prefix: str, client=None):
-    if client:
-        s3_client = client
-    else:
-        session = boto3.session.Session()
-        s3_resource = session.resource("s3")
-        s3_client = s3_resource.meta.client
+    s3_client = client or s3_shared_client()
+    s3_client.copy(copy_source, bucket, dest_prefix, Config=TRANSFER_CONFIG)
 
-    config = TransferConfig(
-        multipart_threshold=MULTIPART_THRESHOLD,
-        multipart_chunksize=MULTIPART_CHUNKSIZE,
-        max_concurrency=MAX_CONCURRENCY,
-        use_threads=USE_THREADS,
-    )
 
-    s3_client.copy(copy_source, bucket, dest_prefix, Config=config)
+################################################################################
+#
+def s3_object_exists(bucket: str, prefix: str, client=None) -> bool:
+    s3_client = client or s3_shared_client()
+
+    try:
+        s3_client.head_object(Bucket=bucket, Key=prefix)
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+    return True
 
 
 ################################################################################
 #
 def s3_upload_file(file_path: str, bucket: str, prefix: str, client=None):
-    if client:
-        s3_client = client
-    else:
-        session = boto3.session.Session()
-        s3_resource = session.resource("s3")
-        s3_client = s3_resource.meta.client
+    s3_client = client or s3_shared_client()
 
     with open(file_path, "rb") as fd:
         s3_client.upload_fileobj(fd, bucket, prefix)
@@ -0,0 +1,271 @@
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import boto3.session
+import botocore.exceptions
+from botocore.config import Config
+
+from .common import MULTIPART_THRESHOLD, TRANSFER_CONFIG
+
+#: Error codes S3 uses to ask clients to slow down
+THROTTLE_ERROR_CODES = {
+    "SlowDown",
+    "ServiceUnavailable",
+    "503",
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+}
+
+#: Other error codes worth trying again
+TRANSIENT_ERROR_CODES = {"InternalError", "500", "502", "504", "RequestTimeout"}
+
+#: Attempts per copy, for throttled or transient failures
+MAX_ATTEMPTS = 8
+
+#: Seconds between adjustments of the concurrency limit based on throughput
+ADJUST_INTERVAL = 10
+
+#: Seconds between progress reports
+REPORT_INTERVAL = 60
+
+
+################################################################################
+#
+def format_bytes(num_bytes: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if num_bytes < 1024 or unit == "TiB":
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+################################################################################
+# Classify errors raised by a copy
+def is_throttle(error: Exception) -> bool:
+    if isinstance(error, botocore.exceptions.ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in THROTTLE_ERROR_CODES or status == 503
+    return False
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+    return isinstance(
+        error,
+        (
+            botocore.exceptions.ConnectionError,
+            botocore.exceptions.ConnectionClosedError,
+            botocore.exceptions.ReadTimeoutError,
+        ),
+    )
+
+
+################################################################################
+# Retry throttled or transient s3 requests, with backoff
+def with_retries(fn, on_throttle: Optional[Callable[[], None]] = None):
+    """Call fn, retrying throttled or transient errors, raising any other error
+    (or the last one, after MAX_ATTEMPTS)"""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return fn()
+        except Exception as error:
+            throttled = is_throttle(error)
+            if throttled and on_throttle is not None:
+                on_throttle()
+
+            if attempt == MAX_ATTEMPTS or not (throttled or is_transient(error)):
+                raise
+
+        # Exponential backoff, with full jitter
+        time.sleep(random.uniform(0, min(20, 0.1 * 2**attempt)))
+
+
+################################################################################
+# A semaphore whose limit can be changed while in use
+class AdaptiveLimiter:
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def set_limit(self, limit: int):
+        with self._cond:
+            self.limit = max(self.minimum, min(int(limit), self.maximum))
+            self._cond.notify_all()
+
+
+################################################################################
+# Copy objects within s3, adapting the number of copies in flight
+class CopyEngine:
+    """Copies objects with a shared client, adapting how many are in flight
+
+    All copies share a single client (clients are thread-safe), with a
+    connection pool sized for the maximum concurrency, and a single transfer
+    config.  Objects known to be smaller than the multipart threshold are
+    copied with a single CopyObject request, rather than through the managed
+    transfer machinery.
+
+    The number of copies in flight starts at ``concurrency``, and adapts
+    between ``min_concurrency`` and ``max_concurrency``:
+
+        - when S3 throttles a request (SlowDown/503), the limit is halved (at
+          most once per adjustment interval) and the copy retried with backoff
+        - otherwise, at each adjustment interval, the limit grows by a quarter
+          while throughput keeps up with the previous interval, and shrinks by
+          one when throughput falls off
+
+    Callers should submit copies from at least ``max_concurrency`` threads, so
+    that the limit, rather than the number of threads, bounds concurrency.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        max_concurrency: int = 64,
+        min_concurrency: int = 2,
+    ):
+        self.max_concurrency = max_concurrency
+        self.limiter = AdaptiveLimiter(concurrency, min_concurrency, max_concurrency)
+
+        # Retries are done here, so that throttling is noticed and acted on.
+        # Large copies are multipart, with parts copied concurrently, so leave
+        # room in the pool for those.
+        config = Config(
+            max_pool_connections=max_concurrency * 2,
+            retries={"mode": "standard", "total_max_attempts": 1},
+        )
+        self.client = boto3.session.Session().client("s3", config=config)
+
+        self._lock = threading.Lock()
+        self.copied_objects = 0
+        self.copied_bytes = 0
+        self.failed_objects = 0
+        self.skipped_objects = 0
+        self.skipped_bytes = 0
+        self.throttled_requests = 0
+
+        self._start = time.monotonic()
+        self._last_report = self._start
+        self._window_start = self._start
+        self._window_bytes = 0
+        self._window_throttled = False
+        self._last_throughput: Optional[float] = None
+
+    def _request(self, fn):
+        """Call fn within the concurrency limit, retrying throttled or transient errors"""
+
+        def limited():
+            self.limiter.acquire()
+            try:
+                return fn()
+            finally:
+                self.limiter.release()
+
+        return with_retries(limited, on_throttle=self._throttled)
+
+    def copy(
+        self,
+        bucket: str,
+        src_key: str,
+        dest_key: str,
+        size: Optional[int] = None,
+        src_bucket: Optional[str] = None,
+    ):
+        """Copy an object, raising the last error if it can't be copied"""
+        copy_source = {"Bucket": src_bucket or bucket, "Key": src_key}
+
+        def do_copy():
+            if size is not None and size < MULTIPART_THRESHOLD:
+                self.client.copy_object(CopySource=copy_source, Bucket=bucket, Key=dest_key)
+            else:
+                self.client.copy(copy_source, bucket, dest_key, Config=TRANSFER_CONFIG)
+
+        try:
+            self._request(do_copy)
+        except Exception:
+            with self._lock:
+                self.failed_objects += 1
+            raise
+
+        self._copied(size or 0)
+
+    def exists(self, bucket: str, key: str) -> bool:
+        """Whether the object exists, raising the last error if that can't be told"""
+        try:
+            self._request(lambda: self.client.head_object(Bucket=bucket, Key=key))
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def skipped(self, size: int):
+        """Record a copy that wasn't needed, e.g. because the object already exists"""
+        with self._lock:
+            self.skipped_objects += 1
+            self.skipped_bytes += size
+
+    def _throttled(self):
+        with self._lock:
+            self.throttled_requests += 1
+            if not self._window_throttled:
+                self._window_throttled = True
+                self.limiter.set_limit(self.limiter.limit / 2)
+
+    def _copied(self, size: int):
+        with self._lock:
+            self.copied_objects += 1
+            self.copied_bytes += size
+            self._window_bytes += size
+
+            now = time.monotonic()
+            if now - self._window_start >= ADJUST_INTERVAL:
+                self._adjust(self._window_bytes / (now - self._window_start))
+                self._window_start = now
+                self._window_bytes = 0
+                self._window_throttled = False
+
+            report = now - self._last_report >= REPORT_INTERVAL
+            if report:
+                self._last_report = now
+
+        if report:
+            self.report()
+
+    def _adjust(self, throughput: float):
+        # Already backed off for any throttling within the window
+        if not self._window_throttled:
+            limit = self.limiter.limit
+            if self._last_throughput is None or throughput >= 0.95 * self._last_throughput:
+                self.limiter.set_limit(limit + max(1, limit // 4))
+            elif throughput < 0.8 * self._last_throughput:
+                self.limiter.set_limit(limit - 1)
+        self._last_throughput = throughput
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._start, 1e-6)
+        print(
+            f"Copied {self.copied_objects} objects ({format_bytes(self.copied_bytes)}), "
+            f"{self.copied_objects / elapsed:.1f} objects/s, "
+            f"{format_bytes(self.copied_bytes / elapsed)}/s, "
+            f"skipped {self.skipped_objects} ({format_bytes(self.skipped_bytes)}), "
+            f"{self.failed_objects} failed, {self.throttled_requests} throttled, "
+            f"{self.limiter.limit} copies in flight allowed"
+        )
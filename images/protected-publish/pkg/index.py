@@ -0,0 +1,283 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import botocore.exceptions
+
+from .common import s3_shared_client
+from .copier import with_retries
+from .inventory import INDEX_MARKER
+
+#: The dependency types counted in the ref_count of index records, which differ
+#: between spack versions (older versions only counted link/run dependencies).
+#: The rule in use is detected from the existing index.
+REF_COUNT_DEPTYPES: List[Optional[Set[str]]] = [None, {"link", "run"}]
+
+
+class IndexInconsistencyError(Exception):
+    """Raised when the index can't be safely updated in place"""
+
+
+################################################################################
+#
+def _blob_key(mirror_prefix: str, algorithm: str, checksum: str) -> str:
+    return f"{mirror_prefix}/blobs/{algorithm}/{checksum[:2]}/{checksum}"
+
+
+################################################################################
+#
+def _get_object(client, bucket: str, key: str) -> Tuple[bytes, str]:
+    try:
+        response = with_retries(lambda: client.get_object(Bucket=bucket, Key=key))
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            raise IndexInconsistencyError(f"s3://{bucket}/{key} does not exist")
+        raise
+    return response["Body"].read(), response["ETag"]
+
+
+################################################################################
+#
+def _get_etag(client, bucket: str, key: str) -> Optional[str]:
+    try:
+        return with_retries(lambda: client.head_object(Bucket=bucket, Key=key))["ETag"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+
+
+################################################################################
+#
+def _put_object(client, bucket: str, key: str, data: bytes):
+    with_retries(lambda: client.put_object(Bucket=bucket, Key=key, Body=data))
+
+
+################################################################################
+#
+def decode_blob(data: bytes, record: Dict[str, Any]) -> bytes:
+    """Check the content of a blob against its manifest record, and decompress it"""
+    algorithm = record.get("checksumAlgorithm", "sha256")
+    if hashlib.new(algorithm, data).hexdigest() != record["checksum"]:
+        raise IndexInconsistencyError(f"Checksum mismatch for blob {record['checksum']}")
+
+    compression = record.get("compression", "none")
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression != "none":
+        raise IndexInconsistencyError(f"Unsupported blob compression: {compression}")
+    return data
+
+
+################################################################################
+#
+def read_index(
+    client, bucket: str, mirror_prefix: str, layout_version: int
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], str]:
+    """Fetch the current index of a mirror
+
+    Returns the index, the manifest record of the index blob (only for layout
+    version 3), and the etag of the object marking the current version of the
+    index, used to detect the index changing before the update is written.
+    """
+    if layout_version == 2:
+        index_data, _ = _get_object(client, bucket, f"{mirror_prefix}/build_cache/index.json")
+        hash_data, marker_etag = _get_object(
+            client, bucket, f"{mirror_prefix}/{INDEX_MARKER[2]}"
+        )
+        if hashlib.sha256(index_data).hexdigest() != hash_data.decode("utf-8").strip():
+            raise IndexInconsistencyError("index.json does not match index.json.hash")
+        record = None
+    else:
+        manifest_data, marker_etag = _get_object(
+            client, bucket, f"{mirror_prefix}/{INDEX_MARKER[3]}"
+        )
+        try:
+            manifest = json.loads(manifest_data)
+        except ValueError:
+            # A signed index manifest can't be re-signed here
+            raise IndexInconsistencyError("Index manifest is not plain json")
+
+        if len(manifest.get("data", [])) != 1:
+            raise IndexInconsistencyError("Index manifest should refer to a single blob")
+
+        record = manifest["data"][0]
+        blob_key = _blob_key(mirror_prefix, record["checksumAlgorithm"], record["checksum"])
+        blob_data, _ = _get_object(client, bucket, blob_key)
+        index_data = decode_blob(blob_data, record)
+
+    index = json.loads(index_data)
+    if "installs" not in index.get("database", {}):
+        raise IndexInconsistencyError("Index has no database of installs")
+
+    return index, record, marker_etag
+
+
+################################################################################
+#
+def _dependency_hashes(node: Dict[str, Any], deptypes: Optional[Set[str]]) -> List[str]:
+    hashes = []
+    for dep in node.get("dependencies", []):
+        types = dep.get("parameters", {}).get("deptypes") or dep.get("type") or []
+        if deptypes is None or deptypes.intersection(types):
+            hashes.append(dep["hash"])
+    return hashes
+
+
+################################################################################
+# Count the dependents of every record, as spack does when building the index
+def _ref_counts(
+    installs: Dict[str, Any], deptypes: Optional[Set[str]]
+) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for spec_hash, record in installs.items():
+        for dep_hash in _dependency_hashes(record["spec"], deptypes):
+            if dep_hash not in installs:
+                raise IndexInconsistencyError(
+                    f"{spec_hash} depends on {dep_hash}, which is not in the index"
+                )
+            counts[dep_hash] = counts.get(dep_hash, 0) + 1
+    return counts
+
+
+################################################################################
+#
+def merge_specs(index: Dict[str, Any], spec_dicts: List[Dict[str, Any]]) -> int:
+    """Merge the metadata of specs present in the mirror into its index
+
+    Every node of each spec gets a record (only the root of each spec is in the
+    buildcache), and the reference counts are recomputed, using whichever rule
+    the existing index was built with.  Returns the number of specs added.
+    """
+    installs = index["database"]["installs"]
+
+    for deptypes in REF_COUNT_DEPTYPES:
+        counts = _ref_counts(installs, deptypes)
+        if all(r.get("ref_count", 0) == counts.get(h, 0) for h, r in installs.items()):
+            break
+    else:
+        raise IndexInconsistencyError("Reference counts in the index are inconsistent")
+
+    added = 0
+    for spec_dict in spec_dicts:
+        nodes = spec_dict["spec"]["nodes"]
+        for node in nodes:
+            record = installs.get(node["hash"])
+            if record is None:
+                installs[node["hash"]] = {
+                    "spec": node,
+                    "ref_count": 0,
+                    "in_buildcache": False,
+                }
+            elif record["spec"].get("name") != node.get("name"):
+                raise IndexInconsistencyError(
+                    f"{node['hash']} is {record['spec'].get('name')} in the index, "
+                    f"but {node.get('name')} in the spec metadata"
+                )
+
+        root = installs[nodes[0]["hash"]]
+        if not root.get("in_buildcache"):
+            root["in_buildcache"] = True
+            added += 1
+
+    counts = _ref_counts(installs, deptypes)
+    for spec_hash, record in installs.items():
+        record["ref_count"] = counts.get(spec_hash, 0)
+
+    return added
+
+
+################################################################################
+#
+def write_index(
+    client,
+    bucket: str,
+    mirror_prefix: str,
+    layout_version: int,
+    index: Dict[str, Any],
+    record: Optional[Dict[str, Any]],
+    marker_etag: str,
+):
+    """Write the index, unless it changed since it was read
+
+    The index is written before the object marking its version (the hash of
+    index.json, or the index manifest), so readers never see a marker referring
+    to an index that doesn't exist yet.
+    """
+    index_data = json.dumps(index, separators=(",", ":")).encode("utf-8")
+
+    marker_key = f"{mirror_prefix}/{INDEX_MARKER[layout_version]}"
+    if _get_etag(client, bucket, marker_key) != marker_etag:
+        raise IndexInconsistencyError("Index changed while it was being updated")
+
+    if layout_version == 2:
+        _put_object(
+            client, bucket, f"{mirror_prefix}/build_cache/index.json", index_data
+        )
+        _put_object(
+            client,
+            bucket,
+            marker_key,
+            hashlib.sha256(index_data).hexdigest().encode("utf-8"),
+        )
+        return
+
+    if record.get("compression", "none") == "gzip":
+        blob_data = gzip.compress(index_data, mtime=0)
+    else:
+        blob_data = index_data
+
+    algorithm = record.get("checksumAlgorithm", "sha256")
+    checksum = hashlib.new(algorithm, blob_data).hexdigest()
+    blob_key = _blob_key(mirror_prefix, algorithm, checksum)
+    _put_object(client, bucket, blob_key, blob_data)
+
+    manifest = {
+        "version": 3,
+        "data": [
+            {
+                **record,
+                "contentLength": len(blob_data),
+                "checksumAlgorithm": algorithm,
+                "checksum": checksum,
+            }
+        ],
+    }
+    _put_object(
+        client,
+        bucket,
+        marker_key,
+        json.dumps(manifest, indent=0, separators=(",", ":")).encode("utf-8"),
+    )
+
+
+################################################################################
+# Update the index of a mirror with just the given specs, rather than rebuilding
+# it from the metadata of every spec in the mirror.
+def update_index(
+    bucket: str,
+    mirror_prefix: str,
+    layout_version: int,
+    spec_dicts: List[Dict[str, Any]],
+    client=None,
+):
+    """Merge the metadata of newly added specs into the index of a mirror
+
+    Raises IndexInconsistencyError if the index can't be safely updated in place,
+    in which case it should be rebuilt from scratch.  S3 requests are retried
+    when throttled or failing transiently, and any other error is raised.
+    """
+    client = client or s3_shared_client()
+    start_time = datetime.now()
+
+    index, record, marker_etag = read_index(client, bucket, mirror_prefix, layout_version)
+    added = merge_specs(index, spec_dicts)
+    write_index(client, bucket, mirror_prefix, layout_version, index, record, marker_etag)
+
+    elapsed = datetime.now() - start_time
+    print(
+        f"Added {added} specs to the index of s3://{bucket}/{mirror_prefix} "
+        f"({len(index['database']['installs'])} records), elapsed time: {elapsed}"
+    )
@@ -0,0 +1,271 @@
+import sqlite3
+import threading
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import botocore.exceptions
+
+from .listing import list_stacks, ObjectInfo, CATALOG_SUBPREFIX
+
+#: The object within a mirror which changes whenever the mirror changes, since
+#: the index is rebuilt at the end of every pipeline (or publish) that adds specs
+#: to the mirror.
+INDEX_MARKER = {
+    2: "build_cache/index.json.hash",
+    3: "v3/manifests/index/index.manifest.json",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    PRIMARY KEY (bucket, key)
+);
+CREATE TABLE IF NOT EXISTS scopes (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    marker_etag TEXT,
+    marker_last_modified TEXT,
+    generation INTEGER NOT NULL,
+    resume_after TEXT,
+    refreshed_at TEXT,
+    PRIMARY KEY (bucket, prefix)
+);
+"""
+
+#: A prefix to keep listed, along with the key of the object whose changes
+#: indicate that the prefix needs to be listed again.
+Scope = Tuple[str, str]
+
+
+################################################################################
+# The first string sorting after every string starting with prefix, so that the
+# keys under a prefix can be found with a range query on the primary key.
+def _prefix_end(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+################################################################################
+#
+def catalog_scopes(mirror_prefixes: List[str], layout_version: int) -> List[Scope]:
+    """Return the scopes holding the spec catalogs of the given mirrors"""
+    subprefix = CATALOG_SUBPREFIX[layout_version]
+    marker = INDEX_MARKER[layout_version]
+    return [(f"{m}/{subprefix}", f"{m}/{marker}") for m in mirror_prefixes]
+
+
+################################################################################
+# Persistent inventory of bucket contents
+class Inventory:
+    """A local snapshot of the objects (key, size, etag, last modified) in a bucket
+
+    The snapshot is organized in scopes, each of which is a prefix listed as a
+    whole.  A scope is only listed again when the etag or modification time of
+    its marker object (the index of the mirror it belongs to) has moved, or when
+    the marker doesn't exist.  Rows are written a page at a time, along with the
+    last key written, so an interrupted listing resumes where it stopped (with
+    ``StartAfter``) as long as the marker hasn't moved in the meantime.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def _marker(self, client, bucket: str, key: str) -> Optional[Tuple[str, str]]:
+        try:
+            response = client.head_object(Bucket=bucket, Key=key)
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        return response["ETag"], response["LastModified"].isoformat()
+
+    def refresh_scope(
+        self, client, bucket: str, scope: Scope, force: bool = False
+    ) -> bool:
+        """List the scope again if its marker moved, returns whether it was listed"""
+        prefix, marker_key = scope
+        marker = self._marker(client, bucket, marker_key)
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT marker_etag, marker_last_modified, generation, resume_after "
+                "FROM scopes WHERE bucket = ? AND prefix = ?",
+                (bucket, prefix),
+            ).fetchone()
+
+        start_after = None
+        unchanged = row is not None and marker is not None and tuple(row[:2]) == marker
+        if unchanged and not force:
+            if row[3] is None:
+                # Nothing changed since the scope was last listed
+                return False
+            # Resume an interrupted listing
+            generation = row[2]
+            start_after = row[3] or None
+        else:
+            generation = row[2] + 1 if row is not None else 1
+            marker_etag, marker_last_modified = marker or (None, None)
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO scopes (bucket, prefix, marker_etag, "
+                    "marker_last_modified, generation, resume_after) "
+                    "VALUES (?, ?, ?, ?, ?, '')",
+                    (bucket, prefix, marker_etag, marker_last_modified, generation),
+                )
+
+        if start_after:
+            print(f"Resuming listing of s3://{bucket}/{prefix} after {start_after}")
+
+        params = {"Bucket": bucket, "Prefix": prefix}
+        if start_after:
+            params["StartAfter"] = start_after
+
+        count = 0
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**params):
+            contents = page.get("Contents", [])
+            if not contents:
+                continue
+
+            rows = [
+                (
+                    bucket,
+                    obj["Key"],
+                    obj["Size"],
+                    obj.get("ETag"),
+                    obj["LastModified"].isoformat(),
+                    generation,
+                )
+                for obj in contents
+            ]
+            with self._lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self._db.execute(
+                    "UPDATE scopes SET resume_after = ? WHERE bucket = ? AND prefix = ?",
+                    (contents[-1]["Key"], bucket, prefix),
+                )
+            count += len(rows)
+
+        # Anything in the scope not seen in this listing has been deleted
+        refreshed_at = datetime.now(timezone.utc).isoformat()
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM objects WHERE bucket = ? AND key >= ? AND key < ? "
+                "AND generation != ?",
+                (bucket, prefix, _prefix_end(prefix), generation),
+            )
+            self._db.execute(
+                "UPDATE scopes SET resume_after = NULL, refreshed_at = ? "
+                "WHERE bucket = ? AND prefix = ?",
+                (refreshed_at, bucket, prefix),
+            )
+
+        print(f"Listed {count} objects in s3://{bucket}/{prefix}")
+        return True
+
+    def refresh(
+        self,
+        client,
+        bucket: str,
+        scopes: List[Scope],
+        parallel: int = 8,
+        force: bool = False,
+    ):
+        """Concurrently refresh any of the scopes whose marker moved"""
+        start_time = datetime.now()
+        refreshed = 0
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = [
+                executor.submit(self.refresh_scope, client, bucket, scope, force)
+                for scope in scopes
+            ]
+            for future in as_completed(futures):
+                if future.result():
+                    refreshed += 1
+
+        elapsed = datetime.now() - start_time
+        print(
+            f"Refreshed {refreshed} of {len(scopes)} prefixes in s3://{bucket}, "
+            f"elapsed time: {elapsed}"
+        )
+
+    def objects(self, bucket: str, prefix: str) -> Iterator[ObjectInfo]:
+        """Yield every object in the inventory under the prefix"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, size, last_modified FROM objects "
+                "WHERE bucket = ? AND key >= ? AND key < ? ORDER BY key",
+                (bucket, prefix, _prefix_end(prefix)),
+            ).fetchall()
+
+        for key, size, last_modified in rows:
+            yield key, size, datetime.fromisoformat(last_modified)
+
+    def get(self, bucket: str, key: str) -> Optional[ObjectInfo]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, size, last_modified FROM objects WHERE bucket = ? AND key = ?",
+                (bucket, key),
+            ).fetchone()
+
+        if row is None:
+            return None
+        return row[0], row[1], datetime.fromisoformat(row[2])
+
+    def write_listing(self, bucket: str, prefixes: List[str], output_file: str):
+        """Write the objects under the prefixes, formatted like "aws s3 ls" output"""
+        with open(output_file, "w") as f:
+            for prefix in prefixes:
+                for key, size, last_modified in self.objects(bucket, prefix):
+                    timestamp = last_modified.astimezone().strftime("%Y-%m-%d %H:%M:%S")
+                    f.write(f"{timestamp} {size:>10} {key}\n")
+
+
+################################################################################
+#
+def inventory_catalog_objects(
+    inventory: Inventory,
+    client,
+    bucket: str,
+    ref: str,
+    layout_version: int,
+    exclude: Optional[List[str]] = None,
+    parallel: int = 8,
+    force: bool = False,
+) -> List[ObjectInfo]:
+    """Return the objects needed to build the spec catalogs of a ref
+
+    Equivalent to listing.list_catalog_objects, but only the mirrors whose index
+    has changed since the last run are listed again.
+    """
+    exclude = exclude or []
+    stacks = [s for s in list_stacks(client, bucket, ref) if s not in exclude]
+    mirror_prefixes = [ref] + [f"{ref}/{stack}" for stack in stacks]
+    scopes = catalog_scopes(mirror_prefixes, layout_version)
+
+    inventory.refresh(client, bucket, scopes, parallel=parallel, force=force)
+
+    objects: List[ObjectInfo] = []
+    for prefix, _ in scopes:
+        objects.extend(inventory.objects(bucket, prefix))
+    return objects
@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .common import (
+    get_workdir_context,
+    list_prefix_contents,
+    s3_create_client,
+    spec_catalogs_from_listing_v2,
+    spec_catalogs_from_listing_v3,
+    BuiltSpec,
+    REGEX_V2_ARCHIVE_KEY,
+    REGEX_V2_SIGNED_SPECFILE_KEY,
+    REGEX_V3_SIGNED_SPECFILE_KEY,
+)
+
+#: Children of a ref prefix which belong to the top-level mirror, rather than
+#: being stack-specific mirrors.
+TOP_LEVEL_DIRS = ["build_cache", "v3", "blobs"]
+
+#: Where the objects that make up the spec catalog live, relative to a mirror
+CATALOG_SUBPREFIX = {
+    2: "build_cache/",
+    3: "v3/manifests/spec/",
+}
+
+#: Pages of listed objects waiting to be cataloged, per listing thread
+PAGES_BUFFERED = 4
+
+#: A listed object: (key, size, last modified)
+ObjectInfo = Tuple[str, int, datetime]
+
+
+################################################################################
+#
+def list_stacks(client, bucket: str, ref: str) -> List[str]:
+    """Return the names of the stack mirrors within the prefix of ref"""
+    stacks = []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{ref}/", Delimiter="/"):
+        for common_prefix in page.get("CommonPrefixes", []):
+            stack = common_prefix["Prefix"][len(ref) + 1 :].rstrip("/")
+            if stack not in TOP_LEVEL_DIRS:
+                stacks.append(stack)
+    return stacks
+
+
+################################################################################
+#
+def list_object_pages(client, bucket: str, prefix: str) -> Iterator[List[ObjectInfo]]:
+    """Yield the objects under the prefix, a page at a time"""
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        yield [
+            (obj["Key"], obj["Size"], obj["LastModified"])
+            for obj in page.get("Contents", [])
+        ]
+
+
+################################################################################
+#
+def list_objects(client, bucket: str, prefix: str) -> Iterator[ObjectInfo]:
+    """Yield every object under the prefix, a page at a time"""
+    for page in list_object_pages(client, bucket, prefix):
+        yield from page
+
+
+################################################################################
+#
+def add_to_catalogs(
+    all_catalogs: Dict[str, Dict[str, BuiltSpec]],
+    key: str,
+    size: int,
+    last_modified: datetime,
+    layout_version: int,
+):
+    """Record a single listed object in the catalog of the mirror it belongs to
+
+    This is equivalent to matching a line of "aws s3 ls" output in
+    spec_catalogs_from_listing_v2/_v3, but works on the bare key.
+    """
+    if layout_version == 2:
+        if key.endswith(".spec.json.sig"):
+            m = REGEX_V2_SIGNED_SPECFILE_KEY.match(key)
+            attr = "meta"
+        elif key.endswith(".spack"):
+            m = REGEX_V2_ARCHIVE_KEY.match(key)
+            attr = "archive"
+        else:
+            # a public key, an index, or a hash of an index
+            return
+    else:
+        if not key.endswith(".spec.manifest.json"):
+            return
+        m = REGEX_V3_SIGNED_SPECFILE_KEY.match(key)
+        attr = "manifest_prefix"
+
+    if not m:
+        return
+
+    prefix = m.group(1)
+    hash = m.group(3)
+    spec = all_catalogs[prefix][hash]
+    spec.hash = hash
+    setattr(spec, attr, key)
+    spec.add_object(key, size, last_modified)
+
+
+################################################################################
+#
+def list_catalog_objects(
+    bucket: str,
+    ref: str,
+    layout_version: int,
+    exclude: Optional[List[str]] = None,
+    parallel: int = 8,
+    client=None,
+) -> Iterator[ObjectInfo]:
+    """Yield the objects needed to build the spec catalogs of a ref
+
+    Rather than listing everything under the ref, only the part of each mirror
+    (the top-level mirror and each stack mirror) holding the spec metadata and
+    archives (v2) or the spec manifests (v3) is listed, and the stacks are
+    listed concurrently.  Pages are yielded as they're listed, through a
+    bounded queue, so the listing of the ref is never held as a whole.
+    """
+    exclude = exclude or []
+    client = client or s3_create_client(max_pool_connections=parallel)
+    subprefix = CATALOG_SUBPREFIX[layout_version]
+
+    stacks = [s for s in list_stacks(client, bucket, ref) if s not in exclude]
+    mirror_prefixes = [ref] + [f"{ref}/{stack}" for stack in stacks]
+    print(f"Listing {len(mirror_prefixes)} mirrors in s3://{bucket}/{ref}/")
+
+    # Each mirror's pages, followed by None once it's listed, or the error
+    # which stopped it from being listed
+    pages: queue.Queue = queue.Queue(maxsize=parallel * PAGES_BUFFERED)
+    stop = threading.Event()
+
+    def _put(item):
+        # Give up once nothing is reading the pages anymore
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _list_mirror(mirror_prefix):
+        try:
+            count = 0
+            prefix = f"{mirror_prefix}/{subprefix}"
+            for page in list_object_pages(client, bucket, prefix):
+                if stop.is_set():
+                    return
+                _put(page)
+                count += len(page)
+            print(f"Listed {count} objects in s3://{bucket}/{mirror_prefix}")
+            _put(None)
+        except Exception as error:
+            _put(error)
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for mirror_prefix in mirror_prefixes:
+            executor.submit(_list_mirror, mirror_prefix)
+
+        try:
+            remaining = len(mirror_prefixes)
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from page
+        finally:
+            stop.set()
+
+
+################################################################################
+# Save the objects to the cache as they go by.  They're written to the side, and
+# only moved into place once all were written, so a partial listing is never
+# reused.
+def write_listing_cache(
+    cache_path: str, objects: Iterable[ObjectInfo]
+) -> Iterator[ObjectInfo]:
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as f:
+        for key, size, last_modified in objects:
+            f.write(json.dumps([key, size, last_modified.isoformat()]))
+            f.write("\n")
+            yield key, size, last_modified
+    os.replace(tmp_path, cache_path)
+
+
+################################################################################
+#
+def read_listing_cache(cache_path: str) -> Iterator[ObjectInfo]:
+    with open(cache_path) as f:
+        for line in f:
+            key, size, last_modified = json.loads(line)
+            yield key, size, datetime.fromisoformat(last_modified)
+
+
+################################################################################
+#
+def spec_catalogs_from_s3(
+    bucket: str,
+    ref: str,
+    layout_version: int,
+    exclude: Optional[List[str]] = None,
+    parallel: int = 8,
+    cache_path: Optional[str] = None,
+    force: bool = False,
+) -> Dict[str, Dict[str, BuiltSpec]]:
+    """Return a complete catalog of all the built specs under the ref
+
+    Builds the same catalogs as spec_catalogs_from_listing_v2/_v3 would from a
+    full "aws s3 ls --recursive" listing of the ref, keyed by unique prefix,
+    but from a native listing, and with the size and modification time of each
+    object recorded on the specs.
+
+    The catalogs are built as the listing streams in.  If ``cache_path`` is
+    given, the listing is saved there, and reused by later calls unless
+    ``force`` is True.
+    """
+    if cache_path and os.path.isfile(cache_path) and not force:
+        print(f"Reusing listing from {cache_path}")
+        objects = read_listing_cache(cache_path)
+    else:
+        objects = list_catalog_objects(bucket, ref, layout_version, exclude, parallel)
+        if cache_path:
+            objects = write_listing_cache(cache_path, objects)
+
+    return spec_catalogs_from_objects(objects, layout_version)
+
+
+################################################################################
+#
+def spec_catalogs_from_objects(
+    objects: Iterable[ObjectInfo], layout_version: int
+) -> Dict[str, Dict[str, BuiltSpec]]:
+    """Return the catalogs of all the built specs among the listed objects"""
+    all_catalogs: Dict[str, Dict[str, BuiltSpec]] = defaultdict(
+        lambda: defaultdict(BuiltSpec)
+    )
+    for key, size, last_modified in objects:
+        add_to_catalogs(all_catalogs, key, size, last_modified, layout_version)
+
+    return all_catalogs
+
+
+################################################################################
+# Compare the time taken and the catalogs produced by listing with the aws cli
+# and matching the output with regular expressions, vs listing natively.
+def benchmark(bucket: str, ref: str, layout_version: int, parallel: int, workdir: str):
+    listing_file = os.path.join(workdir, "full_listing.txt")
+
+    start_time = datetime.now()
+    list_prefix_contents(f"s3://{bucket}/{ref}/", listing_file)
+    if layout_version == 2:
+        cli_catalogs = spec_catalogs_from_listing_v2(listing_file)
+    else:
+        cli_catalogs = spec_catalogs_from_listing_v3(listing_file)
+    cli_elapsed = datetime.now() - start_time
+    print(f"aws cli listing and regex matching, elapsed time: {cli_elapsed}")
+
+    start_time = datetime.now()
+    native_catalogs = spec_catalogs_from_s3(bucket, ref, layout_version, parallel=parallel)
+    native_elapsed = datetime.now() - start_time
+    print(f"Native listing, elapsed time: {native_elapsed}")
+
+    def summarize(catalogs):
+        return {
+            prefix: {
+                (h, s.meta, s.archive, s.manifest_prefix) for h, s in catalog.items()
+            }
+            for prefix, catalog in catalogs.items()
+        }
+
+    cli_summary = summarize(cli_catalogs)
+    native_summary = summarize(native_catalogs)
+    total_specs = sum(len(catalog) for catalog in native_summary.values())
+    print(f"Found {total_specs} specs in {len(native_summary)} mirrors")
+
+    if cli_summary == native_summary:
+        print("The catalogs are identical")
+        return True
+
+    for prefix in sorted(set(cli_summary) | set(native_summary)):
+        if cli_summary.get(prefix) != native_summary.get(prefix):
+            print(f"  catalogs for {prefix} differ")
+    return False
+
+
+################################################################################
+#
+def main():
+    parser = argparse.ArgumentParser(
+        prog="listing.py",
+        description="Benchmark native bucket listing against the aws cli",
+    )
+
+    parser.add_argument(
+        "-b", "--bucket", default="spack-binaries", help="Bucket to operate on"
+    )
+    parser.add_argument("-r", "--ref", default="develop", help="Ref to list")
+    parser.add_argument(
+        "-p", "--parallel", default=8, type=int, help="Thread parallelism level"
+    )
+    parser.add_argument(
+        "-v",
+        "--version",
+        type=int,
+        default=3,
+        help=("Layout version to catalog (either 2 or 3, defaults to 3)"),
+    )
+    parser.add_argument(
+        "-w",
+        "--workdir",
+        default=None,
+        help="A scratch directory, defaults to a tmp dir",
+    )
+
+    args = parser.parse_args()
+
+    with get_workdir_context(args.workdir) as workdir:
+        benchmark(args.bucket, args.ref, args.version, args.parallel, workdir)
+
+
+################################################################################
+#
+if __name__ == "__main__":
+    main()
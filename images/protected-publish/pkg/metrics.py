@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, push_to_gateway
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+#: Environment variable holding the address of the Pushgateway, metrics are only
+#: pushed when it's set.
+PUSHGATEWAY_ENV = "PUSHGATEWAY_URL"
+
+#: Seconds between pushes during long phases
+PUSH_INTERVAL = 30
+
+PREFIX = "protected_publish"
+
+
+################################################################################
+# Expose the counters kept by the copy engine and signature verifier
+class _ProgressCollector:
+    def __init__(self):
+        self.copier = None
+        self.verifier = None
+
+    def collect(self):
+        copier = self.copier
+        if copier is not None:
+            for name, doc, value in [
+                ("copied_objects", "Objects copied", copier.copied_objects),
+                ("copied_bytes", "Bytes copied", copier.copied_bytes),
+                ("skipped_objects", "Copies skipped", copier.skipped_objects),
+                ("skipped_bytes", "Bytes of copies skipped", copier.skipped_bytes),
+                ("failed_copies", "Copies which failed", copier.failed_objects),
+                ("throttled_requests", "Requests throttled", copier.throttled_requests),
+            ]:
+                yield CounterMetricFamily(f"{PREFIX}_{name}", doc, value=value)
+
+            yield GaugeMetricFamily(
+                f"{PREFIX}_copy_concurrency_limit",
+                "Number of copies allowed in flight",
+                value=copier.limiter.limit,
+            )
+
+        verifier = self.verifier
+        if verifier is not None:
+            yield CounterMetricFamily(
+                f"{PREFIX}_verified_signatures",
+                "Signatures verified",
+                value=verifier.verified_count,
+            )
+            yield CounterMetricFamily(
+                f"{PREFIX}_failed_signatures",
+                "Signatures which failed verification",
+                value=verifier.failed_count,
+            )
+
+
+################################################################################
+# Push progress and throughput metrics to a Prometheus Pushgateway
+class Metrics:
+    """Progress metrics of a run, pushed to a Pushgateway
+
+    Metrics are pushed at the end of every phase, and periodically while the
+    run is in progress (between ``start`` and ``stop``).  Each push replaces the
+    metrics of the previous push for the same job, so the gateway always holds
+    the state of the latest run.  When no gateway is configured, metrics are
+    still kept, but never pushed.  Failing to push is reported, but never fails
+    the run.
+    """
+
+    def __init__(
+        self,
+        job: str,
+        gateway: Optional[str] = None,
+        interval: float = PUSH_INTERVAL,
+    ):
+        self.job = job
+        self.gateway = gateway or os.environ.get(PUSHGATEWAY_ENV)
+        self.interval = interval
+
+        self.registry = CollectorRegistry()
+        self.progress = _ProgressCollector()
+        self.registry.register(self.progress)
+
+        self.phase_seconds = Gauge(
+            f"{PREFIX}_phase_duration_seconds",
+            "Duration of the last completed run of each phase",
+            ["ref", "phase"],
+            registry=self.registry,
+        )
+        self.phase_in_progress = Gauge(
+            f"{PREFIX}_phase_in_progress",
+            "Whether each phase is currently running",
+            ["ref", "phase"],
+            registry=self.registry,
+        )
+        self.specs_missing = Gauge(
+            f"{PREFIX}_specs_missing",
+            "Specs planned to be published, by source stack",
+            ["ref", "stack"],
+            registry=self.registry,
+        )
+        self.specs_published = Counter(
+            f"{PREFIX}_specs_published",
+            "Specs published, by source stack",
+            ["ref", "stack"],
+            registry=self.registry,
+        )
+        self.bytes_published = Counter(
+            f"{PREFIX}_published_bytes",
+            "Bytes of the objects of specs published, by source stack",
+            ["ref", "stack"],
+            registry=self.registry,
+        )
+        self.specs_failed = Counter(
+            f"{PREFIX}_specs_failed",
+            "Specs which failed to be published, by source stack",
+            ["ref", "stack"],
+            registry=self.registry,
+        )
+        self.last_push = Gauge(
+            f"{PREFIX}_last_push_timestamp_seconds",
+            "Time of the latest push of these metrics",
+            registry=self.registry,
+        )
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, copier=None, verifier=None):
+        """Include the counters of a copy engine and/or signature verifier"""
+        if copier is not None:
+            self.progress.copier = copier
+        if verifier is not None:
+            self.progress.verifier = verifier
+
+    def push(self):
+        if not self.gateway:
+            return
+
+        with self._lock:
+            self.last_push.set_to_current_time()
+            try:
+                push_to_gateway(self.gateway, job=self.job, registry=self.registry)
+            except Exception as error:
+                print(f"Failed to push metrics to {self.gateway} due to {error}")
+
+    def _push_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.push()
+
+    def start(self):
+        if self.gateway and self._thread is None:
+            self._thread = threading.Thread(target=self._push_periodically, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.push()
+
+    @contextmanager
+    def phase(self, ref: str, name: str):
+        """Measure the duration of a phase, pushing metrics once it's done"""
+        self.phase_in_progress.labels(ref, name).set(1)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phase_seconds.labels(ref, name).set(time.monotonic() - start)
+            self.phase_in_progress.labels(ref, name).set(0)
+            self.push()
+
+    def set_missing(self, ref: str, counts: Dict[str, int]):
+        for stack, count in counts.items():
+            self.specs_missing.labels(ref, stack).set(count)
+
+    def spec_published(self, ref: str, stack: str, size: int = 0):
+        self.specs_published.labels(ref, stack).inc()
+        self.bytes_published.labels(ref, stack).inc(size)
+
+    def spec_failed(self, ref: str, stack: str):
+        self.specs_failed.labels(ref, stack).inc()
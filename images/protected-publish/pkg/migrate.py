@@ -9,7 +9,7 @@ import sys
 from concurrent.futures import as_completed, ThreadPoolExecutor
 from contextlib import closing
 from datetime import datetime
-from typing import NamedTuple
+from typing import List, NamedTuple, Optional, Tuple
 
 import sentry_sdk
 
@@ -23,10 +23,17 @@ from .common import (
     get_workdir_context,
     list_prefix_contents,
     s3_copy_file,
+    s3_create_client,
     s3_download_file,
+    s3_object_exists,
     s3_upload_file,
     spec_catalogs_from_listing_v2,
 )
+from .index import IndexInconsistencyError, update_index
+from .inventory import catalog_scopes, Inventory
+from .metrics import Metrics
+from .publish import is_ref_protected
+from .signatures import export_public_keys, SignatureVerifier
 
 sentry_sdk.init(traces_sample_rate=1.0)
 
@@ -36,6 +43,10 @@ class MigrationResult(NamedTuple):
     migrated: bool
     #: Any message about the cause of error or success conditions
     message: str
+    #: The metadata of the spec under the new layout, if it was migrated
+    spec_dict: Optional[dict] = None
+    #: The bytes of the objects written under the new layout
+    size: int = 0
 
 
 ################################################################################
@@ -47,6 +58,7 @@ def _migrate_spec(
     target_prefix: str,
     working_dir: str,
     force: bool,
+    verifier: SignatureVerifier,
 ) -> MigrationResult:
     """Migrate a single spec from the old layout to the new one
 
@@ -69,6 +81,7 @@ def _migrate_spec(
         target_prefix: The bits between bucket name and "build_cache"
         working_dir: Location to download files, clone spack, etc.
         force: Re-migrate the spec, even if it has already been done
+        verifier: Verifies the signature of the spec metadata
 
     Returns: A MigrationResult indicating whether spec was migrated and why.
     """
@@ -110,16 +123,16 @@ def _migrate_spec(
         os.remove(verified_specfile_path)
 
     if not os.path.exists(verified_specfile_path):
-        # Verify the signature of the locally downloaded metadata file, it seems
-        # when you let gpg deduce what to do from the arguments, it not only
-        # verifies, but also strips the signature material and writes the file
-        # back to disk with the .sig extension removed.
-        try:
-            subprocess.run(["gpg", "--quiet", signed_specfile_path], check=True)
-        except subprocess.CalledProcessError as cpe:
-            error_msg = getattr(cpe, "message", str(cpe))
+        # Verify the signature of the locally downloaded metadata file, and write
+        # the signed content back to disk with the .sig extension removed.
+        result = verifier.verify_file(signed_specfile_path)
+        if not result.verified:
+            error_msg = result.message
             print(f"Failed to verify signature of {built_spec.meta} due to {error_msg}")
             return MigrationResult(False, error_msg)
+
+        with open(verified_specfile_path, "w") as fd:
+            fd.write(result.message)
     else:
         print(f"Verification of {built_spec.hash} skipped as it was already done.")
 
@@ -220,6 +233,8 @@ def _migrate_spec(
         print(f"Failed to resign {verified_specfile_path} due to {error_msg}")
         return MigrationResult(False, error_msg)
 
+    manifest_size = os.stat(manifest_path_signed).st_size
+
     # Copy the archive from the original prefix into the prefix under the new layout
     copy_source = {
         "Bucket": bucket,
@@ -283,15 +298,24 @@ def _migrate_spec(
         )
         return MigrationResult(False, error_msg)
 
-    return MigrationResult(True, f"{built_spec.hash} successfully migrated")
+    return MigrationResult(
+        True,
+        f"{built_spec.hash} successfully migrated",
+        spec_dict,
+        archive_size + specfile_size + manifest_size,
+    )
 
 
 ################################################################################
 #
-def migrate_keys(bucket: str, target_prefix: str, listing_file: str, tmpdir: str):
-    """Migrate the _pgp directory to the new layout"""
+def migrate_keys(bucket: str, target_prefix: str, listing_file: str, tmpdir: str) -> int:
+    """Migrate the _pgp directory to the new layout
+
+    Returns the number of keys which were not already present under the new layout.
+    """
     print("Migrating public keys")
     original_key_prefixes = []
+    new_keys = 0
 
     key_id_regex = re.compile(r"_pgp/([^/]+)\.pub$")
     public_key_pattern = r"\.pub$"
@@ -349,6 +373,9 @@ def migrate_keys(bucket: str, target_prefix: str, listing_file: str, tmpdir: str
             ],
         }
 
+        if not s3_object_exists(bucket, key_manifest_prefix):
+            new_keys += 1
+
         local_manifest_path = os.path.join(tmpdir, f"{key_id}.key.manifest.json")
         with open(local_manifest_path, "w", encoding="utf-8") as fd:
             json.dump(key_manifest_dict, fd, indent=0, separators=(",", ":"))
@@ -371,11 +398,33 @@ def migrate_keys(bucket: str, target_prefix: str, listing_file: str, tmpdir: str
             print(f"Failed to upload {local_manifest_path} to s3://{bucket}/{key_manifest_prefix}")
             continue
 
+    return new_keys
+
 
 ################################################################################
 #
-def update_mirror_index(mirror_url: str, clone_spack_dir: str):
-    """Clone spack and update the index for the new layout"""
+def update_mirror_index(
+    mirror_url: str,
+    clone_spack_dir: str,
+    spec_dicts: Optional[List[dict]] = None,
+    keys_changed: bool = True,
+):
+    """Update the index for the new layout
+
+    When only the given specs were added to the mirror (and no keys), they are
+    merged into the existing index.  Otherwise, or if the index can't be safely
+    updated in place, spack is cloned to rebuild the spec and key indices from
+    scratch.
+    """
+    if spec_dicts is not None and not keys_changed:
+        bucket = bucket_name_from_s3_url(mirror_url)
+        mirror_prefix = mirror_url[len(f"s3://{bucket}/") :].rstrip("/")
+        try:
+            update_index(bucket, mirror_prefix, 3, spec_dicts)
+            return
+        except IndexInconsistencyError as e:
+            print(f"Unable to update index incrementally ({e}), rebuilding it instead")
+
     print(f"Rebuilding index at {mirror_url}")
 
     clone_spack(clone_dir=clone_spack_dir)
@@ -396,9 +445,40 @@ def update_mirror_index(mirror_url: str, clone_spack_dir: str):
         print(f"Updating index failed due to {e}")
 
 
+################################################################################
+# Refresh the parts of the inventory relevant to migration (the old and new
+# layout spec catalogs of the mirror), and write them out as a listing file.
+def write_listing_from_inventory(
+    mirror_url: str, listing_file: str, inventory_path: str, parallel: int
+):
+    bucket = bucket_name_from_s3_url(mirror_url)
+    mirror_prefix = mirror_url[len(f"s3://{bucket}/") :].rstrip("/")
+    scopes = catalog_scopes([mirror_prefix], 2) + catalog_scopes([mirror_prefix], 3)
+
+    with Inventory(inventory_path) as inventory:
+        client = s3_create_client(max_pool_connections=parallel)
+        inventory.refresh(client, bucket, scopes, parallel=parallel)
+        inventory.write_listing(bucket, [prefix for prefix, _ in scopes], listing_file)
+
+
+################################################################################
+# Split the prefix of a mirror into the ref, and the stack if it's a stack mirror
+def ref_and_stack(mirror_prefix: str) -> Tuple[str, str]:
+    if is_ref_protected(mirror_prefix) or "/" not in mirror_prefix:
+        return mirror_prefix, ""
+    ref, stack = mirror_prefix.rsplit("/", 1)
+    return ref, stack
+
+
 ################################################################################
 #
-def migrate(mirror_url: str, workdir: str, force: bool = False, parallel: int = 8):
+def migrate(
+    mirror_url: str,
+    workdir: str,
+    force: bool = False,
+    parallel: int = 8,
+    inventory_path: Optional[str] = None,
+):
     """Migrate all specs in the given mirror
 
     When ``force`` is False, avoids do any work for specs that appear in the
@@ -410,15 +490,44 @@ def migrate(mirror_url: str, workdir: str, force: bool = False, parallel: int =
         workdir: Path where working files can be stored (for possible re-use)
         force: Determines whether to migrate already-migrate specs
         parallel: The number of concurrent threads to use in processing
+        inventory_path: Optional path of a persistent bucket inventory to
+            read the mirror contents from, rather than listing the mirror
     """
-    listing_file = os.path.join(workdir, "full_listing.txt")
     tmp_storage_dir = os.path.join(workdir, "specfiles")
 
     if not os.path.isdir(tmp_storage_dir):
         os.makedirs(tmp_storage_dir)
 
-    if not os.path.isfile(listing_file) or force:
-        list_prefix_contents(f"{mirror_url}/", listing_file)
+    metrics = Metrics("migrate")
+    metrics.start()
+
+    try:
+        _migrate(mirror_url, workdir, force, parallel, inventory_path, metrics)
+    finally:
+        metrics.stop()
+
+
+################################################################################
+#
+def _migrate(
+    mirror_url: str,
+    workdir: str,
+    force: bool,
+    parallel: int,
+    inventory_path: Optional[str],
+    metrics: Metrics,
+):
+    listing_file = os.path.join(workdir, "full_listing.txt")
+    tmp_storage_dir = os.path.join(workdir, "specfiles")
+
+    bucket = bucket_name_from_s3_url(mirror_url)
+    ref, stack = ref_and_stack(mirror_url[len(f"s3://{bucket}/") :].rstrip("/"))
+
+    with metrics.phase(ref, "listing"):
+        if inventory_path:
+            write_listing_from_inventory(mirror_url, listing_file, inventory_path, parallel)
+        elif not os.path.isfile(listing_file) or force:
+            list_prefix_contents(f"{mirror_url}/", listing_file)
 
     all_catalogs = spec_catalogs_from_listing_v2(listing_file)
     target_prefix = None
@@ -435,13 +544,16 @@ def migrate(mirror_url: str, workdir: str, force: bool = False, parallel: int =
     target_catalog = all_catalogs[target_prefix]
     total_count = len(target_catalog)
     print(f"Found mirror: {target_prefix} has {total_count} specs to migrate")
+    metrics.set_missing(ref, {stack: total_count})
 
     for spec_hash, built_spec in target_catalog.items():
         print(f"  {spec_hash}:")
         print(f"    meta: {built_spec.meta}")
         print(f"    archive: {built_spec.archive}")
 
-    bucket = bucket_name_from_s3_url(mirror_url)
+    # The keys in $GNUPGHOME are loaded once to verify all the specs
+    verifier = SignatureVerifier(export_public_keys())
+    metrics.track(verifier=verifier)
 
     # Build a list of tasks for threads
     task_list = [
@@ -452,34 +564,47 @@ def migrate(mirror_url: str, workdir: str, force: bool = False, parallel: int =
             target_prefix,
             tmp_storage_dir,
             force,
+            verifier,
         )
         for (_, built_spec) in target_catalog.items()
     ]
 
-    migrated_specs = 0
+    migrated_specs = []
 
     # Dispatch work tasks
-    with ThreadPoolExecutor(max_workers=parallel) as executor:
+    with metrics.phase(ref, "migrate"), ThreadPoolExecutor(
+        max_workers=parallel
+    ) as executor:
         futures = [executor.submit(_migrate_spec, *task) for task in task_list]
         for future in as_completed(futures):
             try:
                 result = future.result()
             except Exception as exc:
                 print(f"Exception: {exc}")
+                metrics.spec_failed(ref, stack)
             else:
                 if result and result.migrated:
-                    migrated_specs += 1
+                    migrated_specs.append(result.spec_dict)
+                    metrics.spec_published(ref, stack, result.size)
                 else:
                     print(f"Spec was not migrated due to: {result.message}")
 
     print("All migration threads finished")
+    verifier.report()
 
-    if migrated_specs > 0:
+    if migrated_specs:
         # Migrate any signing keys
-        migrate_keys(bucket, target_prefix, listing_file, tmp_storage_dir)
-
-        # Rebuild the top-level index
-        update_mirror_index(mirror_url=mirror_url, clone_spack_dir=workdir)
+        with metrics.phase(ref, "keys"):
+            new_keys = migrate_keys(bucket, target_prefix, listing_file, tmp_storage_dir)
+
+        # Update the top-level index
+        with metrics.phase(ref, "index"):
+            update_mirror_index(
+                mirror_url=mirror_url,
+                clone_spack_dir=workdir,
+                spec_dicts=migrated_specs,
+                keys_changed=new_keys > 0,
+            )
 
 
 ################################################################################
@@ -516,6 +641,13 @@ def main():
         "-p", "--parallel", default=8, type=int, help="Thread parallelism level"
     )
 
+    parser.add_argument(
+        "-i",
+        "--inventory",
+        default=None,
+        help="Path of a persistent bucket inventory to read the mirror contents from",
+    )
+
     args = parser.parse_args()
     if not args.mirror:
         print("Missing required mirror argument")
@@ -524,7 +656,13 @@ def main():
     # If the cli didn't provide a working directory, we will create (and clean up)
     # a temporary directory using this workdir context
     with get_workdir_context(args.workdir) as workdir:
-        migrate(args.mirror, workdir=workdir, force=args.force, parallel=args.parallel)
+        migrate(
+            args.mirror,
+            workdir=workdir,
+            force=args.force,
+            parallel=args.parallel,
+            inventory_path=args.inventory,
+        )
 
     end_time = datetime.now()
     elapsed = end_time - start_time
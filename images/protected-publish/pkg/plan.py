@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from .common import BuiltSpec
+
+PLAN_VERSION = 1
+
+
+################################################################################
+#
+def plan_entry(built_spec: BuiltSpec, objects: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Describe a spec to publish, along with the objects to copy for it"""
+    return {
+        "hash": built_spec.hash,
+        "stack": built_spec.stack,
+        "meta": built_spec.meta,
+        "archive": built_spec.archive,
+        "manifest": built_spec.manifest_prefix,
+        "manifest_path": built_spec.manifest_path,
+        "objects": objects,
+    }
+
+
+################################################################################
+#
+def built_spec_from_entry(entry: Dict[str, Any]) -> BuiltSpec:
+    built_spec = BuiltSpec(
+        hash=entry["hash"],
+        stack=entry["stack"],
+        meta=entry["meta"],
+        archive=entry["archive"],
+        manifest_prefix=entry["manifest"],
+        manifest_path=entry["manifest_path"],
+    )
+    for obj in entry["objects"]:
+        if obj["size"] is not None:
+            built_spec.sizes[obj["src"]] = obj["size"]
+    return built_spec
+
+
+################################################################################
+#
+def write_plan(
+    path: str,
+    bucket: str,
+    ref: str,
+    layout_version: int,
+    entries: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    plan = {
+        "version": PLAN_VERSION,
+        "bucket": bucket,
+        "ref": ref,
+        "layout_version": layout_version,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "total_bytes": sum(o["size"] or 0 for e in entries for o in e["objects"]),
+        "specs": entries,
+    }
+
+    # Write to the side and rename, so a plan on disk is always complete
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp_path, path)
+
+    return plan
+
+
+################################################################################
+# Read a plan made for the same mirror and layout, if there is one
+def read_plan(
+    path: str, bucket: str, ref: str, layout_version: int
+) -> Optional[Dict[str, Any]]:
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        plan = json.load(f)
+
+    if (
+        plan.get("version") != PLAN_VERSION
+        or plan.get("bucket") != bucket
+        or plan.get("ref") != ref
+        or plan.get("layout_version") != layout_version
+    ):
+        return None
+
+    return plan
+
+
+################################################################################
+# Record of the progress made executing a plan
+class Journal:
+    """An append-only record of the specs published, and the index update
+
+    Each completed item is written (and flushed) as a line of json as soon as
+    it completes, so that execution of the plan can resume where it stopped.
+    A partial last line, from being interrupted mid-write, is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.published: Set[str] = set()
+        self.index: Optional[str] = None
+        partial = False
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    partial = not line.endswith("\n")
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "published" in item:
+                        self.published.add(item["published"])
+                    elif "index" in item:
+                        self.index = item["index"]
+
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+        # Don't append to the end of a partially written line
+        if partial:
+            self._file.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def complete(self) -> bool:
+        return self.index is not None
+
+    def _append(self, item: Dict[str, Any]):
+        item["at"] = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._file.write(json.dumps(item) + "\n")
+            self._file.flush()
+
+    def record_published(self, spec_hash: str):
+        self._append({"published": spec_hash})
+        with self._lock:
+            self.published.add(spec_hash)
+
+    def record_index(self, how: str):
+        self._append({"index": how})
+        self.index = how
+
+
+################################################################################
+#
+def print_plan(plan: Dict[str, Any], journal: Optional[Journal] = None):
+    published = journal.published if journal else set()
+    remaining = [e for e in plan["specs"] if e["hash"] not in published]
+
+    stacks: Dict[str, List[int]] = {}
+    for entry in remaining:
+        counts = stacks.setdefault(entry["stack"], [0, 0])
+        counts[0] += 1
+        counts[1] += sum(o["size"] or 0 for o in entry["objects"])
+
+    print(
+        f"Plan for s3://{plan['bucket']}/{plan['ref']} (created {plan['created']}): "
+        f"{len(remaining)} of {len(plan['specs'])} specs remaining"
+    )
+    for stack, (count, size) in sorted(stacks.items()):
+        print(f"    {stack}: {count} specs, {size} bytes")
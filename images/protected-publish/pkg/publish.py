@@ -1,14 +1,16 @@
 import argparse
+import json
 import os
 import re
 import shutil
 import stat
 import subprocess
+import threading
 
 from collections import defaultdict
-from concurrent.futures import as_completed, ThreadPoolExecutor
+from concurrent.futures import as_completed, Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import botocore.exceptions
 
@@ -20,18 +22,29 @@ from boto3.s3.transfer import TransferConfig
 from .common import (
     clone_spack,
     extract_json_from_clearsig,
+    extract_json_from_clearsig_text,
     get_workdir_context,
-    list_prefix_contents,
-    s3_copy_file,
     s3_create_client,
     s3_download_file,
-    spec_catalogs_from_listing_v2,
-    spec_catalogs_from_listing_v3,
     BuiltSpec,
     MalformedManifestError,
     NoSuchMediaTypeError,
     UnexpectedURLFormatError,
 )
+from .copier import CopyEngine
+from .index import decode_blob, IndexInconsistencyError, update_index
+from .inventory import inventory_catalog_objects, Inventory
+from .listing import spec_catalogs_from_objects, spec_catalogs_from_s3
+from .metrics import Metrics
+from .plan import (
+    built_spec_from_entry,
+    plan_entry,
+    print_plan,
+    read_plan,
+    write_plan,
+    Journal,
+)
+from .signatures import export_public_keys, SignatureVerifier
 
 sentry_sdk.init(traces_sample_rate=1.0)
 
@@ -67,7 +80,7 @@ def is_ref_protected(ref):
 
 ################################################################################
 #
-def publish_missing_spec_v2(built_spec, bucket, ref, force, gpg_home, tmpdir):
+def publish_missing_spec_v2(built_spec, bucket, ref, force, verifier, copier, tmpdir):
     """Publish a single spec from a stack to the root"""
     hash = built_spec.hash
     meta_suffix = built_spec.meta
@@ -83,12 +96,10 @@ def publish_missing_spec_v2(built_spec, bucket, ref, force, gpg_home, tmpdir):
         return False, error_msg
 
     # Verify the signature of the locally downloaded metadata file
-    try:
-        env = {"GNUPGHOME": gpg_home}
-        subprocess.run(["gpg", "--verify", specfile_path], env=env, check=True)
-    except subprocess.CalledProcessError as cpe:
-        error_msg = getattr(cpe, "message", cpe)
-        print(f"Failed to verify signature of {meta_suffix} due to {error_msg}")
+    result = verifier.verify_file(specfile_path)
+    if not result.verified:
+        error_msg = f"Failed to verify signature of {meta_suffix} due to {result.message}"
+        print(error_msg)
         return False, error_msg
 
     # Finally, copy the files directly from source to dest, starting with the tarball
@@ -97,11 +108,8 @@ def publish_missing_spec_v2(built_spec, bucket, ref, force, gpg_home, tmpdir):
         if m:
             dest_prefix = f"{ref}/build_cache/{m.group(1)}"
             try:
-                copy_source = {
-                    "Bucket": bucket,
-                    "Key": suffix,
-                }
-                s3_copy_file(copy_source, bucket, dest_prefix)
+                size = built_spec.sizes.get(suffix)
+                copier.copy(bucket, suffix, dest_prefix, size=size)
             except Exception as error:
                 error_msg = getattr(error, "message", error)
                 error_msg = f"Failed to copy_object({suffix}) due to {error_msg}"
@@ -110,68 +118,221 @@ def publish_missing_spec_v2(built_spec, bucket, ref, force, gpg_home, tmpdir):
     return True, f"Published {meta_suffix} and {archive_suffix} to s3://{bucket}/{ref}/"
 
 
+################################################################################
+# Return the top-level key of an object within one of the stack mirrors
+def top_level_key(ref: str, stack: str, stack_key: str) -> str:
+    m = re.match(rf"^{re.escape(ref)}/{re.escape(stack)}/(.+)$", stack_key)
+    if not m:
+        raise UnexpectedURLFormatError(stack_key)
+    return f"{ref}/{m.group(1)}"
+
+
 ################################################################################
 #
-def publish_missing_spec_v3(built_spec, bucket, ref, force, gpg_home, tmpdir):
-    """Publish a single spec from a stack to the root"""
-    spec_hash = built_spec.hash
-    stack = built_spec.stack
-    stack_manifest_prefix = built_spec.manifest_prefix
-    stack_meta_prefix = built_spec.meta
-    stack_archive_prefix = built_spec.archive
+def publish_specs_v3(
+    built_specs: List[BuiltSpec],
+    bucket: str,
+    ref: str,
+    copier,
+    on_published: Optional[Callable[[BuiltSpec], None]] = None,
+) -> List[BuiltSpec]:
+    """Publish specs from their stacks to the root, returning those published
+
+    Blobs (tarballs and spec metadata) are content-addressed, so the same blob is
+    often shared by specs from several stacks, or already present at the top
+    level from an earlier publish.  Each distinct destination blob is checked
+    for existence and copied at most once, and all blob copies complete before
+    any manifest is copied, so a published manifest never refers to a missing
+    blob.  In the v3 layout, the manifests of all the specs to publish were
+    already verified (see verify_manifests).  If given, ``on_published`` is
+    called with each spec as soon as it has been published.
+    """
+    # Destination key of every blob, with the source and size of the first
+    # spec referring to it, and the sizes of the other references to it, which
+    # are counted as skipped once the blob is in place.
+    blob_sources: Dict[str, Tuple[str, Optional[int]]] = {}
+    duplicate_sizes: Dict[str, List[int]] = defaultdict(list)
+    spec_blobs: Dict[str, List[str]] = {}
+    failed: Dict[str, str] = {}
+
+    for built_spec in built_specs:
+        src_keys = (built_spec.archive, built_spec.meta)
+        try:
+            dest_keys = [top_level_key(ref, built_spec.stack, k) for k in src_keys]
+        except UnexpectedURLFormatError as error:
+            failed[built_spec.hash] = f"Unexpected key format: {error}"
+            continue
 
-    # In v3 land, we already had to download this file in order to access
-    # the content-address of the tarball and metadata.
-    manifest_path = built_spec.manifest_path
+        for src_key, dest_key in zip(src_keys, dest_keys):
+            size = built_spec.sizes.get(src_key)
+            if dest_key in blob_sources:
+                duplicate_sizes[dest_key].append(size or 0)
+            else:
+                blob_sources[dest_key] = (src_key, size)
+        spec_blobs[built_spec.hash] = dest_keys
+
+    def copy_blob(dest_key):
+        src_key, size = blob_sources[dest_key]
+        if copier.exists(bucket, dest_key):
+            copier.skipped(size or 0)
+            return False
+        copier.copy(bucket, src_key, dest_key, size=size)
+        return True
+
+    print(f"Publishing {len(blob_sources)} distinct blobs to s3://{bucket}/{ref}/")
+
+    failed_blobs: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=copier.max_concurrency) as executor:
+        futures = {executor.submit(copy_blob, key): key for key in blob_sources}
+        for future in as_completed(futures):
+            dest_key = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                error_msg = getattr(error, "message", error)
+                failed_blobs[dest_key] = (
+                    f"Failed to copy_object({blob_sources[dest_key][0]}) due to {error_msg}"
+                )
+            else:
+                for size in duplicate_sizes[dest_key]:
+                    copier.skipped(size)
 
-    # Verify the signature of the previously downloaded manifest file
-    try:
-        env = {"GNUPGHOME": gpg_home}
-        subprocess.run(["gpg", "--verify", manifest_path], env=env, check=True)
-    except subprocess.CalledProcessError as cpe:
-        error_msg = getattr(cpe, "message", cpe)
-        print(f"Failed to verify signature of {stack_meta_prefix} due to {error_msg}")
-        return False, error_msg
+    def copy_manifest(built_spec):
+        for dest_key in spec_blobs[built_spec.hash]:
+            if dest_key in failed_blobs:
+                return False, failed_blobs[dest_key]
 
-    stack_regex = re.compile(rf"^{ref}/{stack}/(.+)$")
+        src_key = built_spec.manifest_prefix
+        try:
+            dest_key = top_level_key(ref, built_spec.stack, src_key)
+            copier.copy(bucket, src_key, dest_key, size=built_spec.sizes.get(src_key))
+        except Exception as error:
+            error_msg = getattr(error, "message", error)
+            return False, f"Failed to copy_object({src_key}) due to {error_msg}"
 
-    m = stack_regex.match(stack_manifest_prefix)
-    if not m:
-        raise UnexpectedURLFormatError(stack_manifest_prefix)
-    top_level_manifest_prefix = f"{ref}/{m.group(1)}"
+        return True, f"Published {src_key} to s3://{bucket}/{ref}/"
 
-    m = stack_regex.match(stack_meta_prefix)
-    if not m:
-        raise UnexpectedURLFormatError(stack_meta_prefix)
-    top_level_meta_prefix = f"{ref}/{m.group(1)}"
+    for spec_hash, error_msg in failed.items():
+        print(f"Publishing failed: {spec_hash}: {error_msg}")
 
-    m = stack_regex.match(stack_archive_prefix)
-    if not m:
-        raise UnexpectedURLFormatError(stack_archive_prefix)
-    top_level_archive_prefix = f"{ref}/{m.group(1)}"
+    published = []
+    with ThreadPoolExecutor(max_workers=copier.max_concurrency) as executor:
+        futures = {
+            executor.submit(copy_manifest, built_spec): built_spec
+            for built_spec in built_specs
+            if built_spec.hash in spec_blobs
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as exc:
+                print(f"Exception: {exc}")
+            else:
+                if not result[0]:
+                    print(f"Publishing failed: {result[1]}")
+                else:
+                    print(result[1])
+                    published.append(futures[future])
+                    if on_published:
+                        on_published(futures[future])
 
-    things_to_copy = [
-        (stack_archive_prefix, top_level_archive_prefix),
-        (stack_meta_prefix, top_level_meta_prefix),
-        (stack_manifest_prefix, top_level_manifest_prefix),
-    ]
+    return published
 
-    s3_client = s3_create_client()
 
-    # Finally, copy the files directly from source to dest, starting with the tarball
-    for src_prefix, dest_prefix in things_to_copy:
-        try:
-            copy_source = {"Bucket": bucket, "Key": src_prefix}
-            s3_copy_file(copy_source, bucket, dest_prefix, client=s3_client)
-        except Exception as error:
-            error_msg = getattr(error, "message", error)
-            error_msg = f"Failed to copy_object({src_prefix}) due to {error_msg}"
-            return False, error_msg
+################################################################################
+#
+class PublishResult(NamedTuple):
+    ref: str
+    #: Number of specs present in stacks but missing from the root
+    missing: int
+    #: Number of those specs published to the root
+    published: int
+    #: How the index of the root was updated ("incremental", "rebuilt" or "none")
+    index: str
+    elapsed: timedelta
 
-    return (
-        True,
-        f"Published {stack_manifest_prefix}, {stack_meta_prefix}, and {stack_archive_prefix} to s3://{bucket}/{ref}/",
-    )
+
+################################################################################
+# Setup shared by all the refs published in a single run
+class PublishContext:
+    """Resources shared between refs which are published concurrently
+
+    The reputational key is downloaded and imported once, and its public keys
+    loaded once to verify signatures.  All copies go through a single copy
+    engine, so ``max_copies`` bounds the copies in flight across all refs.  A
+    spack checkout is cloned once per distinct ref, in the background, as soon
+    as a ref is known to have specs to publish.  Progress of all refs is pushed
+    as metrics, labeled by ref.
+    """
+
+    def __init__(
+        self,
+        workdir: str,
+        force: bool = False,
+        parallel: int = 8,
+        max_copies: int = 64,
+        inventory_path: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.workdir = workdir
+        self.force = force
+        self.gnu_pg_home = os.path.join(workdir, ".gnupg")
+        self.copier = CopyEngine(
+            concurrency=parallel, max_concurrency=max(parallel, max_copies)
+        )
+        self.inventory = Inventory(inventory_path) if inventory_path else None
+        self.metrics = metrics or Metrics("protected-publish")
+        self.metrics.track(copier=self.copier)
+
+        self._lock = threading.Lock()
+        self._verifier: Optional[SignatureVerifier] = None
+        self._clones: Dict[str, Future] = {}
+        self._clone_executor = ThreadPoolExecutor(max_workers=4)
+
+    def __enter__(self):
+        self.metrics.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._clone_executor.shutdown(wait=True)
+        if self.inventory:
+            self.inventory.close()
+        self.metrics.stop()
+
+    def verifier(self) -> SignatureVerifier:
+        """Import the reputational key (once), returning a verifier for it"""
+        with self._lock:
+            if self._verifier is None:
+                download_and_import_key(self.gnu_pg_home, self.workdir, self.force)
+                self._verifier = SignatureVerifier(export_public_keys(self.gnu_pg_home))
+                self.metrics.track(verifier=self._verifier)
+            return self._verifier
+
+    def start_clone(self, ref: str):
+        """Start cloning spack at the given ref, unless that was already done"""
+        with self._lock:
+            if ref not in self._clones:
+                clone_dir = os.path.join(self.workdir, "clones", ref.replace("/", "_"))
+                os.makedirs(clone_dir, exist_ok=True)
+
+                def _clone_fn():
+                    clone_spack(ref, clone_dir=clone_dir)
+                    return f"{clone_dir}/spack/bin/spack"
+
+                self._clones[ref] = self._clone_executor.submit(_clone_fn)
+
+    def spack_exe(self, ref: str) -> str:
+        """Return the spack executable cloned at the given ref, waiting if needed"""
+        self.start_clone(ref)
+        return self._clones[ref].result()
+
+    def report(self):
+        if self._verifier:
+            self._verifier.report()
+        self.copier.report()
 
 
 ################################################################################
@@ -184,102 +345,326 @@ def publish(
     parallel: int = 8,
     workdir: str = "/work",
     layout_version: int = 2,
-):
+    inventory_path: Optional[str] = None,
+    max_copies: int = 64,
+    plan_only: bool = False,
+    context: Optional[PublishContext] = None,
+) -> PublishResult:
     """Publish all specs present in stacks but missing at the root
 
     Main steps of the publish algorithm:
-        1) Get a listing of the bucket contents.  This will include entries for
-           metadata and archive files for all specs at the root as well as in all
-           stacks
-        2) Use regular expressions to build dictionaries of all hashes in the
-           stack mirrors, as well as all hashes at the root.  Stored information
-           for each includes url (path) to metadata and archive file.
+        1) Get a listing of the bucket contents, concurrently by stack.  This will
+           include entries for metadata and archive files (or manifests) for all
+           specs at the root as well as in all non-excluded stacks
+        2) Build dictionaries of all hashes in the stack mirrors, as well as all
+           hashes at the root, from the listed keys.  Stored information for each
+           includes url (path) to metadata and archive file.
         3) Determine which specs are missing from the root (should contain union
            of all specs in stacks)
-        4) If no specs are missing from the top level, quit
+        4) Write a plan of the specs to publish (and the objects to copy for
+           each), and if no specs are missing from the top level, quit
         5) Download and trust the public part of the reputational signing key
-        6) In parallel, publish any missing specs:
+        6) In parallel, publish any missing specs, journaling each one:
             6a) Download meta file from stack mirror
             6b) Verify signature of metadata file
             6c) If not valid signature, QUIT
             6d) Try to copy archive file from src to dst, and quit if you can't
             6e) Try to copy metadata file from src to dst
-        7) Once all threads complete, rebuild the remote mirror index
+        7) Once all threads complete, update the remote mirror index
+
+    Steps 1-4 are skipped if the workdir holds an unfinished plan for the same
+    mirror (unless ``force``), in which case only the specs not yet journaled
+    are published.  With ``plan_only``, stop after step 4.
+
+    Copies start out ``parallel`` at a time, and adapt to throughput and to
+    throttling by S3, up to ``max_copies`` at a time.
+
+    If ``inventory_path`` is given, the listing in step 1 is kept in a
+    persistent inventory there, and only mirrors whose index changed since
+    the previous run are listed again.
+
+    When publishing several refs at once, pass the same ``context`` to each, in
+    which case ``max_copies`` and ``inventory_path`` are taken from the context.
     """
-    list_url = f"s3://{bucket}/{ref}/"
-    listing_file = os.path.join(workdir, "full_listing.txt")
+    if context is None:
+        with PublishContext(workdir, force, parallel, max_copies, inventory_path) as context:
+            result = publish(
+                bucket,
+                ref,
+                exclude,
+                force,
+                parallel,
+                workdir,
+                layout_version,
+                plan_only=plan_only,
+                context=context,
+            )
+            context.report()
+            return result
+
+    plan_path = os.path.join(workdir, "plan.json")
+    journal_path = os.path.join(workdir, "plan.journal")
+    start_time = datetime.now()
+
+    if layout_version not in (2, 3):
+        print(f"Unrecognized layout version: {layout_version}")
+        return PublishResult(ref, 0, 0, "none", datetime.now() - start_time)
+
+    # Resume an unfinished plan, unless forced to start over
+    plan = None if force else read_plan(plan_path, bucket, ref, layout_version)
+    if plan is not None:
+        with Journal(journal_path) as journal:
+            if journal.complete:
+                plan = None
+
+    if plan is None:
+        # The journal of any previous plan doesn't apply to the new one
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+        plan = plan_publish(
+            bucket, ref, exclude, force, parallel, workdir, layout_version, context
+        )
+        print(f"Wrote publish plan to {plan_path}")
+    else:
+        print(f"Resuming publish from the plan in {plan_path}")
+
+    with Journal(journal_path) as journal:
+        print_plan(plan, journal)
+
+        if not plan["specs"]:
+            print(f"No specs missing from s3://{bucket}/{ref}, nothing to do.")
+            return PublishResult(ref, 0, 0, "none", datetime.now() - start_time)
+
+        if plan_only:
+            return PublishResult(
+                ref,
+                len(plan["specs"]),
+                len(journal.published),
+                "none",
+                datetime.now() - start_time,
+            )
+
+        index = execute_plan(plan, journal, force, parallel, workdir, context)
+
+        return PublishResult(
+            ref,
+            len(plan["specs"]),
+            len(journal.published),
+            index,
+            datetime.now() - start_time,
+        )
+
+
+################################################################################
+# Return the objects to copy to the root in order to publish a spec
+def planned_objects(
+    built_spec: BuiltSpec, ref: str, layout_version: int
+) -> List[Dict]:
+    objects = []
+
+    if layout_version == 2:
+        for src_key in [built_spec.archive, built_spec.meta]:
+            m = PREFIX_REGEX_V2.search(src_key)
+            if m:
+                dest_key = f"{ref}/build_cache/{m.group(1)}"
+                objects.append((src_key, dest_key))
+    else:
+        for src_key in [built_spec.archive, built_spec.meta, built_spec.manifest_prefix]:
+            objects.append((src_key, top_level_key(ref, built_spec.stack, src_key)))
+
+    return [
+        {"src": src_key, "dest": dest_key, "size": built_spec.sizes.get(src_key)}
+        for src_key, dest_key in objects
+    ]
+
+
+################################################################################
+#
+def plan_publish(
+    bucket: str,
+    ref: str,
+    exclude: List[str],
+    force: bool,
+    parallel: int,
+    workdir: str,
+    layout_version: int,
+    context: PublishContext,
+) -> Dict:
+    """Find the specs missing from the root, and write a plan to publish them
+
+    The plan lists, for each spec, the stack it will be published from, and
+    the objects (with their sizes) to copy to the root.
+    """
+    listing_cache = os.path.join(workdir, "listing.jsonl")
     tmp_storage_dir = os.path.join(workdir, "specfiles")
 
     if not os.path.isdir(tmp_storage_dir):
         os.makedirs(tmp_storage_dir)
 
-    if not os.path.isfile(listing_file) or force:
-        list_prefix_contents(list_url, listing_file)
+    metrics = context.metrics
 
-    # Build dictionaries of specs existing at the root and within stacks
+    start_time = datetime.now()
+    with metrics.phase(ref, "listing"):
+        if context.inventory:
+            objects = inventory_catalog_objects(
+                context.inventory,
+                s3_create_client(max_pool_connections=parallel),
+                bucket,
+                ref,
+                layout_version,
+                exclude=exclude,
+                parallel=parallel,
+                force=force,
+            )
+            all_catalogs = spec_catalogs_from_objects(objects, layout_version)
+        else:
+            all_catalogs = spec_catalogs_from_s3(
+                bucket,
+                ref,
+                layout_version,
+                exclude=exclude,
+                parallel=parallel,
+                cache_path=listing_cache,
+                force=force,
+            )
+    elapsed = datetime.now() - start_time
+    print(f"Listed s3://{bucket}/{ref}/, elapsed time: {elapsed}")
 
-    if layout_version == 2:
-        all_stack_specs, top_level_specs = generate_spec_catalogs_v2(
-            ref, listing_file, exclude
-        )
-        publish_fn = publish_missing_spec_v2
-    elif layout_version == 3:
-        all_stack_specs, top_level_specs = generate_spec_catalogs_v3(
-            bucket, ref, listing_file, exclude, tmp_storage_dir, parallel
-        )
-        publish_fn = publish_missing_spec_v3
-    else:
-        print(f"Unrecognized layout version: {layout_version}")
-        return
+    # Build dictionaries of specs existing at the root and within stacks
+    with metrics.phase(ref, "catalog"):
+        if layout_version == 2:
+            all_stack_specs, top_level_specs = generate_spec_catalogs_v2(
+                ref, all_catalogs, exclude
+            )
+        else:
+            all_stack_specs, top_level_specs = generate_spec_catalogs_v3(
+                bucket, ref, all_catalogs, exclude, tmp_storage_dir, parallel, force
+            )
 
-    # Build dictionary of specs in stacks but missing from the root
-    missing_at_top = find_top_level_missing(all_stack_specs, top_level_specs)
+        # Build dictionary of specs in stacks but missing from the root
+        missing_at_top = find_top_level_missing(all_stack_specs, top_level_specs)
 
     print_summary(missing_at_top)
 
-    if not missing_at_top:
-        print(f"No specs missing from s3://{bucket}/{ref}, nothing to do.")
-        return
+    # Duplicates are effectively identical, just take the "first" one
+    specs_to_publish = [
+        next(iter(stacks_dict.values())) for stacks_dict in missing_at_top.values()
+    ]
 
-    gnu_pg_home = os.path.join(workdir, ".gnupg")
-    download_and_import_key(gnu_pg_home, workdir, force)
+    entries = []
+    for built_spec in specs_to_publish:
+        try:
+            objects = planned_objects(built_spec, ref, layout_version)
+        except UnexpectedURLFormatError as error:
+            print(f"Unable to plan publishing {built_spec.hash}: {error}")
+            continue
+        entries.append(plan_entry(built_spec, objects))
 
-    # Build a list of tasks for threads
-    task_list = [
-        (
-            # Duplicates are effectively identical, just take the "first" one
-            next(iter(stacks_dict.values())),
-            bucket,
-            ref,
-            force,
-            gnu_pg_home,
-            tmp_storage_dir,
-        )
-        for (_, stacks_dict) in missing_at_top.items()
+    return write_plan(
+        os.path.join(workdir, "plan.json"), bucket, ref, layout_version, entries
+    )
+
+
+################################################################################
+#
+def execute_plan(
+    plan: Dict,
+    journal: Journal,
+    force: bool,
+    parallel: int,
+    workdir: str,
+    context: PublishContext,
+) -> str:
+    """Publish the specs in the plan not yet journaled, then update the index
+
+    Each spec is journaled once published, and the index update once done, so
+    an interrupted execution resumes where it stopped.  Returns how the index
+    was updated.
+    """
+    bucket = plan["bucket"]
+    ref = plan["ref"]
+    layout_version = plan["layout_version"]
+    tmp_storage_dir = os.path.join(workdir, "specfiles")
+
+    if not os.path.isdir(tmp_storage_dir):
+        os.makedirs(tmp_storage_dir)
+
+    # Clone spack version appropriate to what we're publishing, while publishing
+    context.start_clone(ref)
+
+    metrics = context.metrics
+    entries = {entry["hash"]: entry for entry in plan["specs"]}
+
+    remaining: Dict[str, int] = defaultdict(int)
+    for entry in plan["specs"]:
+        if entry["hash"] not in journal.published:
+            remaining[entry["stack"] or ""] += 1
+    metrics.set_missing(ref, remaining)
+
+    def _published(built_spec):
+        journal.record_published(built_spec.hash)
+        size = sum(o["size"] or 0 for o in entries[built_spec.hash]["objects"])
+        metrics.spec_published(ref, built_spec.stack or "", size)
+
+    specs_to_publish = [
+        built_spec_from_entry(entry)
+        for entry in plan["specs"]
+        if entry["hash"] not in journal.published
     ]
 
-    # Dispatch work tasks
-    with ThreadPoolExecutor(max_workers=parallel) as executor:
-        futures = [executor.submit(publish_fn, *task) for task in task_list]
-        for future in as_completed(futures):
-            try:
-                result = future.result()
-            except Exception as exc:
-                print(f"Exception: {exc}")
-            else:
-                if not result[0]:
-                    print(f"Publishing failed: {result[1]}")
+    if specs_to_publish:
+        verifier = context.verifier()
+        copier = context.copier
+
+    if layout_version == 3 and specs_to_publish:
+        with metrics.phase(ref, "verify"):
+            verified = verify_manifests(verifier, specs_to_publish, parallel)
+        with metrics.phase(ref, "copy"):
+            publish_specs_v3(verified, bucket, ref, copier, on_published=_published)
+    elif specs_to_publish:
+        # Build a list of tasks for threads
+        task_list = [
+            (built_spec, bucket, ref, force, verifier, copier, tmp_storage_dir)
+            for built_spec in specs_to_publish
+        ]
+
+        # Dispatch work tasks, with enough threads for the copier to adapt upward
+        with metrics.phase(ref, "copy"), ThreadPoolExecutor(
+            max_workers=copier.max_concurrency
+        ) as executor:
+            futures = {
+                executor.submit(publish_missing_spec_v2, *task): task[0]
+                for task in task_list
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    print(f"Exception: {exc}")
                 else:
-                    print(result[1])
+                    if not result[0]:
+                        print(f"Publishing failed: {result[1]}")
+                    else:
+                        print(result[1])
+                        _published(futures[future])
+
+    for built_spec in specs_to_publish:
+        if built_spec.hash not in journal.published:
+            metrics.spec_failed(ref, built_spec.stack or "")
+
+    # Everything published by this plan, including by any earlier attempts
+    published = [
+        built_spec_from_entry(entry)
+        for entry in plan["specs"]
+        if entry["hash"] in journal.published
+    ]
 
     mirror_url = f"s3://{bucket}/{ref}"
 
     # When all the tasks are finished, rebuild the top-level index
-    print("Publishing complete")
+    print(f"Publishing complete for {mirror_url}")
 
-    # Clone spack version appropriate to what we're publishing
-    clone_spack(ref, clone_dir=workdir)
-    spack_exe = f"{workdir}/spack/bin/spack"
+    spack_exe = context.spack_exe(ref)
 
     # Can be useful for testing to clone a custom spack to somewhere other than "/"
     # clone_spack(
@@ -289,22 +674,118 @@ def publish(
     # )
     # spack_exe = f"{workdir}/spack/bin/spack"
 
-    # Publish the key used for verification
-    print(f"Publishing trusted keys to {mirror_url}")
-    my_env = os.environ.copy()
-    my_env["SPACK_GNUPGHOME"] = gnu_pg_home
-    subprocess.run(
-        [spack_exe, "gpg", "publish", "--mirror-url", mirror_url],
-        env=my_env,
-        check=True,
-    )
+    with metrics.phase(ref, "index"):
+        # Publish the key used for verification, and update the key index
+        print(f"Publishing trusted keys to {mirror_url}")
+        my_env = os.environ.copy()
+        my_env["SPACK_GNUPGHOME"] = context.gnu_pg_home
+        subprocess.run(
+            [spack_exe, "gpg", "publish", "--update-index", "--mirror-url", mirror_url],
+            env=my_env,
+            check=True,
+        )
 
-    # Rebuild the package and key index
-    print(f"Rebuilding index at {mirror_url}")
-    subprocess.run(
-        [spack_exe, "buildcache", "update-index", "--keys", mirror_url],
-        check=True,
-    )
+        # Merge just the published specs into the index, rebuilding the whole index
+        # only when that can't be done safely.  Other errors (e.g. from s3, after
+        # retrying) fail the ref.
+        try:
+            spec_dicts = read_published_metadata(
+                published, bucket, layout_version, tmp_storage_dir, parallel
+            )
+            update_index(bucket, ref, layout_version, spec_dicts)
+            index = "incremental"
+        except IndexInconsistencyError as error:
+            print(
+                f"Unable to update index incrementally ({error}), rebuilding it instead"
+            )
+            print(f"Rebuilding index at {mirror_url}")
+            subprocess.run(
+                [spack_exe, "buildcache", "update-index", "--keys", mirror_url],
+                check=True,
+            )
+            index = "rebuilt"
+
+    journal.record_index(index)
+    return index
+
+
+################################################################################
+#
+def print_publish_summary(results: List[PublishResult], failures: Dict[str, Exception]):
+    """Print a summary of the results of publishing each ref"""
+    print("Summary:")
+    for result in sorted(results):
+        print(
+            f"  {result.ref}: published {result.published} of {result.missing} "
+            f"missing specs, index: {result.index}, elapsed time: {result.elapsed}"
+        )
+    for ref, error in sorted(failures.items()):
+        print(f"  {ref}: failed due to {error}")
+
+
+################################################################################
+#
+def read_published_metadata(
+    built_specs: List[BuiltSpec],
+    bucket: str,
+    layout_version: int,
+    specfiles_dir: str,
+    parallel: int = 8,
+) -> List[Dict]:
+    """Return the metadata (spec dicts) of the given published specs
+
+    In the v2 layout, the signed metadata was already downloaded (to verify it)
+    while publishing.  In the v3 layout only the manifest was, so the metadata
+    blob is fetched, and checked against the checksum in the verified manifest.
+    """
+    s3_client = s3_create_client(max_pool_connections=parallel)
+
+    def _read_fn(built_spec):
+        if layout_version == 2:
+            return extract_json_from_clearsig(
+                os.path.join(specfiles_dir, f"{built_spec.hash}.spec.json.sig")
+            )
+
+        with open(built_spec.manifest_path) as f:
+            manifest_dict = extract_json_from_clearsig_text(f.read())
+        record = find_data_with_media_type(manifest_dict["data"], SPEC_METADATA_MEDIA_TYPE)
+        response = s3_client.get_object(Bucket=bucket, Key=built_spec.meta)
+        return json.loads(decode_blob(response["Body"].read(), record))
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return list(executor.map(_read_fn, built_specs))
+
+
+################################################################################
+#
+def verify_manifests(
+    verifier: SignatureVerifier, built_specs: List[BuiltSpec], parallel: int = 8
+) -> List[BuiltSpec]:
+    """Verify the signatures of the downloaded manifests of the given specs
+
+    Verification is spread over up to ``parallel`` processes.  Returns only the
+    specs whose manifests were verified.
+    """
+    manifests = {}
+    for built_spec in built_specs:
+        with open(built_spec.manifest_path) as f:
+            manifests[built_spec.hash] = f.read()
+
+    processes = min(parallel, os.cpu_count() or 1)
+    results = verifier.verify_all(manifests, processes=processes)
+
+    verified = []
+    for built_spec in built_specs:
+        result = results[built_spec.hash]
+        if result.verified:
+            verified.append(built_spec)
+        else:
+            print(
+                f"Failed to verify signature of {built_spec.manifest_prefix} "
+                f"due to {result.message}"
+            )
+
+    return verified
 
 
 ################################################################################
@@ -419,13 +900,14 @@ def print_summary(missing_at_top: Dict[str, Dict[str, BuiltSpec]]):
 ################################################################################
 #
 def generate_spec_catalogs_v2(
-    ref: str, listing_path: str, exclude: List[str]
+    ref: str, all_catalogs: Dict[str, Dict[str, BuiltSpec]], exclude: List[str]
 ) -> tuple[Dict[str, Dict[str, BuiltSpec]], Dict[str, BuiltSpec]]:
     """Return information about specs in stacks and at the root
 
-    Read the listing file, populate and return a tuple of dicts indicating which
-    specs exist in stacks, and which exist in the top-level buildcache. Stacks
-    appearing in the ``exclude`` list are ignoreed.
+    From the catalogs of every prefix in the listing, populate and return a
+    tuple of dicts indicating which specs exist in stacks, and which exist in
+    the top-level buildcache. Stacks appearing in the ``exclude`` list are
+    ignoreed.
 
     Returns a tuple like the following:
 
@@ -449,7 +931,6 @@ def generate_spec_catalogs_v2(
     stack_specs: Dict[str, Dict[str, BuiltSpec]] = defaultdict(
         lambda: defaultdict(BuiltSpec)
     )
-    all_catalogs = spec_catalogs_from_listing_v2(listing_path)
     top_level_specs = all_catalogs[ref]
 
     for prefix in all_catalogs:
@@ -462,6 +943,7 @@ def generate_spec_catalogs_v2(
             continue
 
         for spec_hash, built_spec in all_catalogs[prefix].items():
+            built_spec.stack = stack
             stack_specs[spec_hash][stack] = built_spec
 
     return stack_specs, top_level_specs
@@ -496,21 +978,26 @@ def format_blob_url(prefix: str, blob_record: Dict[str, str]) -> str:
 def generate_spec_catalogs_v3(
     bucket: str,
     ref: str,
-    listing_path: str,
+    all_catalogs: Dict[str, Dict[str, BuiltSpec]],
     exclude: List[str],
     specfiles_dir: str,
     parallel: int = 8,
+    force: bool = False,
 ) -> tuple[Dict[str, Dict[str, BuiltSpec]], Dict[str, BuiltSpec]]:
-    """Return information about specs in stacks and at the root"""
+    """Return information about specs in stacks and at the root
+
+    The locations of the metadata and archive of a spec are only known from its
+    manifest, so only the manifests of specs missing from the top level are
+    fetched, using the key from the listing.  For each missing hash, manifests
+    are fetched from the stacks containing it until one can be read, so only
+    that stack is considered viable for publishing it.
+    """
     stack_prefix_regex = re.compile(rf"{ref}/(.+)")
     stack_specs: Dict[str, Dict[str, BuiltSpec]] = defaultdict(
         lambda: defaultdict(BuiltSpec)
     )
-    all_catalogs = spec_catalogs_from_listing_v3(listing_path)
     top_level_specs = all_catalogs[ref]
 
-    task_list = []
-
     for prefix in all_catalogs:
         m = stack_prefix_regex.search(prefix)
         if not m:
@@ -520,76 +1007,78 @@ def generate_spec_catalogs_v3(
         if stack in exclude:
             continue
 
-        stack_manifests_dir = os.path.join(specfiles_dir, stack)
-        os.makedirs(stack_manifests_dir)
-        stack_manifest_sync_cmd = [
-            "aws",
-            "s3",
-            "sync",
-            "--exclude",
-            "*",
-            "--include",
-            "*.spec.manifest.json",
-            f"s3://{bucket}/{prefix}/v3/manifests/spec",
-            stack_manifests_dir,
-        ]
+        for spec_hash, built_spec in all_catalogs[prefix].items():
+            built_spec.stack = stack
+            stack_specs[spec_hash][stack] = built_spec
 
-        start_time = datetime.now()
+    task_list = [
+        (spec_hash, list(stacks_dict.values()))
+        for spec_hash, stacks_dict in stack_specs.items()
+        if spec_hash not in top_level_specs
+    ]
 
-        try:
-            print(f"Downloading manifests for stack {stack}")
-            subprocess.run(stack_manifest_sync_cmd, check=True)
-        except subprocess.CalledProcessError as cpe:
-            error_msg = getattr(cpe, "message", cpe)
-            print(f"Failed to download manifests for {stack} due to: {error_msg}")
-            continue
+    s3_client = s3_create_client(max_pool_connections=parallel)
 
-        end_time = datetime.now()
-        elapsed = end_time - start_time
-        print(f"Downloaded manifests for stack {stack}, elapsed time: {elapsed}")
+    def _fetch_manifest_fn(spec_hash, built_specs):
+        for built_spec in built_specs:
+            stack = built_spec.stack
+            manifest_path = os.path.join(
+                specfiles_dir, stack, f"{spec_hash}.spec.manifest.json"
+            )
 
-        for spec_hash, built_spec in all_catalogs[prefix].items():
-            stack_specs[spec_hash][stack] = built_spec
-            task_list.append((built_spec.hash, stack))
+            try:
+                if force or not os.path.isfile(manifest_path):
+                    response = s3_client.get_object(
+                        Bucket=bucket, Key=built_spec.manifest_prefix
+                    )
+                    manifest_text = response["Body"].read().decode("utf-8")
+                    # Keep the signed manifest on disk, to be verified later
+                    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+                    with open(manifest_path, "w") as f:
+                        f.write(manifest_text)
+                else:
+                    with open(manifest_path) as f:
+                        manifest_text = f.read()
 
-    def _process_manifest_fn(spec_hash, stack):
-        download_dir = os.path.join(specfiles_dir, stack)
-        find_cmd = ["find", download_dir, "-type", "f", "-name", f"*{spec_hash}*"]
-        find_result = subprocess.run(find_cmd, capture_output=True)
+                manifest_dict = extract_json_from_clearsig_text(manifest_text)
+                meta_record = find_data_with_media_type(
+                    manifest_dict["data"], SPEC_METADATA_MEDIA_TYPE
+                )
+                archive_record = find_data_with_media_type(
+                    manifest_dict["data"], TARBALL_MEDIA_TYPE
+                )
+                meta = format_blob_url(f"{ref}/{stack}", meta_record)
+                archive = format_blob_url(f"{ref}/{stack}", archive_record)
+            except Exception as exc:
+                print(f"Failed to read manifest for {spec_hash} in {stack}: {exc}")
+                continue
+
+            built_spec.manifest_path = manifest_path
+            built_spec.meta = meta
+            built_spec.archive = archive
+            for key, record in [(meta, meta_record), (archive, archive_record)]:
+                if "contentLength" in record:
+                    built_spec.sizes[key] = record["contentLength"]
+            return True
 
-        if find_result.returncode != 0:
-            print(f"[{find_cmd}] failed to find manifest for {spec_hash} in {stack}")
-            return (None, None, None, None)
+        return False
 
-        manifest_path = find_result.stdout.decode("utf-8").strip()
-        manifest_dict = extract_json_from_clearsig(manifest_path)
-        return (spec_hash, stack, manifest_dict, manifest_path)
+    print(f"Fetching manifests for {len(task_list)} specs missing from the top level")
+    start_time = datetime.now()
+    fetched = 0
 
     with ThreadPoolExecutor(max_workers=parallel) as executor:
-        futures = [executor.submit(_process_manifest_fn, *task) for task in task_list]
+        futures = [executor.submit(_fetch_manifest_fn, *task) for task in task_list]
         for future in as_completed(futures):
             try:
-                spec_hash, stack, manifest_dict, manifest_path = future.result()
-                if not spec_hash or not stack or not manifest_dict or not manifest_path:
-                    continue
-
-                stack_specs[spec_hash][stack].stack = stack
-                stack_specs[spec_hash][stack].manifest_path = manifest_path
-                stack_specs[spec_hash][stack].meta = format_blob_url(
-                    f"{ref}/{stack}",
-                    find_data_with_media_type(
-                        manifest_dict["data"], SPEC_METADATA_MEDIA_TYPE
-                    ),
-                )
-                stack_specs[spec_hash][stack].archive = format_blob_url(
-                    f"{ref}/{stack}",
-                    find_data_with_media_type(
-                        manifest_dict["data"], TARBALL_MEDIA_TYPE
-                    ),
-                )
+                if future.result():
+                    fetched += 1
             except Exception as exc:
                 print(f"Exception processing manifests: {exc}")
 
+    elapsed = datetime.now() - start_time
+    print(f"Fetched {fetched} of {len(task_list)} manifests, elapsed time: {elapsed}")
+
     return stack_specs, top_level_specs
 
 
@@ -679,44 +1168,116 @@ def main():
         default=[],
         help="Optional list of stacks to exclude",
     )
+    parser.add_argument(
+        "-m",
+        "--max-copies",
+        default=64,
+        type=int,
+        help=(
+            "Maximum number of concurrent object copies, the number in flight "
+            "adapts between the parallelism level and this"
+        ),
+    )
+    parser.add_argument(
+        "--plan-only",
+        default=False,
+        action="store_true",
+        help=(
+            "Only write a plan of what would be published (to plan.json in the "
+            "workdir of each ref) for review, requires '--workdir'"
+        ),
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrent-refs",
+        default=4,
+        type=int,
+        help=(
+            "Number of refs to publish at once (only used if `--ref recent` is "
+            "provided), which share the parallelism level and copy budget"
+        ),
+    )
+    parser.add_argument(
+        "-i",
+        "--inventory",
+        default=None,
+        help=(
+            "Path of a persistent bucket inventory, so that only stacks which "
+            "changed since the previous run are listed again"
+        ),
+    )
 
     args = parser.parse_args()
 
+    if args.plan_only and not args.workdir:
+        parser.error("--plan-only requires --workdir, so the plan is kept")
+
     if args.ref == "recent":
         refs = get_recently_run_protected_refs(args.days)
     else:
         refs = [args.ref]
 
-    exceptions = []
-
-    for ref in refs:
-        # If the cli didn't provide a working directory, we will create (and clean up)
-        # a temporary directory using this workdir context
-        with get_workdir_context(args.workdir) as workdir:
-            print(f"Publishing missing specs for {args.bucket} / {ref}")
-            try:
-                publish(
-                    args.bucket,
-                    ref,
-                    args.exclude,
-                    args.force,
-                    args.parallel,
-                    workdir,
-                    args.version,
-                )
-            except Exception as e:
-                # Swallow exceptions here so we can proceed with remaining refs,
-                # but save the exceptions to raise at the end.
-                print(f"Error publishing specs for {args.bucket} / {ref} due to {e}")
-                exceptions.append(e)
+    # Refs are published concurrently, dividing the listing and fetching
+    # parallelism between them, while all copies share a single budget.
+    concurrent_refs = max(1, min(args.concurrent_refs, len(refs)))
+    ref_parallel = max(1, args.parallel // concurrent_refs)
+
+    results = []
+    failures = {}
+
+    # If the cli didn't provide a working directory, we will create (and clean up)
+    # a temporary directory using this workdir context
+    with get_workdir_context(args.workdir) as workdir:
+        with PublishContext(
+            workdir,
+            force=args.force,
+            parallel=args.parallel,
+            max_copies=args.max_copies,
+            inventory_path=args.inventory,
+        ) as context:
+            with ThreadPoolExecutor(max_workers=concurrent_refs) as executor:
+                futures = {}
+                for ref in refs:
+                    print(f"Publishing missing specs for {args.bucket} / {ref}")
+                    ref_workdir = os.path.join(workdir, "refs", ref.replace("/", "_"))
+                    os.makedirs(ref_workdir, exist_ok=True)
+                    future = executor.submit(
+                        publish,
+                        args.bucket,
+                        ref,
+                        args.exclude,
+                        args.force,
+                        ref_parallel,
+                        ref_workdir,
+                        args.version,
+                        plan_only=args.plan_only,
+                        context=context,
+                    )
+                    futures[future] = ref
+
+                for future in as_completed(futures):
+                    ref = futures[future]
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        # Swallow exceptions here so we can proceed with remaining
+                        # refs, but save the exceptions to raise at the end.
+                        print(
+                            f"Error publishing specs for {args.bucket} / {ref} due to {e}"
+                        )
+                        failures[ref] = e
+
+            context.report()
+
+    print_publish_summary(results, failures)
 
     end_time = datetime.now()
     elapsed = end_time - start_time
     print(f"Publish script finished at {end_time}, elapsed time: {elapsed}")
 
-    if exceptions:
+    if failures:
         # Re-raise the first exception encountered, so we can see it in Sentry.
-        raise exceptions[0]
+        raise next(iter(failures.values()))
 
 
 ################################################################################
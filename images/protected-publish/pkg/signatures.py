@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import subprocess
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional
+
+import pgpy
+from pgpy.errors import PGPError
+
+
+class VerificationResult(NamedTuple):
+    #: True only if the data was signed, and every signature is good
+    verified: bool
+    #: The signed content if verified, otherwise the cause of failure
+    message: str
+
+
+################################################################################
+# Export (ascii-armored) the public keys in the keyring that gpg would use to
+# verify signatures, i.e. the keyring in gpg_home, or else $GNUPGHOME.
+def export_public_keys(gpg_home: Optional[str] = None) -> str:
+    env = os.environ.copy()
+    if gpg_home:
+        env["GNUPGHOME"] = gpg_home
+
+    result = subprocess.run(
+        ["gpg", "--no-tty", "--export", "--armor"],
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    return result.stdout.decode("utf-8")
+
+
+################################################################################
+# Verify clearsigned files in-process, rather than running gpg for each one
+class SignatureVerifier:
+    """Verifies clearsigned data against a fixed set of public keys
+
+    The keys are loaded once, and verification is safe to run from many threads
+    at once.  For large batches known up front, ``verify_all`` spreads the work
+    over worker processes, each of which loads the keys once.
+
+    As with ``gpg --verify``, data is only considered verified if it contains
+    at least one signature, and every signature was made by a known key and is
+    good.  Trust levels and revocation are not considered, as gpg only warns
+    about them.
+    """
+
+    def __init__(self, public_keys: str):
+        self.public_keys = public_keys
+
+        keyring = pgpy.PGPKeyring()
+        keyring.load(public_keys)
+
+        # Signatures made by a subkey are verified by way of its primary key
+        self._keys: Dict[str, pgpy.PGPKey] = {}
+        for fingerprint in keyring.fingerprints(keyhalf="public", keytype="primary"):
+            with keyring.key(fingerprint) as key:
+                self._keys[key.fingerprint.keyid] = key
+                for subkey_id in key.subkeys:
+                    self._keys[subkey_id] = key
+
+        if not self._keys:
+            raise ValueError("No public keys available to verify signatures")
+
+        self._lock = threading.Lock()
+        self._first: Optional[datetime] = None
+        self._last: Optional[datetime] = None
+        self.verified_count = 0
+        self.failed_count = 0
+
+    def _verify(self, data: str) -> VerificationResult:
+        try:
+            message = pgpy.PGPMessage.from_blob(data)
+        except Exception as error:
+            return VerificationResult(False, f"No valid OpenPGP data found: {error}")
+
+        if not message.is_signed:
+            return VerificationResult(False, "No signature found")
+
+        unknown = message.signers - set(self._keys)
+        if unknown:
+            key_ids = ", ".join(sorted(unknown))
+            return VerificationResult(False, f"No public key for signer(s) {key_ids}")
+
+        signing_keys = {self._keys[k].fingerprint: self._keys[k] for k in message.signers}
+        for key in signing_keys.values():
+            try:
+                with warnings.catch_warnings():
+                    # PGPy warns on every call about the key checks it doesn't
+                    # implement (self-signatures, revocation, flags)
+                    warnings.simplefilter("ignore", UserWarning)
+                    good = bool(key.verify(message))
+            except PGPError as error:
+                return VerificationResult(False, f"Unable to verify signature: {error}")
+
+            if not good:
+                return VerificationResult(False, f"Bad signature from {key.fingerprint}")
+
+        return VerificationResult(True, message.message)
+
+    def _record(self, results, start: datetime):
+        end = datetime.now()
+        with self._lock:
+            if self._first is None or start < self._first:
+                self._first = start
+            self._last = end
+            for result in results:
+                if result.verified:
+                    self.verified_count += 1
+                else:
+                    self.failed_count += 1
+
+    def verify(self, data: str) -> VerificationResult:
+        """Verify clearsigned data, returning the signed content if successful"""
+        start = datetime.now()
+        result = self._verify(data)
+        self._record([result], start)
+        return result
+
+    def verify_file(self, file_path: str) -> VerificationResult:
+        with open(file_path) as f:
+            return self.verify(f.read())
+
+    def verify_all(
+        self, items: Dict[str, str], processes: Optional[int] = None
+    ) -> Dict[str, VerificationResult]:
+        """Verify many items of clearsigned data (keyed by any id) across processes"""
+        if not items:
+            return {}
+
+        # Forking a process with running threads (e.g. other refs being
+        # published) can deadlock the child, so start the workers from scratch
+        start = datetime.now()
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.public_keys,),
+        ) as executor:
+            results = dict(executor.map(_verify_in_worker, items.items(), chunksize=32))
+
+        self._record(results.values(), start)
+        return results
+
+    def report(self):
+        total = self.verified_count + self.failed_count
+        if not total:
+            return
+
+        elapsed = self._last - self._first
+        rate = total / max(elapsed.total_seconds(), 1e-6)
+        print(
+            f"Verified {self.verified_count} signatures ({self.failed_count} failed), "
+            f"elapsed time: {elapsed}, {rate:.1f} per second"
+        )
+
+
+################################################################################
+# Each worker process of SignatureVerifier.verify_all has its own verifier
+_worker_verifier: Optional[SignatureVerifier] = None
+
+
+def _init_worker(public_keys: str):
+    global _worker_verifier
+    _worker_verifier = SignatureVerifier(public_keys)
+
+
+def _verify_in_worker(item):
+    item_id, data = item
+    return item_id, _worker_verifier._verify(data)
@@ -9,6 +9,9 @@ import botocore.exceptions
 import boto3.session
 import sentry_sdk
 
+from .inventory import catalog_scopes, Inventory
+from .listing import spec_catalogs_from_objects
+
 sentry_sdk.init(traces_sample_rate=1.0)
 
 
@@ -41,9 +44,47 @@ def validate_mirror_index(index_data):
             print(f"    {item}")
 
 
+################################################################################
+# Specs the index claims are in the buildcache, but which the inventory shows
+# are not (or are only partially) present in the mirror.
+def validate_against_inventory(
+    index_data, bucket, mirror_prefix, layout_version, inventory_path, s3_client
+):
+    scopes = catalog_scopes([mirror_prefix], layout_version)
+
+    with Inventory(inventory_path) as inventory:
+        inventory.refresh(s3_client, bucket, scopes)
+        objects = list(inventory.objects(bucket, scopes[0][0]))
+
+    catalog = spec_catalogs_from_objects(objects, layout_version)[mirror_prefix]
+
+    def is_present(built_spec):
+        if layout_version == 2:
+            return built_spec.meta and built_spec.archive
+        return built_spec.manifest_prefix
+
+    absent = []
+    for hash, install_obj in index_data["database"]["installs"].items():
+        spec_obj = install_obj["spec"]
+        if "external" in spec_obj or not install_obj["in_buildcache"]:
+            continue
+        if hash not in catalog or not is_present(catalog[hash]):
+            absent.append(f"{spec_obj['name']}/{hash[:7]}")
+
+    print(
+        f"There are {len(absent)} specs in the index which are not present in "
+        f"s3://{bucket}/{mirror_prefix}"
+    )
+
+    if absent:
+        print("Absent specs:")
+        for item in absent:
+            print(f"    {item}")
+
+
 ################################################################################
 #
-def validate_s3_index(url, layout_version=2):
+def validate_s3_index(url, layout_version=2, inventory_path=None):
     url_regex = re.compile(r"^s3://([^/]+)/(.+)$")
     m = url_regex.search(url)
     if not m:
@@ -80,6 +121,16 @@ def validate_s3_index(url, layout_version=2):
 
     validate_mirror_index(index_data)
 
+    if inventory_path:
+        validate_against_inventory(
+            index_data,
+            bucket,
+            m.group(2).rstrip("/"),
+            layout_version,
+            inventory_path,
+            s3_client,
+        )
+
 
 ################################################################################
 #
@@ -120,6 +171,16 @@ def main():
         help="Layout version (2 or 3, defaults to 2), only used with '-u'",
     )
 
+    parser.add_argument(
+        "-i",
+        "--inventory",
+        default=None,
+        help=(
+            "Path of a persistent bucket inventory, used to also check that specs "
+            "in the index are present in the mirror, only used with '-u'"
+        ),
+    )
+
     args = parser.parse_args()
 
     if not args.url and not args.file:
@@ -130,7 +191,9 @@ def main():
         validate_file_index(args.file)
     else:
         print(f"Validating {args.url} at version {args.version}")
-        validate_s3_index(args.url, layout_version=args.version)
+        validate_s3_index(
+            args.url, layout_version=args.version, inventory_path=args.inventory
+        )
 
     end_time = datetime.now()
     elapsed = end_time - start_time
@@ -0,0 +1,176 @@
+"""Check how the copy engine adapts to throttling and throughput, and retries
+
+The engine's client is replaced by a stub which fails with the given errors
+before succeeding, and time is faked, so that neither backoff nor the
+adjustment interval has to be waited out.
+"""
+
+import botocore.exceptions
+import pytest
+
+from pkg import copier
+from pkg.common import MULTIPART_THRESHOLD, TRANSFER_CONFIG
+from pkg.copier import CopyEngine
+
+BUCKET = "spack-binaries"
+
+
+def client_error(code: str, status: int) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        "CopyObject",
+    )
+
+
+class StubClient:
+    """Records the requests made, raising the given errors from the first ones"""
+
+    def __init__(self):
+        self.errors = []
+        self.requests = []
+
+    def _request(self, name, *args, **kwargs):
+        self.requests.append((name, args, kwargs))
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def copy_object(self, **kwargs):
+        self._request("copy_object", **kwargs)
+
+    def copy(self, *args, **kwargs):
+        self._request("copy", *args, **kwargs)
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(copier, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def engine(clock):
+    engine = CopyEngine(concurrency=8, max_concurrency=16, min_concurrency=2)
+    engine.client = StubClient()
+    return engine
+
+
+def copy(engine: CopyEngine, size: int = 1024):
+    engine.copy(BUCKET, "develop/e4s/blobs/a", "develop/blobs/a", size=size)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        pytest.param(client_error("SlowDown", 503), id="slowdown"),
+        pytest.param(client_error("Unknown", 503), id="503"),
+    ],
+)
+def test_throttle_halves_limit(engine, clock, error):
+    engine.client.errors = [error, error]
+    copy(engine)
+
+    # Throttling within the same interval only halves the limit once
+    assert engine.limiter.limit == 4
+    assert engine.throttled_requests == 2
+    assert engine.copied_objects == 1
+    assert len(engine.client.requests) == 3
+
+    # Nor does the limit grow at the end of that interval, only after the next
+    clock.now += copier.ADJUST_INTERVAL
+    copy(engine)
+    assert engine.limiter.limit == 4
+
+    # Keeping up with the throughput of the throttled interval (both copies)
+    clock.now += copier.ADJUST_INTERVAL
+    copy(engine, 2048)
+    assert engine.limiter.limit == 5
+
+
+def test_throttle_limit_bounded(engine, clock):
+    for _ in range(3):
+        clock.now += copier.ADJUST_INTERVAL
+        engine.client.errors = [client_error("SlowDown", 503)]
+        copy(engine)
+    assert engine.limiter.limit == 2
+
+
+def test_limit_follows_throughput(engine, clock):
+    limits = []
+    for size in [1000, 1000, 500, 450, 2000, 2000, 2000]:
+        clock.now += copier.ADJUST_INTERVAL
+        copy(engine, size)
+        limits.append(engine.limiter.limit)
+
+    # Grows by a quarter while throughput keeps up, shrinks by one once it
+    # falls off, holds if it falls off slightly, and grows up to the maximum
+    assert limits == [10, 12, 11, 11, 13, 16, 16]
+
+
+def test_transient_errors_retried(engine):
+    engine.client.errors = [
+        client_error("InternalError", 500),
+        botocore.exceptions.ConnectionClosedError(endpoint_url="https://s3"),
+        botocore.exceptions.ReadTimeoutError(endpoint_url="https://s3"),
+    ]
+    copy(engine)
+
+    assert len(engine.client.requests) == 4
+    assert engine.copied_objects == 1
+    assert engine.limiter.limit == 8
+
+
+def test_retries_capped(engine):
+    engine.client.errors = [client_error("InternalError", 500)] * copier.MAX_ATTEMPTS
+    with pytest.raises(botocore.exceptions.ClientError):
+        copy(engine)
+
+    assert len(engine.client.requests) == copier.MAX_ATTEMPTS
+    assert (engine.copied_objects, engine.failed_objects) == (0, 1)
+
+
+def test_fatal_error_not_retried(engine):
+    engine.client.errors = [client_error("AccessDenied", 403)]
+    with pytest.raises(botocore.exceptions.ClientError):
+        copy(engine)
+
+    assert len(engine.client.requests) == 1
+    assert engine.failed_objects == 1
+
+
+@pytest.mark.parametrize(
+    "size,request_name",
+    [
+        (1024, "copy_object"),
+        (MULTIPART_THRESHOLD - 1, "copy_object"),
+        (MULTIPART_THRESHOLD, "copy"),
+        (None, "copy"),
+    ],
+)
+def test_small_objects_copied_with_copy_object(engine, size, request_name):
+    copy(engine, size)
+
+    [(name, args, kwargs)] = engine.client.requests
+    assert name == request_name
+    copy_source = {"Bucket": BUCKET, "Key": "develop/e4s/blobs/a"}
+    if name == "copy_object":
+        assert kwargs == {
+            "CopySource": copy_source,
+            "Bucket": BUCKET,
+            "Key": "develop/blobs/a",
+        }
+    else:
+        assert args == (copy_source, BUCKET, "develop/blobs/a")
+        assert kwargs == {"Config": TRANSFER_CONFIG}
+    assert engine.copied_bytes == (size or 0)
@@ -0,0 +1,282 @@
+"""Check the incremental index update against a stubbed S3 client
+
+data/index.json is a buildcache index in the format spack writes (records
+holding only the spec, its ref_count and in_buildcache), of zlib and its
+dependencies, where ref_counts count dependents of every type.
+data/libpng.spec.json is the metadata of a spec depending on all of them, and
+on pkgconf, which is not in the index.
+"""
+
+import copy
+import gzip
+import hashlib
+import io
+import json
+import os
+
+import botocore.exceptions
+import pytest
+
+from pkg import copier
+from pkg.index import (
+    IndexInconsistencyError,
+    merge_specs,
+    read_index,
+    update_index,
+    write_index,
+)
+from pkg.inventory import INDEX_MARKER
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+BUCKET = "spack-binaries"
+PREFIX = "develop"
+
+
+def client_error(code: str, status: int) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        "GetObject",
+    )
+
+
+class StubS3Client:
+    """Objects of a single bucket, with errors to raise from the next requests"""
+
+    def __init__(self):
+        self.objects = {}
+        self.errors = []
+        self.puts = []
+
+    def _next_error(self):
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def _etag(self, key):
+        return f'"{hashlib.md5(self.objects[key]).hexdigest()}"'
+
+    def get_object(self, Bucket, Key):
+        self._next_error()
+        if Key not in self.objects:
+            raise client_error("NoSuchKey", 404)
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": self._etag(Key)}
+
+    def head_object(self, Bucket, Key):
+        self._next_error()
+        if Key not in self.objects:
+            raise client_error("404", 404)
+        return {"ETag": self._etag(Key)}
+
+    def put_object(self, Bucket, Key, Body):
+        self._next_error()
+        self.objects[Key] = Body
+        self.puts.append(Key)
+
+
+def read_fixture(name: str) -> dict:
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return json.load(f)
+
+
+def ref_counts(index: dict) -> dict:
+    """The ref_count of each record, by package name"""
+    return {
+        record["spec"]["name"]: record["ref_count"]
+        for record in index["database"]["installs"].values()
+    }
+
+
+def write_v2_index(client: StubS3Client, index: dict):
+    index_data = json.dumps(index).encode("utf-8")
+    client.objects[f"{PREFIX}/build_cache/index.json"] = index_data
+    client.objects[f"{PREFIX}/{INDEX_MARKER[2]}"] = (
+        hashlib.sha256(index_data).hexdigest().encode("utf-8")
+    )
+
+
+def write_v3_index(client: StubS3Client, index: dict, compression: str = "gzip"):
+    index_data = json.dumps(index).encode("utf-8")
+    blob_data = gzip.compress(index_data) if compression == "gzip" else index_data
+    checksum = hashlib.sha256(blob_data).hexdigest()
+    client.objects[f"{PREFIX}/blobs/sha256/{checksum[:2]}/{checksum}"] = blob_data
+    manifest = {
+        "version": 3,
+        "data": [
+            {
+                "contentLength": len(blob_data),
+                "mediaType": "application/vnd.spack.db.v8+json",
+                "compression": compression,
+                "checksumAlgorithm": "sha256",
+                "checksum": checksum,
+            }
+        ],
+    }
+    client.objects[f"{PREFIX}/{INDEX_MARKER[3]}"] = json.dumps(manifest).encode()
+
+
+@pytest.fixture
+def index():
+    return read_fixture("index.json")
+
+
+@pytest.fixture
+def libpng():
+    return read_fixture("libpng.spec.json")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(copier.time, "sleep", lambda seconds: None)
+    return StubS3Client()
+
+
+def test_merge_specs(index, libpng):
+    assert merge_specs(index, [libpng]) == 1
+
+    installs = index["database"]["installs"]
+    assert len(installs) == 5
+
+    # Every node gets a record, but only the root is in the buildcache
+    in_buildcache = {r["spec"]["name"]: r["in_buildcache"] for r in installs.values()}
+    assert in_buildcache == {
+        "gcc-runtime": True,
+        "gmake": True,
+        "zlib": True,
+        "pkgconf": False,
+        "libpng": True,
+    }
+    pkgconf = libpng["spec"]["nodes"][3]
+    assert installs[pkgconf["hash"]]["spec"] == pkgconf
+
+    # Merging the same spec again adds nothing
+    assert merge_specs(index, [libpng]) == 0
+    assert len(installs) == 5
+
+
+def test_merge_specs_keeps_ref_count_rule(index, libpng):
+    # An index built by an older spack, which only counted link/run dependents
+    installs = index["database"]["installs"]
+    for record in installs.values():
+        if record["spec"]["name"] == "gmake":
+            record["ref_count"] = 0
+
+    merge_specs(index, [libpng])
+    assert ref_counts(index) == {
+        "gcc-runtime": 4,
+        "gmake": 0,
+        "zlib": 1,
+        "pkgconf": 0,
+        "libpng": 0,
+    }
+
+
+def test_merge_specs_inconsistent_ref_counts(index, libpng):
+    for record in index["database"]["installs"].values():
+        if record["spec"]["name"] == "gcc-runtime":
+            record["ref_count"] = 1
+
+    with pytest.raises(IndexInconsistencyError, match="Reference counts"):
+        merge_specs(index, [libpng])
+
+
+def test_merge_specs_missing_dependency_record(index, libpng):
+    # zlib depends on gmake
+    gmake = libpng["spec"]["nodes"][2]
+    del index["database"]["installs"][gmake["hash"]]
+
+    with pytest.raises(IndexInconsistencyError, match="which is not in the index"):
+        merge_specs(index, [libpng])
+
+
+def test_merge_specs_name_mismatch(index, libpng):
+    zlib = libpng["spec"]["nodes"][4]
+    zlib["name"] = "zlib-ng"
+
+    with pytest.raises(IndexInconsistencyError, match="is zlib in the index"):
+        merge_specs(index, [libpng])
+
+
+def test_read_index_v2(client, index):
+    write_v2_index(client, index)
+    read, record, marker_etag = read_index(client, BUCKET, PREFIX, 2)
+    assert read == index
+    assert record is None
+    assert marker_etag == client._etag(f"{PREFIX}/{INDEX_MARKER[2]}")
+
+    # The index no longer matches its hash
+    client.objects[f"{PREFIX}/build_cache/index.json"] += b" "
+    with pytest.raises(IndexInconsistencyError, match="does not match"):
+        read_index(client, BUCKET, PREFIX, 2)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none"])
+def test_write_index_v3_round_trip(client, index, libpng, compression):
+    write_v3_index(client, index, compression)
+    read, record, marker_etag = read_index(client, BUCKET, PREFIX, 3)
+    assert read == index
+
+    merge_specs(read, [libpng])
+    write_index(client, BUCKET, PREFIX, 3, read, record, marker_etag)
+
+    # The blob is written before the manifest referring to it
+    marker_key = f"{PREFIX}/{INDEX_MARKER[3]}"
+    assert client.puts[-1] == marker_key
+    manifest = json.loads(client.objects[marker_key])
+    new_record = manifest["data"][0]
+    checksum = new_record["checksum"]
+    assert client.puts[0] == f"{PREFIX}/blobs/sha256/{checksum[:2]}/{checksum}"
+    assert new_record["compression"] == compression
+    assert new_record["mediaType"] == record["mediaType"]
+    assert new_record["contentLength"] == len(client.objects[client.puts[0]])
+
+    assert read_index(client, BUCKET, PREFIX, 3)[0] == read
+
+
+@pytest.mark.parametrize("layout_version", [2, 3])
+def test_write_index_marker_moved(client, index, layout_version):
+    write = write_v2_index if layout_version == 2 else write_v3_index
+    write(client, index)
+    read, record, marker_etag = read_index(client, BUCKET, PREFIX, layout_version)
+
+    # Another writer updated the index in the meantime
+    updated = copy.deepcopy(index)
+    updated["database"]["installs"].popitem()
+    write(client, updated)
+
+    with pytest.raises(IndexInconsistencyError, match="Index changed"):
+        write_index(client, BUCKET, PREFIX, layout_version, read, record, marker_etag)
+    assert client.puts == []
+
+
+def test_update_index_matches_spack(client, index, libpng):
+    write_v3_index(client, index)
+    update_index(BUCKET, PREFIX, 3, [libpng], client=client)
+
+    # The ref_counts spack gives the records, when libpng is added to the mirror
+    updated, _, _ = read_index(client, BUCKET, PREFIX, 3)
+    assert ref_counts(updated) == {
+        "gcc-runtime": 4,
+        "gmake": 3,
+        "zlib": 1,
+        "pkgconf": 1,
+        "libpng": 0,
+    }
+
+
+def test_update_index_retries_s3_errors(client, index, libpng):
+    write_v3_index(client, index)
+    client.errors = [client_error("SlowDown", 503), client_error("InternalError", 500)]
+
+    update_index(BUCKET, PREFIX, 3, [libpng], client=client)
+    assert not client.errors
+    assert len(read_index(client, BUCKET, PREFIX, 3)[0]["database"]["installs"]) == 5
+
+
+def test_update_index_raises_s3_errors(client, index, libpng):
+    write_v3_index(client, index)
+    client.errors = [client_error("AccessDenied", 403)]
+
+    # Not an inconsistency, so the index isn't rebuilt
+    with pytest.raises(botocore.exceptions.ClientError):
+        update_index(BUCKET, PREFIX, 3, [libpng], client=client)
+    assert client.puts == []
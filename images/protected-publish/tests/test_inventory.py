@@ -0,0 +1,176 @@
+"""Check that the inventory only lists a scope again when its marker moved
+
+The inventory is kept in a SQLite database in a temporary directory, and
+refreshed from a stubbed S3 client, whose paginator returns pages of a few
+objects, and can be made to fail part way through a listing.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import botocore.exceptions
+import pytest
+
+from pkg.common import spec_catalogs_from_listing_v2
+from pkg.inventory import catalog_scopes, Inventory
+
+BUCKET = "spack-binaries"
+MIRROR = "develop/e4s"
+LAST_MODIFIED = datetime(2025, 1, 15, 12, 30, 45, tzinfo=timezone.utc)
+
+SCOPE = catalog_scopes([MIRROR], 2)[0]
+PREFIX, MARKER_KEY = SCOPE
+
+
+def v2_keys(spec_hash: str):
+    """The metadata and archive keys of a spec"""
+    name = f"linux-ubuntu22.04-x86_64_v3-gcc-13.2.0-zlib-1.3-{spec_hash}"
+    return [
+        f"{PREFIX}{name}.spec.json.sig",
+        f"{PREFIX}linux-ubuntu22.04-x86_64_v3/gcc-13.2.0/zlib-1.3/{name}.spack",
+    ]
+
+
+class InterruptedListing(Exception):
+    pass
+
+
+class StubS3Client:
+    """A bucket listed a few objects per page, with a marker object"""
+
+    def __init__(self, keys, page_size: int = 2):
+        self.objects = {key: (len(key), LAST_MODIFIED) for key in keys}
+        self.marker = ('"1"', LAST_MODIFIED)
+        self.page_size = page_size
+        self.fail_after_pages = None
+        self.listings = []
+
+    def move_marker(self):
+        etag, last_modified = self.marker
+        self.marker = (f'"{int(etag[1:-1]) + 1}"', last_modified + timedelta(hours=1))
+
+    def head_object(self, Bucket, Key):
+        if Key != MARKER_KEY or self.marker is None:
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "404"}}, "HeadObject"
+            )
+        return {"ETag": self.marker[0], "LastModified": self.marker[1]}
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix, StartAfter=None):
+        self.listings.append(StartAfter)
+        keys = sorted(
+            k for k in self.objects if k.startswith(Prefix) and k > (StartAfter or "")
+        )
+        for page, start in enumerate(range(0, len(keys), self.page_size)):
+            if page == self.fail_after_pages:
+                raise InterruptedListing()
+
+            yield {
+                "Contents": [
+                    {
+                        "Key": key,
+                        "Size": self.objects[key][0],
+                        "ETag": '"etag"',
+                        "LastModified": self.objects[key][1],
+                    }
+                    for key in keys[start : start + self.page_size]
+                ]
+            }
+
+
+@pytest.fixture
+def inventory(tmp_path):
+    with Inventory(str(tmp_path / "inventory.sqlite")) as inventory:
+        yield inventory
+
+
+def inventory_keys(inventory: Inventory):
+    return [key for key, _, _ in inventory.objects(BUCKET, PREFIX)]
+
+
+def test_refresh_scope_unchanged_marker(inventory):
+    client = StubS3Client(v2_keys("aaaa") + v2_keys("bbbb"))
+    assert inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert inventory_keys(inventory) == sorted(client.objects)
+
+    # Nothing is listed while the marker stays put, even if objects were added
+    client.objects.update({key: (1, LAST_MODIFIED) for key in v2_keys("cccc")})
+    assert not inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert client.listings == [None]
+    assert len(inventory_keys(inventory)) == 4
+
+    # Unless the listing is forced
+    assert inventory.refresh_scope(client, BUCKET, SCOPE, force=True)
+    assert len(inventory_keys(inventory)) == 6
+
+
+def test_refresh_scope_moved_marker(inventory):
+    client = StubS3Client(v2_keys("aaaa") + v2_keys("bbbb"))
+    inventory.refresh_scope(client, BUCKET, SCOPE)
+
+    # The index was rebuilt after a spec was deleted and another added
+    for key in v2_keys("aaaa"):
+        del client.objects[key]
+    client.objects.update({key: (1, LAST_MODIFIED) for key in v2_keys("cccc")})
+    client.move_marker()
+
+    assert inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert client.listings == [None, None]
+    assert inventory_keys(inventory) == sorted(client.objects)
+    assert inventory.get(BUCKET, v2_keys("aaaa")[0]) is None
+    assert inventory.get(BUCKET, v2_keys("cccc")[0]) == (
+        v2_keys("cccc")[0],
+        1,
+        LAST_MODIFIED,
+    )
+
+
+def test_refresh_scope_missing_marker(inventory):
+    client = StubS3Client(v2_keys("aaaa"))
+    client.marker = None
+
+    # Without a marker, there's no telling whether anything changed
+    assert inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert client.listings == [None, None]
+
+
+def test_refresh_scope_resumes_interrupted_listing(inventory):
+    client = StubS3Client(v2_keys("aaaa") + v2_keys("bbbb") + v2_keys("cccc"))
+    inventory.refresh_scope(client, BUCKET, SCOPE)
+
+    # The next listing (after the marker moved) fails after its second page
+    del client.objects[v2_keys("cccc")[0]]
+    client.move_marker()
+    client.fail_after_pages = 2
+    with pytest.raises(InterruptedListing):
+        inventory.refresh_scope(client, BUCKET, SCOPE)
+
+    # Resuming lists only the rest, and still removes the deleted object
+    keys = sorted(client.objects)
+    client.fail_after_pages = None
+    assert inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert client.listings == [None, None, keys[3]]
+    assert inventory_keys(inventory) == keys
+
+    # Once finished, nothing is listed again
+    assert not inventory.refresh_scope(client, BUCKET, SCOPE)
+    assert len(client.listings) == 3
+
+
+def test_write_listing(inventory, tmp_path):
+    client = StubS3Client(v2_keys("aaaa") + v2_keys("bbbb"))
+    inventory.refresh_scope(client, BUCKET, SCOPE)
+
+    listing_path = str(tmp_path / "listing.txt")
+    inventory.write_listing(BUCKET, [PREFIX], listing_path)
+
+    catalogs = spec_catalogs_from_listing_v2(listing_path)
+    assert list(catalogs) == [MIRROR]
+    assert {
+        spec_hash: (spec.meta, spec.archive)
+        for spec_hash, spec in catalogs[MIRROR].items()
+    } == {spec_hash: tuple(v2_keys(spec_hash)) for spec_hash in ["aaaa", "bbbb"]}
@@ -0,0 +1,160 @@
+"""Check that native listings give the same catalogs as "aws s3 ls" output
+
+The same keys, from the top-level mirror and two stack mirrors, are formatted
+as the output of "aws s3 ls --recursive" and matched by
+spec_catalogs_from_listing_v2/_v3, and listed from a stubbed S3 client and
+cataloged by spec_catalogs_from_objects.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from pkg.common import spec_catalogs_from_listing_v2, spec_catalogs_from_listing_v3
+from pkg.listing import list_catalog_objects, spec_catalogs_from_objects
+
+BUCKET = "spack-binaries"
+REF = "develop"
+LAST_MODIFIED = datetime(2025, 1, 15, 12, 30, 45, tzinfo=timezone.utc)
+MIRRORS = [REF, f"{REF}/e4s", f"{REF}/ml"]
+
+
+def v2_keys(mirror: str, spec_hash: str):
+    name = f"linux-ubuntu22.04-x86_64_v3-gcc-13.2.0-zlib-1.3-{spec_hash}"
+    return [
+        f"{mirror}/build_cache/{name}.spec.json.sig",
+        f"{mirror}/build_cache/linux-ubuntu22.04-x86_64_v3/gcc-13.2.0/zlib-1.3/"
+        f"{name}.spack",
+    ]
+
+
+def v3_keys(mirror: str, spec_hash: str):
+    return [
+        f"{mirror}/v3/manifests/spec/zlib/zlib-1.3-{spec_hash}.spec.manifest.json",
+    ]
+
+
+#: Keys of each layout, along with objects which aren't part of any catalog
+KEYS = {
+    2: [
+        *v2_keys(REF, "aaaa"),
+        *v2_keys(f"{REF}/e4s", "aaaa"),
+        *v2_keys(f"{REF}/e4s", "bbbb"),
+        *v2_keys(f"{REF}/ml", "cccc"),
+        # A spec whose archive is missing
+        v2_keys(f"{REF}/ml", "dddd")[0],
+        f"{REF}/build_cache/index.json",
+        f"{REF}/build_cache/index.json.hash",
+        f"{REF}/e4s/build_cache/_pgp/0123456789ABCDEF.pub",
+    ],
+    3: [
+        *v3_keys(REF, "aaaa"),
+        *v3_keys(f"{REF}/e4s", "aaaa"),
+        *v3_keys(f"{REF}/e4s", "bbbb"),
+        *v3_keys(f"{REF}/ml", "cccc"),
+        f"{REF}/v3/manifests/index/index.manifest.json",
+        f"{REF}/e4s/v3/manifests/key/0123456789ABCDEF.key.manifest.json",
+    ],
+}
+
+
+class StubS3Client:
+    """Lists the keys of a bucket, page_size at a time"""
+
+    def __init__(self, keys, page_size: int = 2):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+        self.pages_listed = 0
+        self.failing_prefix = None
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        keys = [k for k in self.keys if k.startswith(Prefix)]
+        if Delimiter:
+            children = {k[len(Prefix) :].split(Delimiter)[0] for k in keys}
+            yield {"CommonPrefixes": [{"Prefix": f"{Prefix}{c}/"} for c in children]}
+            return
+
+        if Prefix.startswith(self.failing_prefix or "/"):
+            raise RuntimeError(f"Failed to list {Prefix}")
+
+        for start in range(0, len(keys), self.page_size):
+            self.pages_listed += 1
+            yield {
+                "Contents": [
+                    {"Key": key, "Size": len(key), "LastModified": LAST_MODIFIED}
+                    for key in keys[start : start + self.page_size]
+                ]
+            }
+
+
+def summarize(catalogs):
+    return {
+        prefix: {
+            (h, s.hash, s.meta, s.archive, s.manifest_prefix)
+            for h, s in catalog.items()
+        }
+        for prefix, catalog in catalogs.items()
+    }
+
+
+@pytest.mark.parametrize("layout_version", [2, 3])
+def test_catalogs_match_listing(tmp_path, layout_version):
+    keys = KEYS[layout_version]
+    listing_path = str(tmp_path / "listing.txt")
+    with open(listing_path, "w") as f:
+        for key in keys:
+            f.write(f"2025-01-15 12:30:45 {len(key):>10} {key}\n")
+
+    if layout_version == 2:
+        cli_catalogs = spec_catalogs_from_listing_v2(listing_path)
+    else:
+        cli_catalogs = spec_catalogs_from_listing_v3(listing_path)
+
+    # From the keys alone, and from a native listing of the catalogs
+    objects = [(key, len(key), LAST_MODIFIED) for key in keys]
+    client = StubS3Client(keys)
+    listed = list_catalog_objects(BUCKET, REF, layout_version, client=client)
+
+    assert set(cli_catalogs) == set(MIRRORS)
+    for catalogs in [
+        spec_catalogs_from_objects(objects, layout_version),
+        spec_catalogs_from_objects(listed, layout_version),
+    ]:
+        assert summarize(catalogs) == summarize(cli_catalogs)
+
+    # The sizes of the objects are only known from a native listing
+    spec = spec_catalogs_from_objects(objects, layout_version)[f"{REF}/e4s"]["bbbb"]
+    assert spec.sizes == {key: len(key) for key in keys if "bbbb" in key}
+    assert spec.last_modified == LAST_MODIFIED
+
+
+def test_list_catalog_objects_excludes_stacks():
+    client = StubS3Client(KEYS[3])
+    objects = list_catalog_objects(BUCKET, REF, 3, exclude=["ml"], client=client)
+    assert set(spec_catalogs_from_objects(objects, 3)) == {REF, f"{REF}/e4s"}
+
+
+def test_list_catalog_objects_streams_pages():
+    keys = [key for h in range(100) for key in v3_keys(f"{REF}/e4s", f"{h:04}")]
+    client = StubS3Client(keys, page_size=1)
+
+    # Listing stays a bounded number of pages ahead of what's been consumed
+    objects = list_catalog_objects(BUCKET, REF, 3, parallel=1, client=client)
+    assert next(objects)[0] == keys[0]
+    assert client.pages_listed < 10
+
+    # And stops once nothing consumes the pages
+    objects.close()
+    assert client.pages_listed < 10
+
+
+def test_list_catalog_objects_raises_listing_errors():
+    client = StubS3Client(KEYS[3])
+    client.failing_prefix = f"{REF}/ml/"
+
+    with pytest.raises(RuntimeError, match="Failed to list"):
+        list(list_catalog_objects(BUCKET, REF, 3, client=client))
@@ -0,0 +1,218 @@
+"""Check the metrics pushed by publish and migrate, to a stand-in Pushgateway
+
+Both are run against stubbed out S3 listings, copies and index updates, with
+one spec which succeeds and one which fails, and the metrics they pushed are
+compared with those the dashboards and alerts expect.
+"""
+
+import http.server
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from pkg import migrate, publish
+from pkg.common import BuiltSpec
+from pkg.metrics import PUSHGATEWAY_ENV
+from pkg.migrate import MigrationResult
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+#: Metrics tracking the progress of the copy engine and signature verifier
+COPIER_SAMPLES = [
+    "protected_publish_copied_objects_total",
+    "protected_publish_copied_bytes_total",
+    "protected_publish_skipped_objects_total",
+    "protected_publish_skipped_bytes_total",
+    "protected_publish_failed_copies_total",
+    "protected_publish_throttled_requests_total",
+    "protected_publish_copy_concurrency_limit",
+]
+VERIFIER_SAMPLES = [
+    "protected_publish_verified_signatures_total",
+    "protected_publish_failed_signatures_total",
+]
+
+
+class _PushgatewayHandler(http.server.BaseHTTPRequestHandler):
+    def _push(self):
+        length = int(self.headers["Content-Length"])
+        self.server.pushes.append(
+            (self.command, self.path, self.rfile.read(length).decode())
+        )
+        self.send_response(200)
+        self.end_headers()
+
+    do_PUT = do_POST = _push
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pushgateway(monkeypatch):
+    """Serve a stand-in Pushgateway, which records every push made to it"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _PushgatewayHandler)
+    server.pushes = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv(PUSHGATEWAY_ENV, f"http://127.0.0.1:{server.server_port}")
+    yield server.pushes
+
+    server.shutdown()
+    server.server_close()
+
+
+def read_keys(*args) -> str:
+    with open(os.path.join(DATA_DIR, "keys.pub")) as f:
+        return f.read()
+
+
+def pushed_samples(body: str) -> dict:
+    """The samples of a push, keyed by name and labels"""
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(body)
+        for sample in family.samples
+    }
+
+
+def v2_spec(prefix: str, spec_hash: str, size: int) -> BuiltSpec:
+    built_spec = BuiltSpec(
+        hash=spec_hash,
+        prefix=prefix,
+        meta=f"{prefix}/build_cache/linux-zlib-1.3-{spec_hash}.spec.json.sig",
+        archive=f"{prefix}/build_cache/linux/zlib-1.3-{spec_hash}.spack",
+    )
+    built_spec.sizes = {built_spec.meta: size, built_spec.archive: size}
+    return built_spec
+
+
+def test_publish_metrics(monkeypatch, tmp_path, pushgateway):
+    catalogs = {
+        "develop": {},
+        "develop/e4s": {"aaaa": v2_spec("develop/e4s", "aaaa", 100)},
+        "develop/ml": {"bbbb": v2_spec("develop/ml", "bbbb", 200)},
+    }
+    monkeypatch.setattr(
+        publish, "spec_catalogs_from_s3", lambda *args, **kwargs: catalogs
+    )
+    monkeypatch.setattr(publish, "download_and_import_key", lambda *args: None)
+    monkeypatch.setattr(publish, "export_public_keys", read_keys)
+    monkeypatch.setattr(publish, "clone_spack", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        publish, "subprocess", SimpleNamespace(run=lambda *args, **kwargs: None)
+    )
+    monkeypatch.setattr(publish, "read_published_metadata", lambda *args: [])
+    monkeypatch.setattr(publish, "update_index", lambda *args: None)
+
+    # The spec from the "ml" stack fails to be published
+    def publish_missing_spec_v2(built_spec, *args):
+        return built_spec.stack == "e4s", f"{built_spec.hash} from {built_spec.stack}"
+
+    monkeypatch.setattr(publish, "publish_missing_spec_v2", publish_missing_spec_v2)
+
+    result = publish.publish("spack-binaries", "develop", [], workdir=str(tmp_path))
+    assert (result.missing, result.published) == (2, 1)
+
+    assert pushgateway
+    assert {(method, path) for method, path, _ in pushgateway} == {
+        ("PUT", "/metrics/job/protected-publish")
+    }
+
+    samples = pushed_samples(pushgateway[-1][2])
+    for phase in ["listing", "catalog", "copy", "index"]:
+        labels = (("phase", phase), ("ref", "develop"))
+        assert ("protected_publish_phase_duration_seconds", labels) in samples
+        assert samples[("protected_publish_phase_in_progress", labels)] == 0
+
+    for stack, published, published_bytes, failed in [
+        ("e4s", 1, 200, 0),
+        ("ml", 0, 0, 1),
+    ]:
+        labels = (("ref", "develop"), ("stack", stack))
+        assert samples[("protected_publish_specs_missing", labels)] == 1
+        assert (
+            samples.get(("protected_publish_specs_published_total", labels), 0)
+            == published
+        )
+        assert samples.get(("protected_publish_published_bytes_total", labels), 0) == (
+            published_bytes
+        )
+        assert (
+            samples.get(("protected_publish_specs_failed_total", labels), 0) == failed
+        )
+
+    for name in COPIER_SAMPLES + VERIFIER_SAMPLES:
+        assert (name, ()) in samples
+    assert ("protected_publish_last_push_timestamp_seconds", ()) in samples
+
+
+def test_migrate_metrics(monkeypatch, tmp_path, pushgateway):
+    mirror_url = "s3://spack-binaries/develop/e4s"
+    catalogs = {
+        "develop/e4s": {
+            "aaaa": v2_spec("develop/e4s", "aaaa", 100),
+            "bbbb": v2_spec("develop/e4s", "bbbb", 200),
+        }
+    }
+    monkeypatch.setattr(migrate, "list_prefix_contents", lambda *args: None)
+    monkeypatch.setattr(
+        migrate, "spec_catalogs_from_listing_v2", lambda *args: catalogs
+    )
+    monkeypatch.setattr(migrate, "export_public_keys", read_keys)
+    monkeypatch.setattr(migrate, "migrate_keys", lambda *args: 0)
+    monkeypatch.setattr(migrate, "update_mirror_index", lambda **kwargs: None)
+
+    # The second spec fails to be migrated
+    def _migrate_spec(built_spec, *args):
+        if built_spec.hash == "bbbb":
+            raise RuntimeError("Failed to download the metadata")
+        return MigrationResult(True, "Migrated", {"spec": {"nodes": []}}, 110)
+
+    monkeypatch.setattr(migrate, "_migrate_spec", _migrate_spec)
+
+    migrate.migrate(mirror_url, str(tmp_path))
+
+    assert pushgateway
+    assert {(method, path) for method, path, _ in pushgateway} == {
+        ("PUT", "/metrics/job/migrate")
+    }
+
+    samples = pushed_samples(pushgateway[-1][2])
+    for phase in ["listing", "migrate", "keys", "index"]:
+        labels = (("phase", phase), ("ref", "develop"))
+        assert ("protected_publish_phase_duration_seconds", labels) in samples
+        assert samples[("protected_publish_phase_in_progress", labels)] == 0
+
+    labels = (("ref", "develop"), ("stack", "e4s"))
+    assert samples[("protected_publish_specs_missing", labels)] == 2
+    assert samples[("protected_publish_specs_published_total", labels)] == 1
+    assert samples[("protected_publish_published_bytes_total", labels)] == 110
+    assert samples[("protected_publish_specs_failed_total", labels)] == 1
+
+    # There's no copy engine when migrating
+    for name in VERIFIER_SAMPLES:
+        assert (name, ()) in samples
+    for name in COPIER_SAMPLES:
+        assert (name, ()) not in samples
+
+
+@pytest.mark.parametrize(
+    "mirror_prefix,ref,stack",
+    [
+        ("develop", "develop", ""),
+        ("develop/e4s", "develop", "e4s"),
+        ("releases/v0.23", "releases/v0.23", ""),
+        (
+            "releases/v0.23/ml-linux-x86_64-cuda",
+            "releases/v0.23",
+            "ml-linux-x86_64-cuda",
+        ),
+    ],
+)
+def test_migrate_labels(mirror_prefix, ref, stack):
+    assert migrate.ref_and_stack(mirror_prefix) == (ref, stack)
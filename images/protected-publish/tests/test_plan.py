@@ -0,0 +1,163 @@
+"""Check that publishing resumes an unfinished plan, from its journal
+
+Publishing is run against a stubbed out listing, copies and index update, with
+three specs missing from the root, and the workdir of the run kept between
+runs.
+"""
+
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from pkg import publish
+from pkg.common import BuiltSpec
+from pkg.plan import Journal, plan_entry, read_plan, write_plan
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+BUCKET = "spack-binaries"
+REF = "develop"
+
+
+def v2_spec(prefix: str, spec_hash: str) -> BuiltSpec:
+    return BuiltSpec(
+        hash=spec_hash,
+        prefix=prefix,
+        meta=f"{prefix}/build_cache/linux-zlib-1.3-{spec_hash}.spec.json.sig",
+        archive=f"{prefix}/build_cache/linux/zlib-1.3-{spec_hash}.spack",
+    )
+
+
+def read_keys(*args) -> str:
+    with open(os.path.join(DATA_DIR, "keys.pub")) as f:
+        return f.read()
+
+
+class StubPublish:
+    """Records the listings made and the specs published, which can be made to fail"""
+
+    def __init__(self):
+        self.listings = 0
+        self.published = []
+        self.failing = set()
+        self.interrupt_index = False
+
+    def spec_catalogs_from_s3(self, *args, **kwargs):
+        self.listings += 1
+        return {
+            REF: {},
+            f"{REF}/e4s": {h: v2_spec(f"{REF}/e4s", h) for h in ["aaaa", "bbbb"]},
+            f"{REF}/ml": {"cccc": v2_spec(f"{REF}/ml", "cccc")},
+        }
+
+    def publish_missing_spec_v2(self, built_spec, *args):
+        if built_spec.hash in self.failing:
+            return False, f"Failed to publish {built_spec.hash}"
+        self.published.append(built_spec.hash)
+        return True, f"Published {built_spec.hash}"
+
+    def run(self, *args, **kwargs):
+        if self.interrupt_index:
+            raise KeyboardInterrupt()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubPublish()
+    monkeypatch.setattr(publish, "spec_catalogs_from_s3", stub.spec_catalogs_from_s3)
+    monkeypatch.setattr(
+        publish, "publish_missing_spec_v2", stub.publish_missing_spec_v2
+    )
+    monkeypatch.setattr(publish, "subprocess", SimpleNamespace(run=stub.run))
+    monkeypatch.setattr(publish, "download_and_import_key", lambda *args: None)
+    monkeypatch.setattr(publish, "export_public_keys", read_keys)
+    monkeypatch.setattr(publish, "clone_spack", lambda *args, **kwargs: None)
+    monkeypatch.setattr(publish, "read_published_metadata", lambda *args: [])
+    monkeypatch.setattr(publish, "update_index", lambda *args: None)
+    return stub
+
+
+def run_publish(workdir, force: bool = False) -> publish.PublishResult:
+    return publish.publish(BUCKET, REF, [], force=force, workdir=str(workdir))
+
+
+def journal_lines(workdir) -> list:
+    with open(os.path.join(workdir, "plan.journal")) as f:
+        return f.readlines()
+
+
+def test_journal_ignores_partial_line(tmp_path):
+    path = str(tmp_path / "plan.journal")
+    with open(path, "w") as f:
+        f.write('{"published": "aaaa"}\n{"published": "bbbb"}\n{"published": "cc')
+
+    with Journal(path) as journal:
+        assert journal.published == {"aaaa", "bbbb"}
+        assert not journal.complete
+        journal.record_published("cccc")
+
+    # The partial line is left alone, rather than appended to
+    with Journal(path) as journal:
+        assert journal.published == {"aaaa", "bbbb", "cccc"}
+
+
+def test_rerun_publishes_only_unjournaled_specs(stub, tmp_path):
+    # The first run stops before updating the index, with one spec unpublished
+    stub.failing = {"cccc"}
+    stub.interrupt_index = True
+    with pytest.raises(KeyboardInterrupt):
+        run_publish(tmp_path)
+    assert sorted(stub.published) == ["aaaa", "bbbb"]
+
+    # The rerun resumes from the plan, without listing the bucket again
+    stub.failing = set()
+    stub.interrupt_index = False
+    result = run_publish(tmp_path)
+    assert stub.listings == 1
+    assert sorted(stub.published) == ["aaaa", "bbbb", "cccc"]
+    assert (result.missing, result.published, result.index) == (3, 3, "incremental")
+
+
+def test_completed_journal_starts_new_plan(stub, tmp_path):
+    run_publish(tmp_path)
+    assert len(journal_lines(tmp_path)) == 4
+
+    # The previous journal is replaced along with the plan
+    run_publish(tmp_path)
+    assert stub.listings == 2
+    assert stub.published.count("aaaa") == 2
+    assert len(journal_lines(tmp_path)) == 4
+
+
+def test_force_discards_plan(stub, tmp_path):
+    stub.interrupt_index = True
+    with pytest.raises(KeyboardInterrupt):
+        run_publish(tmp_path)
+
+    stub.interrupt_index = False
+    run_publish(tmp_path, force=True)
+    assert stub.listings == 2
+    assert sorted(stub.published) == ["aaaa", "aaaa", "bbbb", "bbbb", "cccc", "cccc"]
+    assert len(journal_lines(tmp_path)) == 4
+
+
+@pytest.mark.parametrize(
+    "mirror",
+    [
+        pytest.param({"bucket": "spack-binaries-prs"}, id="bucket"),
+        pytest.param({"ref": "releases/v0.23"}, id="ref"),
+        pytest.param({"layout_version": 3}, id="layout"),
+    ],
+)
+def test_plan_for_other_mirror_ignored(stub, tmp_path, mirror):
+    plan_path = str(tmp_path / "plan.json")
+    plan_mirror = {"bucket": BUCKET, "ref": REF, "layout_version": 2, **mirror}
+    entries = [plan_entry(v2_spec(f"{REF}/e4s", "dddd"), [])]
+    write_plan(plan_path, entries=entries, **plan_mirror)
+    assert read_plan(plan_path, **plan_mirror) is not None
+
+    run_publish(tmp_path)
+    assert stub.listings == 1
+    assert "dddd" not in stub.published
+    assert read_plan(plan_path, BUCKET, REF, 2) is not None
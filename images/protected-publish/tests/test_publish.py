@@ -0,0 +1,107 @@
+"""Check publishing v3 specs, whose content-addressed blobs are shared
+
+The copy engine is replaced by a stub, holding the keys already at the top
+level, which records the copies made and the copies skipped.
+"""
+
+import threading
+
+import pytest
+
+from pkg.common import BuiltSpec
+from pkg.publish import publish_specs_v3
+
+BUCKET = "spack-binaries"
+REF = "develop"
+
+
+def blob_key(stack: str, checksum: str) -> str:
+    return f"{REF}/{stack}/blobs/sha256/{checksum[:2]}/{checksum}"
+
+
+def v3_spec(spec_hash: str, stack: str, archive: str, meta: str) -> BuiltSpec:
+    manifest = f"zlib/zlib-1.3-{spec_hash}.spec.manifest.json"
+    built_spec = BuiltSpec(
+        hash=spec_hash,
+        stack=stack,
+        archive=blob_key(stack, archive),
+        meta=blob_key(stack, meta),
+        manifest_prefix=f"{REF}/{stack}/v3/manifests/spec/{manifest}",
+    )
+    built_spec.sizes = {
+        built_spec.archive: 1000,
+        built_spec.meta: 10,
+        built_spec.manifest_prefix: 1,
+    }
+    return built_spec
+
+
+class StubCopier:
+    max_concurrency = 4
+
+    def __init__(self, existing, failing):
+        self.existing = set(existing)
+        self.failing = set(failing)
+        self.copies = []
+        self.skipped_sizes = []
+        self._lock = threading.Lock()
+
+    def exists(self, bucket, key):
+        return key in self.existing
+
+    def copy(self, bucket, src_key, dest_key, size=None):
+        if src_key in self.failing:
+            raise RuntimeError("Access Denied")
+        with self._lock:
+            self.copies.append(dest_key)
+
+    def skipped(self, size):
+        with self._lock:
+            self.skipped_sizes.append(size)
+
+
+@pytest.fixture
+def built_specs():
+    return [
+        # The archive of a spec built in two stacks
+        v3_spec("aaaa", "e4s", archive="a1", meta="a2"),
+        v3_spec("bbbb", "ml", archive="a1", meta="b2"),
+        # An archive already at the top level
+        v3_spec("cccc", "ml", archive="c1", meta="c2"),
+        # An archive which fails to be copied, shared by a spec in another stack
+        v3_spec("dddd", "e4s", archive="d1", meta="d2"),
+        v3_spec("eeee", "ml", archive="d1", meta="e2"),
+    ]
+
+
+def test_publish_specs_v3(built_specs):
+    copier = StubCopier(
+        existing=[f"{REF}/blobs/sha256/c1/c1"], failing=[blob_key("e4s", "d1")]
+    )
+    published = []
+    result = publish_specs_v3(
+        built_specs, BUCKET, REF, copier, on_published=published.append
+    )
+
+    assert sorted(s.hash for s in result) == ["aaaa", "bbbb", "cccc"]
+    assert sorted(s.hash for s in published) == ["aaaa", "bbbb", "cccc"]
+
+    # Each blob is copied once, and the specs depending on the failed blob don't
+    # have their manifests copied
+    blob_copies = [key for key in copier.copies if "/blobs/" in key]
+    manifest_copies = [key for key in copier.copies if "/manifests/" in key]
+    assert sorted(blob_copies) == [
+        f"{REF}/blobs/sha256/{checksum[:2]}/{checksum}"
+        for checksum in ["a1", "a2", "b2", "c2", "d2", "e2"]
+    ]
+    assert sorted(manifest_copies) == [
+        f"{REF}/v3/manifests/spec/zlib/zlib-1.3-{h}.spec.manifest.json"
+        for h in ["aaaa", "bbbb", "cccc"]
+    ]
+
+    # All blobs are in place before any manifest refers to them
+    assert copier.copies[: len(blob_copies)] == blob_copies
+
+    # The duplicate of the shared archive and the one at the top level are
+    # skipped, but not the duplicate of the one that failed
+    assert sorted(copier.skipped_sizes) == [1000, 1000]
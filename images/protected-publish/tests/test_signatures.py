@@ -0,0 +1,94 @@
+"""Check the verdicts of SignatureVerifier against those of ``gpg --verify``
+
+The fixtures in data/ are a clearsigned spec metadata file, signed by:
+
+    good-rsa, tampered      an RSA key (the body of "tampered" was then edited)
+    good-eddsa              an Ed25519 key
+    revoked                 an RSA key, revoked after signing
+    unknown-signer          an RSA key which is not in keys.pub
+
+along with the same metadata, unsigned.  keys.pub holds the public keys of the
+RSA, Ed25519 and revoked signers (including the revocation).
+"""
+
+import os
+import shutil
+import subprocess
+import warnings
+
+import pytest
+
+from pkg.signatures import SignatureVerifier
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+#: Each fixture, and whether it should be verified
+FIXTURES = [
+    ("good-rsa.spec.json.sig", True),
+    ("good-eddsa.spec.json.sig", True),
+    ("tampered.spec.json.sig", False),
+    ("unsigned.spec.json", False),
+    ("unknown-signer.spec.json.sig", False),
+    # gpg only warns that the key has been revoked
+    ("revoked.spec.json.sig", True),
+]
+
+requires_gpg = pytest.mark.skipif(shutil.which("gpg") is None, reason="gpg is not available")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return f.read()
+
+
+@pytest.fixture(scope="module")
+def verifier():
+    return SignatureVerifier(read_fixture("keys.pub"))
+
+
+@pytest.fixture(scope="module")
+def gpg_home(tmp_path_factory):
+    home = tmp_path_factory.mktemp("gnupg")
+    os.chmod(home, 0o700)
+    subprocess.run(
+        ["gpg", "--no-tty", "--batch", "--import", os.path.join(DATA_DIR, "keys.pub")],
+        env={**os.environ, "GNUPGHOME": str(home)},
+        check=True,
+        capture_output=True,
+    )
+    return str(home)
+
+
+def gpg_verify(gpg_home: str, name: str) -> bool:
+    result = subprocess.run(
+        ["gpg", "--no-tty", "--batch", "--verify", os.path.join(DATA_DIR, name)],
+        env={**os.environ, "GNUPGHOME": gpg_home},
+        capture_output=True,
+    )
+    return result.returncode == 0
+
+
+@requires_gpg
+@pytest.mark.parametrize("name,expected", FIXTURES)
+def test_verdict_matches_gpg(verifier, gpg_home, name, expected):
+    assert gpg_verify(gpg_home, name) == expected
+
+    result = verifier.verify(read_fixture(name))
+    assert result.verified == expected, result.message
+    if expected:
+        assert result.message.strip() == read_fixture("unsigned.spec.json").strip()
+
+
+def test_verify_all():
+    verifier = SignatureVerifier(read_fixture("keys.pub"))
+    items = {name: read_fixture(name) for name, _ in FIXTURES}
+    results = verifier.verify_all(items, processes=2)
+
+    assert {name: r.verified for name, r in results.items()} == dict(FIXTURES)
+    assert (verifier.verified_count, verifier.failed_count) == (3, 3)
+
+
+def test_no_pgpy_warnings(verifier):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert verifier.verify(read_fixture("good-rsa.spec.json.sig")).verified
@@ -53,10 +53,36 @@ class JobLogScraper(object):
 
     def __init__(self, token,
                  session_name='error_log',
-                 out_dir='error_logs'):
+                 out_dir='error_logs',
+                 trace_store=None):
         self.session = requests_cache.CachedSession(session_name)
         self.out_dir = out_dir
         self.token = token
+        self.trace_store = trace_store
+
+    def read_trace_store(self, job_id):
+        """Read a job log from the analytics trace store, if it's been stored.
+
+        The store holds zstd compressed logs at <job_id>/<sha256>.log.zst
+
+        """
+        paths = sorted(glob.glob(f'{self.trace_store}/{job_id}/*.log.zst'))
+        if not paths:
+            return None
+
+        import zstandard
+        with open(paths[0], 'rb') as f:
+            return zstandard.decompress(f.read()).decode()
+
+    def write_trace_store(self, job_id, text):
+        import hashlib
+        import zstandard
+
+        data = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        os.makedirs(f'{self.trace_store}/{job_id}', exist_ok=True)
+        with open(f'{self.trace_store}/{job_id}/{digest}.log.zst', 'wb') as f:
+            f.write(zstandard.compress(data, 10))
 
     def scrape(self, api_link):
         logging.debug(f'Getting {api_link}')
@@ -67,14 +93,21 @@ class JobLogScraper(object):
 
         job_id = int(match.group('job_id'))
 
-        response = self.session.get(
-            api_link, headers={'PRIVATE-TOKEN': self.token})
+        text = None
+        if self.trace_store is not None:
+            text = self.read_trace_store(job_id)
 
-        text = response.text
+        if text is None:
+            response = self.session.get(
+                api_link, headers={'PRIVATE-TOKEN': self.token})
 
-        if response.status_code != 200:
-            logging.warning(f'Got {response.status_code} for {api_link}')
-            text = f'ERROR: Got {response.status_code} for {api_link}'
+            text = response.text
+
+            if response.status_code != 200:
+                logging.warning(f'Got {response.status_code} for {api_link}')
+                text = f'ERROR: Got {response.status_code} for {api_link}'
+            elif self.trace_store is not None:
+                self.write_trace_store(job_id, text)
 
         if text == '':
             logging.warning(f'Log File Empty {api_link}')
@@ -438,13 +471,18 @@ def cmd(log_level):
               help='Spack GitLab API Token (or API_TOKEN environment variable)')
 @click.option('-c', '--cache', default='error_log',
               help='Requests cache file name')
+@click.option('-s', '--trace-store', default=None,
+              type=click.Path(file_okay=False),
+              help="Analytics trace store directory to read logs from, "
+              "and save fetched logs to (requires zstandard).")
 @click.argument('error_csv', type=ErrorLogCSVType(mode='r'))
-def get_logs(error_csv, output, token, cache):
+def get_logs(error_csv, output, token, cache, trace_store):
     """Scrape Logs from Gitlab into a local directory.
 
     """
     os.makedirs(output, exist_ok=True)
-    scraper = JobLogScraper(token, session_name=cache, out_dir=output)
+    scraper = JobLogScraper(token, session_name=cache, out_dir=output,
+                            trace_store=trace_store)
     scraper.process_csv(error_csv)
 
 @cmd.command()